@@ -0,0 +1,460 @@
+"""
+Офлайн-бенчмарки гарячих шляхів бота:
+  matcher    - Bot_1.analyze_message_with_patterns на тисячах ключових слів та українських постах
+  crypto     - encrypt_data / decrypt_data на різних розмірах payload
+  user_store - load_users_db / add_user_to_db на 10k-1M користувачів
+  broadcast  - send_notification_to_users з фейковим ботом (черга + диспетчер + Broadcaster)
+
+Дані генеруються з фіксованим seed, тож запуски порівнянні між собою.
+Результати пишуться в JSON; --compare попередній.json показує зміни та повертає код 1,
+якщо якийсь бенчмарк повільніший за поріг --threshold.
+
+    python benchmark.py --quick
+    python benchmark.py --only matcher,crypto --output new.json --compare benchmark_results.json
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bot_1 import Bot_1
+from main import encrypt_data, decrypt_data
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_SEED = 20240601
+BENCHMARK_GROUPS = ('matcher', 'crypto', 'user_store', 'broadcast')
+
+SIZES = {
+    'matcher_keywords': (100, 1000, 5000),
+    'crypto_payload_bytes': (256, 4096, 65536, 1048576),
+    'user_store_users': (10_000, 100_000, 1_000_000),
+    'broadcast_recipients': (1000, 10_000),
+}
+QUICK_SIZES = {
+    'matcher_keywords': (100, 1000),
+    'crypto_payload_bytes': (256, 65536),
+    'user_store_users': (10_000, 100_000),
+    'broadcast_recipients': (1000,),
+}
+
+# Фрагменти типових постів новинних каналів (з апострофами, наголосами, посиланнями, латинськими двійниками)
+POST_SENTENCES = (
+    "Увага! У Києві та області оголошено повітряну тривогу.",
+    "Сили ППО збили ракети над Київщиною, інформація щодо наслідків уточнюється.",
+    "Зафіксовано рух ударних БпЛА з півночі в напрямку Чернігова.",
+    "Прохання не публікувати фото та відео роботи протиповітряної оборони.",
+    "Обстріл Харкова: пошкоджено об'єкт інфраструктури, є постраждалі.",
+    "Мер міста повідомив, що на лівому березі чути вибухи.",
+    "Відбій повітряної тривоги в Києві. Будьте уважні та бережіть себе.",
+    "Загроза застосування балістичного озброєння з півдня!",
+    "Детальніше за посиланням: https://t.me/news_channel/12345",
+    "Ворог атакує енергетичну інфраструктуру, можливі аварійні відключення світла.",
+    "Працюють рятувальники ДСНС, на місці влучання виникла пожежа.",
+    "Нагадуємо, пам'ятайте про правило двох стін і не нехтуйте сигналами тривоги.",
+    "Kиїв: на Оболоні пролунали вибухи, мешканцям радять залишатися в укриттях.",
+    "За даними Повітряних сил, частина крилатих ракет ще в повітрі.",
+    "Курс валют на сьогодні: долар подешевшав, євро без змін.",
+    "Погода: у столиці до +24°, без опадів, вітер помірний.",
+)
+SYLLABLES = (
+    "ка", "ра", "ки", "ло", "ні", "ве", "ст", "ко", "ми", "ро", "та", "па", "на", "ле", "ві",
+    "до", "зо", "ту", "бе", "гі", "ша", "чу", "жи", "фе", "ци", "ща", "ю", "я", "є", "ї",
+)
+ENDINGS = ("", "а", "и", "у", "ою", "ами", "ах", "ий", "ого", "ому", "і", "ів")
+MATCH_TEMPLATE = "Знайдено: {found_words}{channel_info}\n\n{message_preview}"
+
+
+def describe(samples):
+    """Статистика вибірки тривалостей (секунди) у мікросекундах"""
+    ordered = sorted(samples)
+    return {
+        "median_us": round(statistics.median(ordered) * 1e6, 3),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 3),
+        "min_us": round(ordered[0] * 1e6, 3),
+        "p90_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1e6, 3),
+        "samples": len(ordered),
+    }
+
+
+def time_calls(func, args_list, repeat):
+    """Час одного виклику func(*args) для кожного набору args, repeat проходів"""
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            started = time.perf_counter()
+            func(*args)
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def result(group, name, value, unit, **extra):
+    """Запис результату; value - основна метрика (менше - краще)"""
+    return {"group": group, "name": name, "value": value, "unit": unit, **extra}
+
+
+def bench_config(tmp_dir, **overrides):
+    return {
+        'Token': 'benchmark',
+        'TargetChats': '1001,1002',
+        'UsersDbFile': os.path.join(tmp_dir, 'users.db'),
+        'OutboundDbFile': os.path.join(tmp_dir, 'outbound.db'),
+        **overrides,
+    }
+
+
+def make_bot(config_data):
+    bot = Bot_1(config_data)
+    # Не підтягувати users_db.json з робочого каталогу
+    bot.user_store.legacy_json_path = None
+    return bot
+
+
+# --- matcher ---
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        stem_ = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        words.add(stem_ + rng.choice(ENDINGS))
+    return sorted(words)
+
+
+def make_posts(rng, vocabulary, count):
+    """Пости з 3-8 речень корпусу, розбавлені словами словника (частина постів спрацьовує на правила)"""
+    posts = []
+    for _ in range(count):
+        sentences = rng.sample(POST_SENTENCES, rng.randint(3, 8))
+        filler = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(5, 40)))
+        sentences.insert(rng.randrange(len(sentences) + 1), filler.capitalize() + '.')
+        posts.append(' '.join(sentences))
+    return posts
+
+
+def make_message_patterns(rng, vocabulary, keyword_count):
+    """
+    keyword_count ключових слів, розкладених по правилах any_of / all_of та виразах
+    з різними режимами збігу - так, як їх задають у кількох ключах MessagePatterns
+    """
+    keywords = rng.sample(vocabulary, keyword_count)
+    real_words = ["ракет", "київ", "тривог", "балістик", "вибух", "укриття"]
+    blocks = []
+    position = 0
+    rule_index = 0
+    while position < len(keywords):
+        kind = ('any_of', 'any_of', 'all_of')[rule_index % 3]
+        size = 2 if kind == 'all_of' else rng.randint(5, 20)
+        chunk = keywords[position:position + size]
+        position += size
+        if kind == 'all_of':
+            chunk.append(rng.choice(real_words))
+        blocks.append({
+            kind: {
+                "keywords": chunk,
+                "match": ('exact', 'prefix', 'stem')[rule_index // 3 % 3],
+                "priority": ('low', 'normal', 'high')[rule_index % 3],
+                "message": MATCH_TEMPLATE,
+            }
+        })
+        rule_index += 1
+    # Кілька реальних правил, що спрацьовують на корпус
+    blocks.append({
+        "all_of": {"keywords": ["ракет", "Київ"], "match": "prefix", "priority": "critical"},
+        "expressions": {
+            "балістика": {"expression": "балістичного OR (загроза NEAR/3 озброєння)", "match": "stem"},
+            "вибухи_київ": "вибух* AND (київ* OR оболон*) NOT навчання",
+        },
+    })
+    return blocks
+
+
+def bench_matcher(sizes, repeat, rng, tmp_dir):
+    results = []
+    vocabulary = make_vocabulary(rng, max(sizes) * 2)
+    posts = make_posts(rng, vocabulary, 200)
+    average_words = statistics.fmean(len(post.split()) for post in posts)
+
+    for keyword_count in sizes:
+        patterns = make_message_patterns(rng, vocabulary, keyword_count)
+        started = time.perf_counter()
+        bot = make_bot(bench_config(tmp_dir, MessagePatterns=patterns))
+        build_seconds = time.perf_counter() - started
+
+        args_list = [(post, '1001') for post in posts]
+        matched = sum(1 for post, channel_id in args_list if bot.analyze_message_with_patterns(post, channel_id)[1])
+        samples = time_calls(bot.analyze_message_with_patterns, args_list, repeat)
+        stats = describe(samples)
+        results.append(result(
+            'matcher', f"analyze_message_with_patterns/keywords={keyword_count}", stats['median_us'], 'us/post',
+            keywords=bot.pattern_matcher.keyword_count, rules=len(bot.message_patterns),
+            posts=len(posts), avg_words_per_post=round(average_words, 1), matched_posts=matched,
+            build_ms=round(build_seconds * 1000, 3), **stats
+        ))
+    return results
+
+
+# --- crypto ---
+
+def make_payload(rng, size):
+    """JSON-payload приблизно size байтів: конфіг з ключами та список користувачів, як у шифрованих ендпоінтах"""
+    payload = {"config": {"TargetChats": "1001,1002", "MessagePatterns": []}, "users": []}
+    user_bytes = len(json.dumps({"id": 10 ** 9, "name": "Користувач", "enabled": True})) + 2
+    for index in range(max(1, (size - len(json.dumps(payload))) // user_bytes)):
+        payload["users"].append({"id": rng.randint(10 ** 8, 10 ** 10), "name": "Користувач", "enabled": True})
+        if index % 50 == 49:
+            payload["config"]["MessagePatterns"].append({"any_of": {"keywords": ["ракет", "тривог", "вибух"]}})
+    return payload
+
+
+def bench_crypto(sizes, repeat, rng, tmp_dir):
+    results = []
+    encryption_key = ''.join(rng.choice('0123456789abcdef') for _ in range(64))
+    for size in sizes:
+        payload = make_payload(rng, size)
+        # Великі payload - менше повторів, щоб загальний час був співмірним
+        calls = max(3, min(200, int(2_000_000 / size)))
+        token = encrypt_data(payload, encryption_key)
+        assert decrypt_data(token, encryption_key) == payload
+
+        for operation, func, argument in (("encrypt_data", encrypt_data, payload),
+                                          ("decrypt_data", decrypt_data, token)):
+            samples = time_calls(func, [(argument, encryption_key)] * calls, repeat)
+            stats = describe(samples)
+            results.append(result(
+                'crypto', f"{operation}/bytes={size}", stats['median_us'], 'us/call',
+                payload_bytes=len(json.dumps(payload)), token_bytes=len(token),
+                mb_per_second=round(size / (stats['median_us'] / 1e6) / 1e6, 2), **stats
+            ))
+    return results
+
+
+# --- user_store ---
+
+async def _bench_user_store_size(users, tmp_dir, rng):
+    db_dir = tempfile.mkdtemp(dir=tmp_dir)
+    config_data = bench_config(db_dir)
+    user_ids = rng.sample(range(10 ** 8, 10 ** 10), users + 1000)
+    existing, new_users = user_ids[:users], user_ids[users:]
+
+    # Наповнення бази через add_user_to_db + пакетний запис
+    bot = make_bot(config_data)
+    bot.load_users_db()
+    started = time.perf_counter()
+    for user_id in existing:
+        bot.add_user_to_db(user_id)
+    fill_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    await bot.user_store.flush()
+    flush_seconds = time.perf_counter() - started
+    await bot.user_store.close()
+
+    # Холодний старт: перше load_users_db відкриває базу і читає всіх користувачів
+    bot = make_bot(config_data)
+    started = time.perf_counter()
+    snapshot = bot.load_users_db()
+    cold_load_seconds = time.perf_counter() - started
+    assert len(snapshot["users"]) == users
+
+    warm_samples = time_calls(bot.load_users_db, [()] * 5, 1)
+    add_samples = time_calls(bot.add_user_to_db, [(user_id,) for user_id in new_users], 1)
+    duplicate_samples = time_calls(bot.add_user_to_db, [(user_id,) for user_id in existing[:1000]], 1)
+    started = time.perf_counter()
+    await bot.user_store.flush()
+    incremental_flush_seconds = time.perf_counter() - started
+    await bot.user_store.close()
+
+    db_bytes = sum(
+        os.path.getsize(os.path.join(db_dir, name)) for name in os.listdir(db_dir) if name.startswith('users.db')
+    )
+    add_stats = describe(add_samples)
+    return [
+        result('user_store', f"load_users_db/cold/users={users}", round(cold_load_seconds * 1000, 3), 'ms',
+               db_bytes=db_bytes),
+        result('user_store', f"load_users_db/warm/users={users}",
+               round(statistics.median(warm_samples) * 1000, 3), 'ms'),
+        result('user_store', f"add_user_to_db/new/users={users}", add_stats['median_us'], 'us/call', **add_stats),
+        result('user_store', f"add_user_to_db/existing/users={users}",
+               describe(duplicate_samples)['median_us'], 'us/call'),
+        result('user_store', f"fill/users={users}", round(fill_seconds * 1000, 3), 'ms',
+               per_user_us=round(fill_seconds / users * 1e6, 3)),
+        result('user_store', f"flush/full/users={users}", round(flush_seconds * 1000, 3), 'ms'),
+        result('user_store', f"flush/1000_new/users={users}", round(incremental_flush_seconds * 1000, 3), 'ms'),
+    ]
+
+
+def bench_user_store(sizes, repeat, rng, tmp_dir):
+    results = []
+    for users in sizes:
+        results.extend(asyncio.run(_bench_user_store_size(users, tmp_dir, rng)))
+    return results
+
+
+# --- broadcast ---
+
+class FakeBot:
+    """Замість Bot API: send_message лише чекає latency секунд і рахує відправлення"""
+
+    def __init__(self, expected, latency=0.0):
+        self.expected = expected
+        self.latency = latency
+        self.sent = 0
+        self.done = asyncio.Event()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        if self.sent >= self.expected:
+            self.done.set()
+        return SimpleNamespace(message_id=self.sent, chat_id=chat_id)
+
+
+async def _bench_broadcast_size(recipients, latency, tmp_dir, rng):
+    db_dir = tempfile.mkdtemp(dir=tmp_dir)
+    # Ліміти Bot API вимкнені: вимірюється власна пропускна здатність черги, диспетчера та Broadcaster
+    bot = make_bot(bench_config(
+        db_dir, BroadcastRatePerSecond=0, PerChatInterval=0, BroadcastConcurrency=30
+    ))
+    await bot.outbound_queue.open()
+    fake_bot = FakeBot(recipients, latency)
+    app = SimpleNamespace(bot=fake_bot)
+    user_ids = rng.sample(range(10 ** 8, 10 ** 10), recipients)
+
+    try:
+        started = time.perf_counter()
+        enqueued = await bot.send_notification_to_users(app, "Тестове сповіщення", recipients=user_ids)
+        enqueue_seconds = time.perf_counter() - started
+        await asyncio.wait_for(fake_bot.done.wait(), timeout=600)
+        total_seconds = time.perf_counter() - started
+    finally:
+        if bot.dispatcher:
+            await bot.dispatcher.stop()
+        await bot.outbound_queue.close()
+
+    assert enqueued == recipients
+    return result(
+        'broadcast', f"send_notification_to_users/latency_ms={int(latency * 1000)}/recipients={recipients}",
+        round(total_seconds / recipients * 1e6, 3), 'us/recipient',
+        enqueue_ms=round(enqueue_seconds * 1000, 3), total_ms=round(total_seconds * 1000, 3),
+        messages_per_second=round(recipients / total_seconds, 1), sent=fake_bot.sent
+    )
+
+
+def bench_broadcast(sizes, repeat, rng, tmp_dir):
+    results = []
+    for recipients in sizes:
+        for latency in (0.0, 0.02):
+            results.append(asyncio.run(_bench_broadcast_size(recipients, latency, tmp_dir, rng)))
+    return results
+
+
+BENCHMARKS = {
+    'matcher': (bench_matcher, 'matcher_keywords'),
+    'crypto': (bench_crypto, 'crypto_payload_bytes'),
+    'user_store': (bench_user_store, 'user_store_users'),
+    'broadcast': (bench_broadcast, 'broadcast_recipients'),
+}
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_results(current, previous_path, threshold):
+    """Порівнює value з попереднім запуском; повертає список регресій"""
+    with open(previous_path, encoding='utf-8') as file:
+        previous = {entry["name"]: entry for entry in json.load(file).get("results", [])}
+
+    regressions = []
+    print(f"\nПорівняння з {previous_path} (поріг {threshold:.0%}):")
+    for entry in current:
+        old = previous.get(entry["name"])
+        if old is None or not old.get("value") or old.get("unit") != entry["unit"]:
+            continue
+        change = entry["value"] / old["value"] - 1
+        marker = ""
+        if change > threshold:
+            marker = "  РЕГРЕСІЯ"
+            regressions.append(entry["name"])
+        elif change < -threshold:
+            marker = "  покращення"
+        print(f"  {entry['name']:<65} {old['value']:>12} -> {entry['value']:>12} {entry['unit']:<13}"
+              f"{change:+.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки гарячих шляхів бота")
+    parser.add_argument("--only", default=','.join(BENCHMARK_GROUPS),
+                        help=f"групи через кому: {', '.join(BENCHMARK_GROUPS)}")
+    parser.add_argument("--quick", action="store_true", help="менші розміри (без 1M користувачів)")
+    parser.add_argument("--repeat", type=int, default=5, help="проходів для мікробенчмарків")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="файл JSON з результатами")
+    parser.add_argument("--compare", help="JSON попереднього запуску для порівняння")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустиме уповільнення (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    groups = [group.strip() for group in args.only.split(',') if group.strip()]
+    unknown = [group for group in groups if group not in BENCHMARKS]
+    if unknown:
+        parser.error(f"невідомі групи: {', '.join(unknown)}")
+
+    # Логи бота (завантаження бази, пакети черги) не потрібні у виводі бенчмарку
+    logging.disable(logging.INFO)
+    sizes = QUICK_SIZES if args.quick else SIZES
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp_dir:
+        for group in groups:
+            func, size_key = BENCHMARKS[group]
+            # Окремий генератор на групу: дані групи не залежать від того, які групи запущено
+            rng = random.Random(f"{args.seed}:{group}")
+            started = time.perf_counter()
+            group_results = func(sizes[size_key], args.repeat, rng, tmp_dir)
+            print(f"[{group}] {time.perf_counter() - started:.1f} с")
+            for entry in group_results:
+                print(f"  {entry['name']:<65} {entry['value']:>12} {entry['unit']}")
+            results.extend(group_results)
+
+    report = {
+        "environment": environment_info(),
+        "parameters": {"groups": groups, "quick": args.quick, "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+    regressions = compare_results(results, args.compare, args.threshold) if args.compare else []
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультати збережено в {args.output}")
+
+    if regressions:
+        print(f"Регресії: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,83 +1,215 @@
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.request import HTTPXRequest
+from collections import Counter
 import asyncio
+import hashlib
 import logging
-import json
-import os
-import re
+import uuid
 from pathlib import Path
 
-from telegram_module import get_messages_from_all_channels, get_last_channel_message
+from telegram_module import (
+    MEDIA_MESSAGE_PLACEHOLDER,
+    get_messages_from_all_channels,
+    register_channel_handlers,
+    unregister_channel_handlers,
+    is_telegram_client_connected,
+)
+from config_reader import ConfigSnapshot
+from pattern_matcher import DEFAULT_PRIORITY, PRIORITY_LEVELS, rule_priority
+from broadcast import Broadcaster
+from user_store import UserStore, USERS_STORE_FILE, message_words
+from outbound_queue import OutboundQueue, OutboundDispatcher, OUTBOUND_QUEUE_FILE
+from dedup import DuplicateCache
+from ua_text import tokenize
+from metrics import REGISTRY, ANALYZE_SECONDS, MATCHED_MESSAGES, NOTIFICATIONS_ENQUEUED
+from pipeline import Pipeline, PipelineStage
+from digest import DigestBuffer
+from tracing import TraceRecorder, parse_post_date
+from http_pool import PooledHTTPXRequest
+from poll_scheduler import PollScheduler
 
 logger = logging.getLogger(__name__)
 
 USERS_DB_FILE = "users_db.json"
+# Нижче за будь-який пріоритет правил: повідомлення про запуск не затримує сповіщення з каналів
+STARTUP_NOTICE_PRIORITY = min(PRIORITY_LEVELS.values()) - 1
 
 class Bot_1:
     def __init__(self, config_data):
         self.config_data = config_data
         self.token = config_data.get('Token')
-        self.message_patterns = config_data.get('MessagePatterns', {})
+        # Розібраний список каналів та скомпільовані патерни
+        self.snapshot = ConfigSnapshot(config_data)
+        self.message_patterns = self.snapshot.message_patterns
+        self.pattern_matcher = self.snapshot.pattern_matcher
         self.admin_chat_id = config_data.get('AdminChatId')
-        self.user_notifications = {}
         self.application = None
-        self.previous_messages = {}
+        self.bot_api_request = None
+        self.last_message_ids = {}
+        # Курсори отримання: випереджають last_message_ids на повідомлення, що ще в конвеєрі
+        self.fetched_message_ids = {}
+        # ID повідомлень кожного каналу, які ще не пройшли конвеєр (збережений курсор їх не перескакує)
+        self._pending_message_ids = {}
+        self.pipeline = None
         self.channel_names = {}
+        # Спільний для всіх розсилок стан лімітів Bot API (ліміти діють на токен бота)
+        self.broadcaster = Broadcaster.from_config(config_data)
+        self.user_store = UserStore(
+            db_path=config_data.get('UsersDbFile', USERS_STORE_FILE),
+            legacy_json_path=USERS_DB_FILE
+        )
+        self.outbound_queue = OutboundQueue(config_data.get('OutboundDbFile', OUTBOUND_QUEUE_FILE))
+        self.dispatcher = None
+        self.duplicate_cache = DuplicateCache.from_config(config_data)
+        self.push_mode = False
+        self._poll_requested = asyncio.Event()
+        # Розклад опитування каналів у poll-режимі
+        self.poll_scheduler = PollScheduler.from_config(config_data)
+        self.poll_scheduler.set_channels(self.snapshot.channel_ids)
+        self.digest = DigestBuffer.from_config(config_data)
+        self._digest_wakeup = asyncio.Event()
+        self._digest_task = None
+        # Трасування затримки від публікації поста до доставки сповіщення
+        self.traces = TraceRecorder()
+        self._trace_report_task = None
+        
+        # Значення, що зчитуються в момент збору метрик
+        REGISTRY.gauge("users_total", "Користувачі в базі").set_function(lambda: len(self.user_store))
+        REGISTRY.gauge("digest_buffered_users", "Користувачі з накопиченим дайджестом").set_function(
+            lambda: len(self.digest)
+        )
     
     def load_users_db(self):
-        if os.path.exists(USERS_DB_FILE):
-            with open(USERS_DB_FILE, 'r') as f:
-                return json.load(f)
-        return {"users": []}
-    
-    def save_users_db(self, users_db):
-        with open(USERS_DB_FILE, 'w') as f:
-            json.dump(users_db, f)
+        """Знімок бази користувачів у форматі {"users": [...]}"""
+        self.user_store.load()
+        return {"users": self.user_store.users()}
     
     def add_user_to_db(self, user_id):
-        users_db = self.load_users_db()
-        if user_id not in users_db["users"]:
-            users_db["users"].append(user_id)
-            self.save_users_db(users_db)
-    
-    async def send_notification_to_users(self, app, message):
-        """Надсилає повідомлення всім користувачам, які увімкнули сповіщення."""
-        users_db = self.load_users_db()
-        success_count = 0
-        fail_count = 0
-        
-        for user_id in users_db["users"]:
-            if self.user_notifications.get(user_id, True):
-                try:
-                    await app.bot.send_message(
-                        chat_id=user_id,
-                        text=message
-                    )
-                    success_count += 1
-                    logger.info(f"Повідомлення відправлено до {user_id}")
-                except Exception as e:
-                    fail_count += 1
-                    logger.warning(f"Не вдалося відправити повідомлення до {user_id}: {str(e)}")
-                    if "Chat not found" in str(e) or "bot was blocked" in str(e).lower():
-                        if user_id in users_db["users"]:
-                            users_db["users"].remove(user_id)
-                            self.save_users_db(users_db)
+        """Додає користувача в пам'ять; запис на диск виконується пакетно у фоні"""
+        self.user_store.load()
+        return self.user_store.add(user_id)
+    
+    def remove_users_from_db(self, user_ids):
+        """Видаляє недоступних користувачів з бази"""
+        if not user_ids:
+            return
+        removed = self.user_store.remove_many(user_ids)
+        logger.info(f"Видалено з бази недоступних користувачів: {removed}")
+    
+    def start_dispatcher(self, bot):
+        """Запускає фонового відправника черги сповіщень (один на бота)"""
+        if self.dispatcher is None:
+            self.dispatcher = OutboundDispatcher(
+                self.outbound_queue,
+                self.broadcaster,
+                bot,
+                on_unreachable=self.remove_users_from_db,
+                on_results=self.traces.delivered,
+                max_attempts=int(self.config_data.get('OutboundMaxAttempts', 5)),
+                retry_base_delay=float(self.config_data.get('OutboundRetryDelay', 30))
+            )
+        self.dispatcher.start()
+    
+    async def send_notification_to_users(self, app, message, message_key=None, priority=DEFAULT_PRIORITY,
+                                         recipients=None):
+        """
+        Ставить сповіщення в дискову чергу для recipients (за замовчуванням - для всіх користувачів,
+        які увімкнули сповіщення).
+        Відправку виконує OutboundDispatcher: записи з вищим priority йдуть першими і
+        перебивають уже розпочату розсилку нижчого пріоритету; повертає кількість нових записів у черзі
+        """
+        if message_key is None:
+            message_key = uuid.uuid4().hex
+        
+        self.start_dispatcher(app.bot)
+        if recipients is None:
+            recipients = self.user_store.enabled_users()
+        enqueued = await self.outbound_queue.enqueue(message_key, message, recipients, priority)
+        NOTIFICATIONS_ENQUEUED.inc(enqueued)
+        self.dispatcher.notify(priority)
         
-        logger.info(f"Відправлено повідомлень: {success_count}, невдало: {fail_count}")
-        return success_count, fail_count
+        logger.info(f"Сповіщення {message_key} поставлено в чергу для {enqueued} користувачів")
+        return enqueued
     
     async def turn_on(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        self.user_notifications[user_id] = True
-        self.add_user_to_db(user_id)
+        self.user_store.set_notifications(user_id, True)
         await update.message.reply_text("Сповіщення увімкнено!")
     
     async def turn_off(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        self.user_notifications[user_id] = False
-        self.add_user_to_db(user_id)
+        self.user_store.set_notifications(user_id, False)
         await update.message.reply_text("Сповіщення вимкнено!")
     
+    def _parse_subscription_args(self, args):
+        """Розбирає аргументи /subscribe та /unsubscribe на [(kind, value)] та список помилок"""
+        subscriptions, errors = [], []
+        for arg in args:
+            value = arg.strip().lstrip('#')
+            if value.lstrip('-').isdigit():
+                if value in self.snapshot.channel_ids:
+                    subscriptions.append(('channel', value))
+                else:
+                    errors.append(f"{value} - канал не відстежується (див. /channels)")
+            elif len(tokenize(value)) == 1:
+                subscriptions.append(('keyword', value))
+            else:
+                errors.append(f"{arg} - підписка можлива лише на окреме слово")
+        return subscriptions, errors
+    
+    async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Підписка на канали (за ID) та ключові слова: /subscribe <канал або слово> ..."""
+        user_id = update.effective_user.id
+        if not context.args:
+            await update.message.reply_text(
+                "Використання: /subscribe <ID каналу або слово> ...\n"
+                "Без підписок надходять усі сповіщення"
+            )
+            return
+        
+        subscriptions, errors = self._parse_subscription_args(context.args)
+        added = [value for kind, value in subscriptions if self.user_store.subscribe(user_id, kind, value)]
+        
+        response = f"Додано підписок: {len(added)}" + (f" ({', '.join(added)})" if added else "")
+        if errors:
+            response += "\n\nНе додано:\n" + "\n".join(errors)
+        await update.message.reply_text(response)
+    
+    async def unsubscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Скасування підписок: /unsubscribe <канал або слово> ... або /unsubscribe all"""
+        user_id = update.effective_user.id
+        if not context.args:
+            await update.message.reply_text("Використання: /unsubscribe <ID каналу або слово> ... або /unsubscribe all")
+            return
+        
+        if [arg.lower() for arg in context.args] == ['all']:
+            removed = self.user_store.clear_subscriptions(user_id)
+            await update.message.reply_text(f"Видалено всі підписки ({removed}). Надходитимуть усі сповіщення")
+            return
+        
+        subscriptions, errors = self._parse_subscription_args(context.args)
+        removed = [value for kind, value in subscriptions if self.user_store.unsubscribe(user_id, kind, value)]
+        
+        response = f"Видалено підписок: {len(removed)}" + (f" ({', '.join(removed)})" if removed else "")
+        if errors:
+            response += "\n\n" + "\n".join(errors)
+        await update.message.reply_text(response)
+    
+    async def list_subscriptions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показати підписки користувача"""
+        subscriptions = self.user_store.subscriptions(update.effective_user.id)
+        if not any(subscriptions.values()):
+            await update.message.reply_text("Підписок немає - надходять усі сповіщення")
+            return
+        
+        response = "Ваші підписки:\n"
+        if subscriptions['channel']:
+            response += "\nКанали: " + ", ".join(subscriptions['channel'])
+        if subscriptions['keyword']:
+            response += "\nСлова: " + ", ".join(subscriptions['keyword'])
+        await update.message.reply_text(response)
+    
     async def status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Endpoint to check if server is running"""
         await update.message.reply_text("Бот був перезапущений. Система працює у штатному режимі!")
@@ -85,12 +217,11 @@ class Bot_1:
     async def channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показати список відстежуваних каналів"""
         try:
-            target_chats = self.config_data.get('TargetChats', '')
-            if not target_chats:
+            channel_ids = self.snapshot.channel_ids
+            if not channel_ids:
                 await update.message.reply_text("Список каналів порожній")
                 return
             
-            channel_ids = [id_str.strip() for id_str in target_chats.split(',') if id_str.strip()]
             response = "Відстежувані канали:\n\n"
             
             for i, channel_id in enumerate(channel_ids, 1):
@@ -105,60 +236,42 @@ class Bot_1:
         user_id = update.effective_user.id
         self.add_user_to_db(user_id)
         
-        if self.user_notifications.get(user_id, True):
+        if self.user_store.notifications_enabled(user_id):
             await update.message.reply_text(f"Ти написав: {update.message.text}")
         else:
             await update.message.reply_text("Сповіщення вимкнено. Використай /on щоб увімкнути.")
     
     async def send_startup_message(self, app):
-        """Відправляє повідомлення про запуск всім користувачам"""
+        """
+        Ставить повідомлення про запуск у дискову чергу для користувачів, які не вимкнули сповіщення командою /off.
+        Розсилка йде з найнижчим пріоритетом (STARTUP_NOTICE_PRIORITY), тож сповіщення з каналів її перебивають,
+        а недоступних користувачів видаляє з бази OutboundDispatcher
+        """
         try:
-            users_db = self.load_users_db()
-            success_count = 0
-            fail_count = 0
-            
-            logger.info(f"Спроба відправити повідомлення про запуск {len(users_db['users'])} користувачам")
-            
-            for user_id in users_db["users"]:
-                try:
-                    await app.bot.send_message(
-                        chat_id=user_id,
-                        text="Бот був перезапущений. Система працює у штатному режимі!"
-                    )
-                    success_count += 1
-                    logger.info(f"Повідомлення про запуск відправлено до {user_id}")
-                except Exception as e:
-                    fail_count += 1
-                    error_msg = str(e).lower()
-                    logger.warning(f"Не вдалося відправити повідомлення до {user_id}: {error_msg}")
-                    
-                    # Видаляємо користувача з бази у випадку певних помилок
-                    if ("chat not found" in error_msg or 
-                        "bot was blocked" in error_msg or 
-                        "user is deactivated" in error_msg):
-                        if user_id in users_db["users"]:
-                            users_db["users"].remove(user_id)
-                            logger.info(f"Користувача {user_id} видалено з бази через помилку: {error_msg}")
+            self.user_store.load()
+            recipients = self.user_store.enabled_users()
             
-            # Зберігаємо оновлену базу тільки якщо були зміни
-            if fail_count > 0:
-                self.save_users_db(users_db)
+            logger.info(f"Повідомлення про запуск ставиться в чергу для {len(recipients)} користувачів")
             
-            logger.info(f"Повідомлення про запуск: успішно - {success_count}, невдало - {fail_count}")
+            enqueued = await self.send_notification_to_users(
+                app,
+                "Бот був перезапущений. Система працює у штатному режимі!",
+                f"startup:{uuid.uuid4().hex}",
+                priority=STARTUP_NOTICE_PRIORITY,
+                recipients=recipients
+            )
             
             # Відправляємо звіт адміну, якщо вказано в конфігурації
             if self.admin_chat_id:
                 try:
-                    target_chats = self.config_data.get('TargetChats', '')
-                    channel_count = len([id_str.strip() for id_str in target_chats.split(',') if id_str.strip()])
+                    channel_count = len(self.snapshot.channel_ids)
                     
                     await app.bot.send_message(
                         chat_id=self.admin_chat_id,
                         text=f"Бот запущений\n\n"
                              f"Статистика запуску:\n"
-                             f"•Користувачів: {len(users_db['users'])}\n"
-                             f"•Відправлено: {success_count}\n"
-                             f"•Невдало: {fail_count}\n"
+                             f"•Користувачів: {len(self.user_store)}\n"
+                             f"•Повідомлень про запуск у черзі: {enqueued}\n"
                              f"•Каналів: {channel_count}"
                     )
                 except Exception as e:
@@ -170,187 +283,587 @@ class Bot_1:
     def analyze_message_with_patterns(self, message_text, channel_id=None):
         """
         Аналізує повідомлення за заданими патернами
-        Повертає список знайдених відповідностей та відповідне повідомлення
+        Повертає список знайдених відповідностей, відповідне повідомлення та його пріоритет.
+        Шаблон береться з найпріоритетнішого спрацьованого правила (при рівності - з першого)
         """
         if not message_text or not self.message_patterns:
-            return [], None
+            return [], None, DEFAULT_PRIORITY
         
         results = []
         notification_message = None
+        notification_priority = DEFAULT_PRIORITY
         
         try:
             # Додаємо інформацію про канал до повідомлення
             channel_info = f" (канал {channel_id})" if channel_id else ""
+            message_preview = message_text[:300] + ('...' if len(message_text) > 300 else '')
+            selected = None
             
-            # Перевірка для any_of (будь-яке зі слів)
-            if 'any_of' in self.message_patterns:
-                pattern_config = self.message_patterns['any_of']
-                keywords = pattern_config.get('keywords', [])
-                found_words = []
-                
-                for word in keywords:
-                    if re.search(rf'\b{re.escape(word)}\b', message_text, re.IGNORECASE):
-                        found_words.append(word)
-                
-                if found_words:
-                    results.append(f"any_of: {found_words}")
-                    if not notification_message:  # Пріоритет першого знайденого патерну
-                        message_template = pattern_config.get('message', 'Знайдено слова: {found_words}')
-                        notification_message = message_template.format(
-                            found_words=', '.join(found_words),
-                            message_preview=message_text[:300] + ('...' if len(message_text) > 300 else ''),
-                            channel_info=channel_info
-                        )
-            
-            # Перевірка для all_of (всі слова)
-            if 'all_of' in self.message_patterns:
-                pattern_config = self.message_patterns['all_of']
-                keywords = pattern_config.get('keywords', [])
-                found_all = True
-                found_words = []
-                
-                for word in keywords:
-                    if re.search(rf'\b{re.escape(word)}\b', message_text, re.IGNORECASE):
-                        found_words.append(word)
-                    else:
-                        found_all = False
+            # Один прохід скомпільованого матчера по тексту для всіх блоків
+            for kind, pattern_config, found_words in self.pattern_matcher.match(message_text):
+                if kind == 'none_of':
+                    results.append(f"none_of: уникнуто {found_words}")
+                elif kind == 'expression':
+                    results.append(f"{pattern_config.get('name')}: {found_words}")
+                else:
+                    results.append(f"{kind}: {found_words}")
                 
-                if found_all and keywords:  # Перевіряємо, що список слів не порожній
-                    results.append(f"all_of: {found_words}")
-                    if not notification_message:
-                        message_template = pattern_config.get('message', 'Знайдено всі слова: {found_words}')
-                        notification_message = message_template.format(
-                            found_words=', '.join(found_words),
-                            message_preview=message_text[:300] + ('...' if len(message_text) > 300 else ''),
-                            channel_info=channel_info
-                        )
+                priority = rule_priority(pattern_config)
+                if selected is None or priority > selected[0]:
+                    selected = (priority, kind, pattern_config, found_words)
             
-            # Перевірка для none_of (жодного зі слів)
-            if 'none_of' in self.message_patterns:
-                pattern_config = self.message_patterns['none_of']
-                keywords = pattern_config.get('keywords', [])
-                found_any = False
-                avoided_words = []
-                
-                for word in keywords:
-                    if re.search(rf'\b{re.escape(word)}\b', message_text, re.IGNORECASE):
-                        found_any = True
-                        avoided_words.append(word)
-                
-                if not found_any and keywords:  # Жодного слова не знайдено і список не порожній
-                    results.append(f"none_of: уникнуто {keywords}")
-                    if not notification_message:
-                        message_template = pattern_config.get('message', 'Уникнуто слів: {avoided_words}')
-                        notification_message = message_template.format(
-                            avoided_words=', '.join(keywords),
-                            message_preview=message_text[:300] + ('...' if len(message_text) > 300 else ''),
-                            channel_info=channel_info
-                        )
+            if selected is not None:
+                notification_priority, kind, pattern_config, found_words = selected
+                if kind == 'none_of':
+                    message_template = pattern_config.get('message', 'Уникнуто слів: {avoided_words}')
+                    notification_message = message_template.format(
+                        avoided_words=', '.join(found_words),
+                        message_preview=message_preview,
+                        channel_info=channel_info
+                    )
+                else:
+                    default_template = {
+                        'any_of': 'Знайдено слова: {found_words}',
+                        'all_of': 'Знайдено всі слова: {found_words}',
+                        'expression': 'Спрацювало правило {rule_name}: {found_words}'
+                    }[kind]
+                    message_template = pattern_config.get('message', default_template)
+                    notification_message = message_template.format(
+                        found_words=', '.join(found_words),
+                        rule_name=pattern_config.get('name', kind),
+                        message_preview=message_preview,
+                        channel_info=channel_info
+                    )
         
         except Exception as e:
             logger.error(f"Помилка при аналізі повідомлення: {str(e)}")
         
-        return results, notification_message
+        return results, notification_message, notification_priority
     
-    async def check_channel_messages(self):
-        """Періодична перевірка всіх каналів та аналіз повідомлень за патернами"""
-        app = None
+    async def process_channel_result(self, channel_result):
+        """
+        Етап отримання: нові повідомлення каналу в хронологічному порядку передаються в конвеєр.
+        Курсор отримання оновлюється одразу, тож наступне опитування не бере повторно
+        повідомлення, які ще чекають аналізу в черзі. Збережений курсор оновлюється лише
+        в _complete_message, коли повідомлення вийшло з конвеєра
+        """
+        if not channel_result['success']:
+            logger.error(f"Помилка в каналі {channel_result.get('channel_id', 'невідомо')}: {channel_result.get('error')}")
+            return
         
+        channel_id = channel_result['channel_id']
+        for message in channel_result.get('messages', []):
+            message_id = message['id']
+            
+            # Перевіряємо за ID, чи повідомлення нове для цього каналу (редагування обробляємо повторно)
+            fetched_id = self.fetched_message_ids.get(channel_id)
+            if fetched_id is not None and message_id <= fetched_id and not message.get('edited'):
+                logger.debug(f"Повідомлення {message_id} в каналі {channel_id} вже оброблено, пропускаємо")
+                continue
+            
+            self._pending_message_ids.setdefault(channel_id, Counter())[message_id] += 1
+            if fetched_id is None or message_id > fetched_id:
+                self.fetched_message_ids[channel_id] = message_id
+            
+            # Для відредагованого поста затримка рахується від часу редагування
+            posted_at = parse_post_date(message.get('edit_date') or message.get('date'))
+            message['trace_id'] = self.traces.start(channel_id, message_id, posted_at)
+            await self.pipeline.submit((channel_id, message))
+    
+    def _complete_message(self, channel_id, message_id):
+        """
+        Повідомлення вийшло з конвеєра (відкинуте або вже в дисковій черзі чи дайджесті).
+        Збережений курсор каналу просувається лише до найменшого ID, що ще в конвеєрі,
+        тож після перезапуску чи збою незавершені повідомлення будуть отримані повторно
+        """
+        pending = self._pending_message_ids.get(channel_id)
+        if pending is not None:
+            pending[message_id] -= 1
+            if pending[message_id] <= 0:
+                del pending[message_id]
+        
+        safe_id = min(pending) - 1 if pending else self.fetched_message_ids.get(channel_id)
+        last_message_id = self.last_message_ids.get(channel_id)
+        if safe_id is not None and (last_message_id is None or safe_id > last_message_id):
+            self.last_message_ids[channel_id] = safe_id
+            self.user_store.set_cursor(channel_id, safe_id)
+    
+    async def match_channel_message(self, item):
+        """
+        Етап аналізу: перевірка дублікатів та патерни.
+        Повертає (channel_id, message_id, текст сповіщення, пріоритет, слова поста, trace_id,
+        канали, підписники яких уже отримали копію поста) для етапу відправки або None (повідомлення завершене)
+        """
+        channel_id, message = item
         try:
-            app = ApplicationBuilder().token(self.token).build()
-            await app.initialize()
-            await app.start()
-        except Exception as e:
-            logger.error(f"Помилка при ініціалізації app для check_channel_messages: {str(e)}")
+            result = await self._match_channel_message(channel_id, message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._complete_message(channel_id, message['id'])
+            raise
+        if result is None:
+            self._complete_message(channel_id, message['id'])
+        return result
+    
+    async def _match_channel_message(self, channel_id, message):
+        message_id = message['id']
+        current_message = message['message']
+        trace_id = message.get('trace_id')
+        
+        # Копії поста, вже обробленого з іншого каналу в межах вікна DedupWindowSeconds, потрібні лише
+        # підписникам нового каналу: решта одержувачів уже отримала сповіщення про першу копію.
+        # Медіа без тексту не порівнюються: заглушка однакова для всіх таких постів
+        notified_channels = frozenset()
+        duplicate = None
+        if current_message != MEDIA_MESSAGE_PLACEHOLDER:
+            duplicate = self.duplicate_cache.check(current_message, (channel_id, message_id), channel_id)
+        if duplicate is not None:
+            original, notified_channels = duplicate
+            if not self.user_store.has_channel_subscribers(channel_id):
+                logger.info(
+                    f"Пост {message_id} з каналу {channel_id} дублює {original[1]} з каналу {original[0]}, пропускаємо"
+                )
+                self.traces.discard(trace_id)
+                return None
+            logger.info(
+                f"Пост {message_id} з каналу {channel_id} дублює {original[1]} з каналу {original[0]}, "
+                f"сповіщаємо лише підписників каналу {channel_id}"
+            )
+        
+        # Аналізуємо повідомлення за патернами
+        with ANALYZE_SECONDS.time():
+            found_patterns, notification_message, priority = self.analyze_message_with_patterns(
+                current_message, channel_id
+            )
+        if notification_message:
+            MATCHED_MESSAGES.inc()
+        
+        print("\n" + "="*60)
+        print(f"Новий пост з каналу {channel_id} (довжина: {len(current_message)} символів):")
+        print("-"*60)
+        print(current_message[:500] + ("..." if len(current_message) > 500 else ""))
+        print("-"*60)
+        
+        if found_patterns:
+            print(f"Знайдені патерни: {', '.join(found_patterns)}")
+        else:
+            print("Патерни не знайдені")
+        print("="*60 + "\n")
+        
+        if not notification_message:
+            self.traces.discard(trace_id)
+            return None
+        self.traces.stamp(trace_id, 'matched')
+        return (
+            channel_id, message_id, notification_message, priority, message_words(current_message), trace_id,
+            notified_channels
+        )
+    
+    async def dispatch_notification(self, item):
+        """Етап відправки: вибір одержувачів за підписками та постановка сповіщення в дискову чергу"""
+        channel_id, message_id = item[0], item[1]
+        try:
+            held = await self._dispatch_notification(*item)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._complete_message(channel_id, message_id)
+            raise
+        # Пост у буфері дайджесту завершує flush_digests, коли дайджест уже в дисковій черзі
+        if not held:
+            self._complete_message(channel_id, message_id)
+    
+    async def _dispatch_notification(self, channel_id, message_id, notification_message, priority, words, trace_id,
+                                     notified_channels=()):
+        recipients = self.user_store.recipients(channel_id, words)
+        # Для копії поста - лише ті, хто не отримав сповіщення про копії з інших каналів
+        for notified_channel in notified_channels:
+            recipients -= self.user_store.recipients(notified_channel, words)
+        if not recipients:
+            self.traces.discard(trace_id)
+            logger.info(f"Пост {message_id} з каналу {channel_id}: нових одержувачів немає")
             return
         
-        check_interval = 300  # 5 хвилин між перевірками за замовчуванням
+        # У режимі дайджесту нетермінові сповіщення накопичуються і відправляються одним повідомленням
+        if self.digest_enabled() and priority < self.digest_bypass_priority():
+            self.digest.add(recipients, notification_message, priority, source=(channel_id, message_id))
+            self._digest_wakeup.set()
+            # Затримка дайджесту навмисна, тож у статистику часу доставки він не потрапляє
+            self.traces.discard(trace_id)
+            logger.info(f"Пост {message_id} з каналу {channel_id}: додано до дайджесту {len(recipients)} користувачів")
+            return True
+        
+        
+        # Ключ робить повторну постановку того ж поста ідемпотентною
+        text_hash = hashlib.sha1(notification_message.encode()).hexdigest()[:12]
+        message_key = f"{channel_id}:{message_id}:{text_hash}"
+        enqueued = await self.send_notification_to_users(
+            self.application, notification_message, message_key, priority=priority, recipients=recipients
+        )
+        self.traces.enqueued(trace_id, message_key, enqueued)
+        logger.info(f"Пост {message_id} з каналу {channel_id}: поставлено в чергу сповіщень {enqueued}")
+    
+    def digest_enabled(self):
+        return bool(self.config_data.get('DigestMode', False))
+    
+    def digest_bypass_priority(self):
+        """Сповіщення з пріоритетом від DigestBypassPriority відправляються одразу, минаючи дайджест"""
+        return rule_priority({"priority": self.config_data.get('DigestBypassPriority', 'high')})
+    
+    async def flush_digests(self, force=False):
+        """
+        Ставить у чергу готові дайджести (усі - при force); повертає кількість повідомлень.
+        Курсори каналів просуваються за пости з дайджестів лише після постановки всіх частин у дискову чергу
+        """
+        queued = 0
+        digests = self.digest.due(force=force)
+        released = self.digest.released_sources()
+        for texts, priority, user_ids in digests:
+            digest_hash = hashlib.sha1("\n".join(texts).encode()).hexdigest()[:12]
+            digest_id = uuid.uuid4().hex[:8]
+            for part, text in enumerate(self.digest.render(texts)):
+                await self.send_notification_to_users(
+                    self.application, text, f"digest:{digest_hash}:{digest_id}:{part}",
+                    priority=priority, recipients=user_ids
+                )
+                queued += 1
         
+        for channel_id, message_id in released:
+            self._complete_message(channel_id, message_id)
+        return queued
+    
+    async def digest_loop(self):
+        """Відправка дайджестів після закінчення вікна DigestWindowSeconds"""
         while True:
             try:
-                # Отримуємо повідомлення з усіх каналів
-                result = await get_messages_from_all_channels(self.config_data)
+                self._digest_wakeup.clear()
+                await self.flush_digests()
                 
-                if not result['success']:
-                    logger.error(f"Помилка отримання повідомлень: {result.get('error', 'Невідома помилка')}")
-                    await asyncio.sleep(check_interval)
+                timeout = self.digest.next_due_in()
+                try:
+                    await asyncio.wait_for(self._digest_wakeup.wait(), timeout=timeout if timeout is not None else 60)
+                except asyncio.TimeoutError:
+                    pass
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Помилка відправки дайджестів: {str(e)}")
+                await asyncio.sleep(5)
+    
+    def latency_stats(self):
+        """Перцентилі затримки від публікації поста до доставки"""
+        return self.traces.summary()
+    
+    async def trace_report_loop(self):
+        """Періодичний звіт про затримку сповіщень адміністратору (TraceReportInterval секунд, 0 - вимкнено)"""
+        while True:
+            interval = float(self.config_data.get('TraceReportInterval', 3600))
+            await asyncio.sleep(interval if interval > 0 else 60)
+            if interval <= 0 or not self.admin_chat_id or not self.traces.started:
+                continue
+            try:
+                await self.application.bot.send_message(chat_id=self.admin_chat_id, text=self.traces.format_report())
+            except Exception as e:
+                logger.error(f"Помилка при відправці звіту про затримку адміну: {str(e)}")
+    
+    def build_pipeline(self):
+        """
+        Конвеєр аналіз -> відправка з обмеженими чергами (PipelineQueueSize).
+        Опитування та push-обробники лише додають повідомлення в конвеєр,
+        тож повільна постановка сповіщень не затримує наступне опитування
+        """
+        queue_size = int(self.config_data.get('PipelineQueueSize', 1000))
+        pipeline = Pipeline([
+            PipelineStage(
+                "match",
+                self.match_channel_message,
+                workers=int(self.config_data.get('MatchWorkers', 1)),
+                maxsize=queue_size
+            ),
+            PipelineStage(
+                "dispatch",
+                self.dispatch_notification,
+                workers=int(self.config_data.get('DispatchWorkers', 2)),
+                maxsize=queue_size
+            ),
+        ])
+        
+        depth = REGISTRY.gauge("pipeline_queue_depth", "Глибина черг етапів конвеєра", ("stage",))
+        for stage in pipeline.stages:
+            depth.labels(stage.name).set_function(stage.queue.qsize)
+        return pipeline
+    
+    def delivery_stats(self):
+        """Час від постановки в чергу до доставки по кожному пріоритету"""
+        if self.dispatcher is None:
+            return None
+        return self.dispatcher.lane_stats()
+    
+    def digest_stats(self):
+        """Стан буфера дайджестів (None, якщо режим дайджесту вимкнено)"""
+        if not self.digest_enabled() and not len(self.digest):
+            return None
+        return self.digest.stats()
+    
+    def pipeline_stats(self):
+        """Глибина черг конвеєра (None, якщо відстеження каналів ще не запущене)"""
+        if self.pipeline is None:
+            return None
+        return self.pipeline.stats()
+    
+    async def on_channel_update(self, channel_result):
+        """Обробник push-оновлень з Telethon: повідомлення передаються в конвеєр"""
+        if self.pipeline is None:
+            return
+        
+        await self.process_channel_result(channel_result)
+    
+    def polling_stats(self):
+        """Розклад опитування каналів: інтервали, оцінки частоти публікацій, помилки"""
+        return self.poll_scheduler.stats()
+    
+    async def poll_channels(self, channel_ids=None, wait_flood=True):
+        """
+        Один прохід опитування каналів channel_ids (за замовчуванням - усіх).
+        wait_flood=False - канал з FloodWait не чекається всередині проходу, а відкладається PollScheduler
+        """
+        if channel_ids is None:
+            channel_ids = self.snapshot.channel_ids
+        
+        result = await get_messages_from_all_channels(
+            self.config_data,
+            self.fetched_message_ids,
+            channel_ids,
+            wait_flood=wait_flood
+        )
+        
+        if not result['success']:
+            logger.error(f"Помилка отримання повідомлень: {result.get('error', 'Невідома помилка')}")
+            for channel_id in channel_ids:
+                self.poll_scheduler.record_failure(channel_id, result.get('error'))
+            return
+        
+        successful_channels = result.get('successful_channels', 0)
+        total_channels = result.get('total_channels', 0)
+        
+        logger.info(f"Перевірено канали: {successful_channels}/{total_channels} успішно")
+        
+        # Обробляємо кожен канал
+        for channel_result in result['results']:
+            channel_id = channel_result.get('channel_id')
+            if channel_result.get('success'):
+                self.poll_scheduler.record_success(channel_id, channel_result.get('last_message_id'))
+            else:
+                self.poll_scheduler.record_failure(
+                    channel_id, channel_result.get('error'), channel_result.get('retry_after')
+                )
+            await self.process_channel_result(channel_result)
+    
+    async def check_channel_messages(self):
+        """
+        Відстеження всіх каналів та аналіз повідомлень за патернами.
+        У push-режимі (IngestMode=push, за замовчуванням) повідомлення надходять через обробники
+        подій Telethon, а опитування виконується лише для наздоганяння при старті та після перепідключення.
+        У poll-режимі кожен канал опитується за власним розкладом PollScheduler: частіше активні,
+        рідше тихі, в межах спільного бюджету запитів; помилка каналу відкладає лише цей канал.
+        """
+        # Сповіщення йдуть через той самий Application (і пул з'єднань), що й команди бота.
+        # Дочитуємо сповіщення, що залишились у черзі після попереднього запуску
+        self.start_dispatcher(self.application.bot)
+        self.pipeline = self.build_pipeline()
+        self.pipeline.start()
+        if self._digest_task is None or self._digest_task.done():
+            self._digest_task = asyncio.create_task(self.digest_loop())
+        if self._trace_report_task is None or self._trace_report_task.done():
+            self._trace_report_task = asyncio.create_task(self.trace_report_loop())
+        reconnect_check_interval = 5
+        self.push_mode = str(self.config_data.get('IngestMode', 'push')).lower() == 'push'
+        
+        if self.push_mode:
+            try:
+                await register_channel_handlers(self.config_data, self.on_channel_update, self.snapshot.channel_ids)
+            except Exception as e:
+                logger.error(f"Не вдалося увімкнути push-режим, перехід на опитування: {str(e)}")
+                self.push_mode = False
+        
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        was_connected = True
+        
+        while True:
+            # Інтервал читаємо щоразу, щоб гаряче оновлення конфігурації діяло одразу
+            check_interval = int(self.config_data.get('PollInterval', 300))  # 5 хвилин між перевірками за замовчуванням
+            poll_requested = self._poll_requested.is_set()
+            
+            if not self.push_mode:
+                # Зміна каналів лише будить цикл: нові канали PollScheduler ставить на опитування одразу
+                self._poll_requested.clear()
+                due = self.poll_scheduler.due()
+                if not due:
+                    next_due_in = self.poll_scheduler.next_due_in()
+                    await self._wait_poll_request(check_interval if next_due_in is None else next_due_in)
                     continue
-                
-                successful_channels = result.get('successful_channels', 0)
-                total_channels = result.get('total_channels', 0)
-                
-                logger.info(f"Перевірено канали: {successful_channels}/{total_channels} успішно")
-                
-                # Обробляємо кожен канал
-                for channel_result in result['results']:
-                    if not channel_result['success']:
-                        logger.error(f"Помилка в каналі {channel_result.get('channel_id', 'невідомо')}: {channel_result.get('error')}")
-                        continue
-                    
-                    channel_id = channel_result['channel_id']
-                    current_message = channel_result['message']
-                    
-                    # Пропускаємо порожні повідомлення
-                    if current_message == "[Канал порожній]":
-                        continue
-                    
-                    # Перевіряємо, чи змінилося повідомлення в цьому каналі
-                    previous_message = self.previous_messages.get(channel_id)
-                    
-                    if previous_message is not None and current_message == previous_message:
-                        logger.debug(f"Повідомлення в каналі {channel_id} не змінилось, пропускаємо обробку")
-                        continue
-                    
-                    # Оновлюємо останнє повідомлення для цього каналу
-                    self.previous_messages[channel_id] = current_message
-                    
-                    # Аналізуємо повідомлення за патернами
-                    found_patterns, notification_message = self.analyze_message_with_patterns(current_message, channel_id)
-                    
-                    print("\n" + "="*60)
-                    print(f"Новий пост з каналу {channel_id} (довжина: {len(current_message)} символів):")
-                    print("-"*60)
-                    print(current_message[:500] + ("..." if len(current_message) > 500 else ""))
-                    print("-"*60)
-                    
-                    if found_patterns:
-                        print(f"Знайдені патерни: {', '.join(found_patterns)}")
-                        if notification_message:
-                            # Надсилаємо сповіщення користувачам
-                            success_count, fail_count = await self.send_notification_to_users(app, notification_message)
-                            print(f" Відправлено сповіщень: {success_count} успішно, {fail_count} невдало")
-                    else:
-                        print("Патерни не знайдені")
-                    print("="*60 + "\n")
-                
-                # Збільшуємо інтервал перевірки після кожної ітерації
-                await asyncio.sleep(check_interval)
+                try:
+                    await self.poll_channels(due, wait_flood=False)
+                except Exception as e:
+                    logger.error(f"Помилка при перевірці каналів: {str(e)}")
+                    for channel_id in due:
+                        self.poll_scheduler.record_failure(channel_id, str(e))
+                continue
+            
+            # Опитування лише як наздоганяння: при старті, після відновлення з'єднання та зміни каналів
+            connected = is_telegram_client_connected()
+            reconnected = connected and not was_connected
+            was_connected = connected
+            
+            if reconnected:
+                logger.info("З'єднання з Telegram відновлено, наздоганяємо пропущені повідомлення")
+            elif not poll_requested and (next_poll is None or loop.time() < next_poll):
+                await self._wait_poll_request(reconnect_check_interval)
+                continue
+            
+            self._poll_requested.clear()
+            try:
+                await self.poll_channels()
+                next_poll = None
                 
             except Exception as e:
                 logger.error(f"Помилка при перевірці каналів: {str(e)}")
-                # Збільшуємо інтервал при помилках
-                await asyncio.sleep(check_interval * 2)
+                # Повторне наздоганяння пізніше
+                next_poll = loop.time() + check_interval * 2
+    
+    async def _wait_poll_request(self, timeout):
+        """Очікування до timeout секунд або до позачергового запиту на опитування"""
+        try:
+            await asyncio.wait_for(self._poll_requested.wait(), timeout=max(0, timeout))
+        except asyncio.TimeoutError:
+            pass
+    
+    async def apply_config(self, new_config):
+        """
+        Гаряче застосування нової конфігурації без перезапуску процесу:
+        патерни компілюються заздалегідь і підміняються разом з рештою параметрів одним присвоєнням,
+        ліміти розсилки, вікно дедуплікації та повтори черги сповіщень оновлюються на місці,
+        IngestMode перемикає push-режим та опитування, а при зміні TargetChats перереєструються
+        push-обробники та запускається позачергове опитування.
+        Усе, що може не вдатися (компіляція патернів, підписка на канали), виконується до підміни стану:
+        при помилці виникає виняток, а бот продовжує працювати зі старою конфігурацією.
+        Облікові дані, файли баз та параметри клієнтів і конвеєра (main.RESTART_REQUIRED_KEYS)
+        тут не змінюються - для них потрібен перезапуск.
+        Повертає список змінених ключів
+        """
+        old_config = self.config_data
+        changed = sorted(
+            key for key in old_config.keys() | new_config.keys()
+            if old_config.get(key) != new_config.get(key)
+        )
+        if not changed:
+            return changed
+        
+        snapshot = ConfigSnapshot(new_config)
+        
+        # До запуску відстеження каналів режим береться з конфігурації в check_channel_messages
+        push_mode = self.push_mode
+        if self.pipeline is not None:
+            push_mode = str(new_config.get('IngestMode', 'push')).lower() == 'push'
+        channels_changed = old_config.get('TargetChats') != new_config.get('TargetChats')
+        
+        if self.pipeline is not None and push_mode and (channels_changed or not self.push_mode):
+            try:
+                await register_channel_handlers(new_config, self.on_channel_update, snapshot.channel_ids)
+            except Exception as e:
+                logger.error(f"Не вдалося підписатися на оновлення каналів, конфігурацію не застосовано: {str(e)}")
+                raise RuntimeError(f"Не вдалося підписатися на оновлення каналів: {str(e)}") from e
+        
+        self.config_data = new_config
+        self.snapshot = snapshot
+        self.message_patterns = snapshot.message_patterns
+        self.pattern_matcher = snapshot.pattern_matcher
+        self.admin_chat_id = new_config.get('AdminChatId')
+        self.digest.window = float(new_config.get('DigestWindowSeconds', 300))
+        self.poll_scheduler.configure(new_config)
+        self.poll_scheduler.set_channels(snapshot.channel_ids)
+        self._digest_wakeup.set()
+        # Broadcaster спільний з диспетчером черги, тож нові ліміти діють і на сповіщення
+        self.broadcaster.configure(new_config)
+        self.duplicate_cache.configure(new_config)
+        if self.dispatcher is not None:
+            self.dispatcher.max_attempts = int(new_config.get('OutboundMaxAttempts', 5))
+            self.dispatcher.retry_base_delay = float(new_config.get('OutboundRetryDelay', 30))
+        
+        if push_mode != self.push_mode:
+            self.push_mode = push_mode
+            if push_mode:
+                logger.info("Перехід на push-режим")
+            else:
+                await unregister_channel_handlers()
+                logger.info("Перехід на опитування каналів")
+        # Наздоганяємо пости нових каналів та ті, що могли з'явитися під час перемикання режиму
+        if channels_changed or 'IngestMode' in changed:
+            self._poll_requested.set()
+        
+        logger.info(f"Конфігурацію застосовано без перезапуску, змінено: {', '.join(changed)}")
+        return changed
+    
+    def build_application(self):
+        """
+        Єдиний Application для команд, сповіщень та розсилок.
+        Запити до Bot API йдуть через PooledHTTPXRequest з пулом BotApiPoolSize з'єднань,
+        а long polling getUpdates - через окремий невеликий клієнт, щоб не займати пул розсилок
+        """
+        self.bot_api_request = PooledHTTPXRequest.from_config(self.config_data)
+        get_updates_request = HTTPXRequest(
+            connection_pool_size=1,
+            read_timeout=float(self.config_data.get('BotApiReadTimeout', 10)) + 30
+        )
+        builder = (
+            ApplicationBuilder()
+            .token(self.token)
+            .request(self.bot_api_request)
+            .get_updates_request(get_updates_request)
+        )
+        # Локальний Bot API сервер або його замінник (fake_bot_api.py) замість api.telegram.org
+        base_url = self.config_data.get('BotApiBaseUrl')
+        if base_url:
+            builder = builder.base_url(base_url)
+        return builder.build()
+    
+    def bot_api_pool_metrics(self):
+        """Метрики пулу з'єднань до Bot API (None, якщо бот ще не запущений)"""
+        if self.bot_api_request is None:
+            return None
+        return self.bot_api_request.pool_metrics()
     
     async def run(self):
         """Запуск бота"""
         try:
-            self.application = ApplicationBuilder().token(self.token).build()
+            self.application = self.build_application()
 
             self.application.add_handler(CommandHandler("on", self.turn_on))
             self.application.add_handler(CommandHandler("off", self.turn_off))
             self.application.add_handler(CommandHandler("status", self.status))
             self.application.add_handler(CommandHandler("channels", self.channels))
+            self.application.add_handler(CommandHandler("subscribe", self.subscribe))
+            self.application.add_handler(CommandHandler("unsubscribe", self.unsubscribe))
+            self.application.add_handler(CommandHandler("subscriptions", self.list_subscriptions))
             self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.echo))
 
             logger.info("Бот запускається...")
             
+            await self.user_store.open()
+            await self.outbound_queue.open()
+            # Відновлюємо курсори каналів, щоб після перезапуску не сповіщати про вже оброблені пости
+            self.last_message_ids.update(self.user_store.channel_cursors())
+            self.fetched_message_ids.update(self.last_message_ids)
             await self.application.initialize()
             await self.application.start()
             
-            await self.send_startup_message(self.application)
-            
             asyncio.create_task(self.check_channel_messages())
             
+            await self.send_startup_message(self.application)
+            
             logger.info("Бот успішно запущений. Очікування повідомлень...")
             await self.application.updater.start_polling()
             
@@ -362,6 +875,37 @@ class Bot_1:
         except Exception as e:
             logger.error(f"Помилка при запуску бота: {str(e)}")
         finally:
+            if self.pipeline:
+                # Вже отримані повідомлення доводимо до дискової черги; решту незавершених
+                # збережений курсор не перескакує, тож після перезапуску вони будуть отримані повторно
+                try:
+                    await asyncio.wait_for(
+                        self.pipeline.join(), timeout=float(self.config_data.get('PipelineDrainTimeout', 10))
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"Конвеєр не дочитано при зупинці: {self.pipeline.stats()}")
+                await self.pipeline.stop()
+            if self._trace_report_task:
+                self._trace_report_task.cancel()
+            if self._digest_task:
+                self._digest_task.cancel()
+                try:
+                    await self._digest_task
+                except asyncio.CancelledError:
+                    pass
+                # Накопичені дайджести ставимо в дискову чергу, щоб не втратити їх при зупинці
+                try:
+                    await self.flush_digests(force=True)
+                except Exception as e:
+                    logger.error(f"Не вдалося зберегти дайджести при зупинці: {str(e)}")
+            if self.dispatcher:
+                await self.dispatcher.stop()
             if self.application:
+                # Інакше shutdown() завершується RuntimeError "This Updater is still running!"
+                if self.application.updater and self.application.updater.running:
+                    await self.application.updater.stop()
                 await self.application.stop()
-                logger.info("Бот зупинений")
\ No newline at end of file
+                await self.application.shutdown()
+                logger.info("Бот зупинений")
+            await self.outbound_queue.close()
+            await self.user_store.close()
\ No newline at end of file
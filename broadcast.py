@@ -0,0 +1,182 @@
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import asyncio
+import logging
+import time
+
+from rate_limit import TokenBucket
+from metrics import SEND_RESULTS, SEND_SECONDS, SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Помилки, після яких користувача слід видалити з бази
+UNREACHABLE_ERRORS = ("chat not found", "bot was blocked", "user is deactivated")
+
+
+def is_unreachable_error(error):
+    """Чи означає помилка, що користувач більше недоступний для бота"""
+    error_msg = str(error).lower()
+    return any(marker in error_msg for marker in UNREACHABLE_ERRORS)
+
+
+@dataclass
+class BroadcastStats:
+    """Статистика доставки однієї розсилки"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    unreachable: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "unreachable": len(self.unreachable),
+            "elapsed": round(self.elapsed, 3),
+            "rate": round(self.rate, 2)
+        }
+
+
+class Broadcaster:
+    """
+    Паралельна розсилка повідомлень через Bot API з дотриманням лімітів Telegram:
+    глобальний ліміт (~30 повідомлень/с на бота), інтервал між повідомленнями в один чат
+    та паузи RetryAfter (429), які зупиняють усіх відправників до закінчення паузи.
+    Стан лімітів спільний для всіх розсилок одного токена.
+    """
+
+    def __init__(self, rate=30, concurrency=30, per_chat_interval=1.0, max_retries=3):
+        self.concurrency = max(1, int(concurrency))
+        self.per_chat_interval = float(per_chat_interval)
+        self.max_retries = int(max_retries)
+        self._bucket = TokenBucket(rate)
+        # Час останньої відправки в кожен чат у порядку відправки (старі записи видаляються)
+        self._chat_last_sent = OrderedDict()
+        self._paused_until = 0.0
+
+    @classmethod
+    def from_config(cls, config_data):
+        return cls(
+            rate=float(config_data.get('BroadcastRatePerSecond', 30)),
+            concurrency=int(config_data.get('BroadcastConcurrency', 30)),
+            per_chat_interval=float(config_data.get('PerChatInterval', 1.0)),
+            max_retries=int(config_data.get('BroadcastMaxRetries', 3))
+        )
+
+    def configure(self, config_data):
+        """Нові ліміти з конфігурації; пауза RetryAfter та час відправок у чати зберігаються"""
+        rate = float(config_data.get('BroadcastRatePerSecond', 30))
+        if rate != self._bucket.rate:
+            self._bucket = TokenBucket(rate)
+        self.concurrency = max(1, int(config_data.get('BroadcastConcurrency', 30)))
+        self.per_chat_interval = float(config_data.get('PerChatInterval', 1.0))
+        self.max_retries = int(config_data.get('BroadcastMaxRetries', 3))
+
+    async def _wait_for_slot(self, chat_id):
+        # Глобальна пауза після RetryAfter
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        # Ліміт на один чат
+        last_sent = self._chat_last_sent.get(chat_id)
+        if last_sent is not None:
+            wait = last_sent + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        await self._bucket.acquire()
+        now = time.monotonic()
+        self._chat_last_sent.pop(chat_id, None)
+        self._chat_last_sent[chat_id] = now
+        self._expire_chats(now)
+
+    def _expire_chats(self, now):
+        # Чати, в які писали раніше ніж per_chat_interval тому, ліміт уже не обмежує
+        while self._chat_last_sent:
+            last_sent = next(iter(self._chat_last_sent.values()))
+            if now - last_sent < self.per_chat_interval:
+                break
+            self._chat_last_sent.popitem(last=False)
+
+    async def send(self, bot, chat_id, text, stats=None):
+        """
+        Надсилає одне повідомлення з повторними спробами
+        Повертає "sent", "unreachable", "rejected" (Bot API відхилив запит - повтор не допоможе)
+        або "failed" (тимчасова помилка, повтор пізніше має сенс)
+        """
+        outcome = await self._send(bot, chat_id, text, stats)
+        SEND_RESULTS.labels(outcome).inc()
+        return outcome
+
+    async def _send(self, bot, chat_id, text, stats):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                with SEND_SECONDS.time():
+                    await bot.send_message(chat_id=chat_id, text=text)
+                return "sent"
+            except RetryAfter as e:
+                SEND_RETRIES.labels("retry_after").inc()
+                retry_after = float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"RetryAfter {retry_after} с, розсилку призупинено")
+            except (Forbidden, BadRequest) as e:
+                if is_unreachable_error(e):
+                    logger.info(f"Користувач {chat_id} недоступний: {str(e)}")
+                    return "unreachable"
+                logger.warning(f"Bot API відхилив повідомлення до {chat_id}: {str(e)}")
+                return "rejected"
+            except (TimedOut, NetworkError) as e:
+                # Тимчасова помилка: експоненційна затримка перед повтором
+                SEND_RETRIES.labels("network").inc()
+                logger.debug(f"Тимчасова помилка для {chat_id}: {str(e)}")
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except Exception as e:
+                if is_unreachable_error(e):
+                    return "unreachable"
+                logger.warning(f"Не вдалося відправити повідомлення до {chat_id}: {str(e)}")
+                return "failed"
+
+            if stats is not None and attempt < self.max_retries:
+                stats.retried += 1
+
+        logger.warning(f"Вичерпано спроби відправки до {chat_id}")
+        return "failed"
+
+    async def broadcast(self, bot, chat_ids, text):
+        """Розсилка одного тексту списку чатів пулом відправників. Повертає BroadcastStats"""
+        chat_ids = list(chat_ids)
+        stats = BroadcastStats(total=len(chat_ids))
+        started = time.monotonic()
+        pending = iter(chat_ids)
+
+        async def worker():
+            for chat_id in pending:
+                outcome = await self.send(bot, chat_id, text, stats)
+                if outcome == "sent":
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+                    if outcome == "unreachable":
+                        stats.unreachable.append(chat_id)
+
+        workers = min(self.concurrency, len(chat_ids))
+        if workers:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+
+        stats.elapsed = time.monotonic() - started
+        logger.info(
+            f"Розсилка: {stats.sent}/{stats.total} за {stats.elapsed:.1f} с "
+            f"({stats.rate:.1f} повідомлень/с), невдало: {stats.failed}, повторів: {stats.retried}"
+        )
+        return stats
@@ -1,58 +1,229 @@
 import xml.etree.ElementTree as ET
 from pathlib import Path
+import hashlib
 import json
 import logging
+import threading
+
+from pattern_matcher import PatternMatcher, normalize_pattern_rules, EXPRESSION_KIND
+from rule_expressions import parse_expression
+from term_index import MATCH_MODES
 
 logger = logging.getLogger(__name__)
 
+
+def _parse_choice(*choices):
+    def parse(value):
+        if value.lower() not in choices:
+            raise ValueError(f"очікується одне з {', '.join(choices)}, отримано '{value}'")
+        return value.lower()
+    return parse
+
+
+def _parse_bool(value):
+    if value.lower() not in ('true', 'false'):
+        raise ValueError(f"очікується true або false, отримано '{value}'")
+    return value.lower() == 'true'
+
+
+def _parse_chat_id(value):
+    # Числовий ID (у т.ч. від'ємний для груп) або @username
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+def _parse_channel_list(value):
+    channel_ids = [id_str.strip() for id_str in value.split(',') if id_str.strip()]
+    for channel_id in channel_ids:
+        int(channel_id)
+    return value
+
+
+# Типи відомих ключів appSettings. Ключі поза схемою розбираються як раніше (bool/int/рядок)
+CONFIG_SCHEMA = {
+    'encryption_key': str,
+    'previous_encryption_keys': str,
+    'Token': str,
+    'ApiId': int,
+    'ApiHash': str,
+    'PhoneNumber': str,
+    'AdminChatId': _parse_chat_id,
+    'TargetChats': _parse_channel_list,
+    'SearchPatterns': str,
+    'MessagePatterns': json.loads,
+    'IngestMode': _parse_choice('push', 'poll'),
+    'PollInterval': int,
+    'PollMinInterval': float,
+    'PollMaxInterval': float,
+    'PollBudgetPerMinute': float,
+    'PollRateSmoothing': float,
+    'PollBackoffMax': float,
+    'MaxMessagesPerPoll': int,
+    'FetchConcurrency': int,
+    'FetchRatePerSecond': float,
+    'MaxFloodWait': int,
+    'FloodSleepThreshold': int,
+    'BroadcastRatePerSecond': float,
+    'BroadcastConcurrency': int,
+    'PerChatInterval': float,
+    'BroadcastMaxRetries': int,
+    'UsersDbFile': str,
+    'OutboundDbFile': str,
+    'OutboundMaxAttempts': int,
+    'OutboundRetryDelay': float,
+    'DedupWindowSeconds': float,
+    'DedupMaxEntries': int,
+    'BotApiPoolSize': int,
+    'BotApiKeepAlive': float,
+    'BotApiConnectTimeout': float,
+    'BotApiReadTimeout': float,
+    'BotApiWriteTimeout': float,
+    'BotApiPoolTimeout': float,
+    'BotApiHttpVersion': _parse_choice('1.1', '2'),
+    'BotApiBaseUrl': str,
+    'PipelineQueueSize': int,
+    'MatchWorkers': int,
+    'DispatchWorkers': int,
+    'PipelineDrainTimeout': float,
+    'DigestMode': _parse_bool,
+    'DigestWindowSeconds': float,
+    'DigestBypassPriority': str,
+    'TraceReportInterval': float,
+    'MetricsToken': str,
+}
+
+# Ключі, які можуть повторюватися: усі блоки об'єднуються в один список правил
+REPEATABLE_KEYS = ('MessagePatterns',)
+
+
+def _guess_value(value):
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if value.isdigit():
+        return int(value)
+    return value
+
+
+class ConfigSnapshot:
+    """
+    Незмінний знімок конфігурації для гарячих шляхів: розібраний список каналів
+    та скомпільовані патерни, щоб не розбирати TargetChats і MessagePatterns на кожному виклику
+    """
+
+    def __init__(self, config_data):
+        self.config_data = dict(config_data)
+        target_chats = self.config_data.get('TargetChats') or ''
+        self.channel_ids = tuple(id_str.strip() for id_str in str(target_chats).split(',') if id_str.strip())
+        self.message_patterns = normalize_pattern_rules(self.config_data.get('MessagePatterns'))
+        self.pattern_matcher = PatternMatcher(self.message_patterns)
+
+
 class ConfigReader:
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(ConfigReader, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._file_version = None
+            cls._instance._content_hash = None
+            cls._instance.config_data = {}
             cls._instance._load_config()
         return cls._instance
-    
-    def _load_config(self):
+
+    @property
+    def config_path(self):
+        return Path(__file__).parent / "bot.config"
+
+    def _load_config(self, force=False):
+        """
+        Читає bot.config, якщо файл змінився (mtime/розмір, потім SHA-256 вмісту).
+        Повертає True, якщо конфігурація змінилась
+        """
         try:
-            config_path = Path(__file__).parent / "bot.config"
+            config_path = self.config_path
             if not config_path.exists():
                 raise FileNotFoundError(f"Configuration file not found at {config_path}")
-            
-            tree = ET.parse(config_path)
-            root = tree.getroot()
-            app_settings = root.find(".//appSettings")
-            if app_settings is None:
-                raise ValueError("appSettings section not found in config file")
-            
-            # Створюємо словник для зберігання всіх конфігураційних даних
-            self.config_data = {}
-                
-            for elem in app_settings.findall("add"):
-                key = elem.get('key')
-                value = elem.get('value')
-                if key is None or value is None:
-                    continue
-                
-                if value.lower() in ('true', 'false'):
-                    value = value.lower() == 'true'
-                elif value.isdigit():
-                    value = int(value)
-                elif key == 'MessagePatterns':
-                    try:
-                        value = json.loads(value)
-                    except json.JSONDecodeError:
-                        logger.error(f"Помилка парсингу JSON для MessagePatterns: {value}")
-                        value = {}
-                
-                # Зберігаємо значення як атрибут і в словнику
+
+            stats = config_path.stat()
+            file_version = (stats.st_mtime_ns, stats.st_size)
+            if not force and file_version == self._file_version:
+                return False
+
+            content = config_path.read_bytes()
+            content_hash = hashlib.sha256(content).hexdigest()
+            if not force and content_hash == self._content_hash:
+                self._file_version = file_version
+                return False
+
+            config_data = self._parse(content)
+
+            # Зберігаємо значення як атрибут і в словнику
+            for key, value in config_data.items():
                 setattr(self, key, value)
-                self.config_data[key] = value
-            
+            self.config_data = config_data
+            self._file_version = file_version
+            self._content_hash = content_hash
+            return True
+
         except Exception as e:
             raise RuntimeError(f"Failed to load configuration: {str(e)}")
-    
+
+    def _parse(self, content):
+        root = ET.fromstring(content)
+        app_settings = root if root.tag == 'appSettings' else root.find(".//appSettings")
+        if app_settings is None:
+            raise ValueError("appSettings section not found in config file")
+
+        # Створюємо словник для зберігання всіх конфігураційних даних
+        config_data = {}
+        errors = []
+
+        for elem in app_settings.findall("add"):
+            key = elem.get('key')
+            value = elem.get('value')
+            if key is None or value is None:
+                continue
+
+            parser = CONFIG_SCHEMA.get(key)
+            try:
+                value = parser(value.strip()) if parser else _guess_value(value)
+            except (ValueError, TypeError) as e:
+                errors.append(f"{key}: {str(e)}")
+                continue
+
+            if key in REPEATABLE_KEYS:
+                config_data.setdefault(key, []).append(value)
+            else:
+                if key in config_data:
+                    logger.warning(f"Ключ {key} повторюється в конфігурації, використовується останнє значення")
+                config_data[key] = value
+
+        # Повторні блоки MessagePatterns зводимо в один список правил
+        if 'MessagePatterns' in config_data:
+            config_data['MessagePatterns'] = normalize_pattern_rules(config_data['MessagePatterns'])
+            for rule in config_data['MessagePatterns']:
+                rule_name = rule.get('name', rule.get('kind'))
+                if rule.get('match', 'exact') not in MATCH_MODES:
+                    errors.append(
+                        f"MessagePatterns.{rule_name}: match має бути одним з {', '.join(MATCH_MODES)}"
+                    )
+                if rule.get('kind') != EXPRESSION_KIND:
+                    continue
+                try:
+                    parse_expression(rule.get('expression'))
+                except ValueError as e:
+                    errors.append(f"MessagePatterns.{rule_name}: {str(e)}")
+
+        if errors:
+            raise ValueError("Invalid configuration values: " + "; ".join(errors))
+
+        return config_data
+
+    def reload(self, force=False):
+        """Повторно читає bot.config, якщо він змінився на диску. Повертає True при зміні"""
+        with self._lock:
+            return self._load_config(force=force)
+
     def get_config_dict(self):
         """Повертає всю конфігурацію у вигляді словника"""
-        return self.config_data.copy()
\ No newline at end of file
+        return self.config_data.copy()
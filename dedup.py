@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import hashlib
+import re
+import time
+
+_URL_RE = re.compile(r'(?:https?://|www\.|t\.me/)\S+', re.IGNORECASE)
+_MENTION_RE = re.compile(r'@\w+')
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize_content(text):
+    """
+    Нормалізує текст поста для порівняння копій: регістр, посилання, згадки,
+    емодзі, пунктуація та пробіли не впливають на результат
+    """
+    text = _URL_RE.sub(' ', text.casefold())
+    text = _MENTION_RE.sub(' ', text)
+    return ' '.join(_WORD_RE.findall(text))
+
+
+def content_fingerprint(text):
+    """Короткий відбиток нормалізованого тексту (None, якщо в тексті немає слів)"""
+    normalized = normalize_content(text)
+    if not normalized:
+        return None
+    return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+
+
+class DuplicateCache:
+    """
+    Кеш відбитків постів з TTL та обмеженням кількості записів (витісняються найстаріші).
+    Дублікатом вважається лише копія з іншого каналу: для неї повертається джерело першої копії
+    та канали, з яких копії вже надходили, - щоб сповістити лише підписників нового каналу.
+    Повтор того самого тексту в каналі, де він уже був, - нове повідомлення (наприклад, повторна тривога)
+    """
+
+    def __init__(self, ttl=1800, max_entries=10000):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, config_data):
+        return cls(
+            ttl=float(config_data.get('DedupWindowSeconds', 1800)),
+            max_entries=int(config_data.get('DedupMaxEntries', 10000))
+        )
+
+    def configure(self, config_data):
+        """Нові вікно та розмір кешу; вже зареєстровані відбитки зберігаються"""
+        self.ttl = float(config_data.get('DedupWindowSeconds', 1800))
+        self.max_entries = max(1, int(config_data.get('DedupMaxEntries', 10000)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        while self._entries:
+            seen_at, _source, _channels = next(iter(self._entries.values()))
+            if now - seen_at < self.ttl and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def check(self, text, source=None, channel_id=None):
+        """
+        Реєструє пост і повертає (джерело першої копії, канали попередніх копій), якщо це копія з іншого каналу,
+        інакше None.
+        source - довільний ідентифікатор (наприклад, (channel_id, message_id)); channel_id - канал цієї копії,
+        він додається до каналів запису
+        """
+        fingerprint = content_fingerprint(text)
+        if fingerprint is None:
+            return None
+
+        now = time.monotonic()
+        self._expire(now)
+
+        entry = self._entries.get(fingerprint)
+        if entry is not None:
+            _seen_at, original, channels = entry
+            if original == source or (channel_id is not None and channel_id in channels):
+                return None
+            self.suppressed += 1
+            seen_channels = frozenset(channels)
+            if channel_id is not None:
+                channels.add(channel_id)
+            return original, seen_channels
+
+        # Вікно рахується від першої копії, тому порядок вставки збігається з порядком старіння
+        self._entries[fingerprint] = (now, source, {channel_id} if channel_id is not None else set())
+        return None
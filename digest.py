@@ -0,0 +1,143 @@
+import time
+
+# Обмеження Bot API на довжину тексту одного повідомлення
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+DIGEST_SEPARATOR = "\n\n" + "—" * 10 + "\n\n"
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Ділить текст на частини не довші за limit, по можливості на межі рядка"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def truncate_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Обрізає текст до limit символів, позначаючи обрізання трикрапкою"""
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+
+class DigestBuffer:
+    """
+    Буфер дайджестів: сповіщення для кожного користувача накопичуються протягом window секунд
+    від першого з них і відправляються одним повідомленням (за потреби кількома частинами
+    до 4096 символів). Користувачі з однаковим набором сповіщень отримують спільний дайджест,
+    тож він ставиться в чергу одним записом для всієї групи.
+    Буфер живе лише в пам'яті: джерело кожного сповіщення (source) повертає released_sources,
+    коли сповіщення вийшло з дайджестів усіх одержувачів, - до цього курсор каналу його не перескакує.
+    """
+
+    def __init__(self, window=300, max_length=TELEGRAM_MESSAGE_LIMIT):
+        self.window = float(window)
+        self.max_length = int(max_length)
+        # Сповіщення зберігаються один раз, користувачі посилаються на них за індексом
+        self._items = {}
+        self._next_item = 0
+        self._released = []
+        self._pending = {}
+        self.flushed_digests = 0
+        self.coalesced_items = 0
+
+    @classmethod
+    def from_config(cls, config_data):
+        return cls(window=float(config_data.get('DigestWindowSeconds', 300)))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_ids, text, priority, source=None):
+        """Додає сповіщення в буфер кожного з user_ids; source - довільний ідентифікатор поста"""
+        item_id = self._next_item
+        self._next_item += 1
+        self._items[item_id] = (text, priority, source)
+
+        now = time.monotonic()
+        for user_id in user_ids:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = (now, [item_id])
+            else:
+                entry[1].append(item_id)
+
+    def next_due_in(self):
+        """Секунд до найближчого готового дайджесту (None, якщо буфер порожній)"""
+        if not self._pending:
+            return None
+        oldest = min(started_at for started_at, _items in self._pending.values())
+        return max(0.0, oldest + self.window - time.monotonic())
+
+    def due(self, force=False):
+        """
+        Забирає з буфера готові дайджести (усі - при force), згруповані за вмістом:
+        [(texts, priority, [user_id, ...]), ...]
+        """
+        now = time.monotonic()
+        groups = {}
+        for user_id, (started_at, item_ids) in list(self._pending.items()):
+            if force or now - started_at >= self.window:
+                del self._pending[user_id]
+                groups.setdefault(tuple(item_ids), []).append(user_id)
+
+        digests = []
+        for item_ids, user_ids in groups.items():
+            items = [self._items[item_id] for item_id in item_ids]
+            digests.append((
+                [text for text, _priority, _source in items], max(p for _text, p, _source in items), user_ids
+            ))
+            self.flushed_digests += 1
+            self.coalesced_items += len(item_ids)
+
+        # Звільняємо сповіщення, на які більше не посилається жоден користувач
+        referenced = {item_id for _started_at, item_ids in self._pending.values() for item_id in item_ids}
+        for item_id in list(self._items):
+            if item_id not in referenced:
+                _text, _priority, source = self._items.pop(item_id)
+                if source is not None:
+                    self._released.append(source)
+
+        return digests
+
+    def released_sources(self):
+        """Джерела сповіщень, що вийшли з буфера під час попередніх due() (список очищується)"""
+        released, self._released = self._released, []
+        return released
+
+    def render(self, texts):
+        """Текст дайджесту, поділений на частини не довші за max_length"""
+        if len(texts) == 1:
+            return split_message(texts[0], self.max_length)
+
+        chunks = []
+        header = f"Дайджест: {len(texts)} сповіщень\n\n"
+        # Заголовок завжди йде разом з першим сповіщенням: задовге перше сповіщення обрізається
+        current = header + truncate_message(texts[0], self.max_length - len(header))
+        for text in texts[1:]:
+            if len(current) + len(DIGEST_SEPARATOR) + len(text) <= self.max_length:
+                current += DIGEST_SEPARATOR + text
+                continue
+            # Сповіщення не вміщується в поточну частину: починаємо нову, а задовге ділимо окремо
+            chunks.append(current)
+            parts = split_message(text, self.max_length)
+            chunks.extend(parts[:-1])
+            current = parts[-1]
+        chunks.append(current)
+        return chunks
+
+    def stats(self):
+        return {
+            "buffered_users": len(self._pending),
+            "buffered_items": len(self._items),
+            "window": self.window,
+            "flushed_digests": self.flushed_digests,
+            "coalesced_items": self.coalesced_items
+        }
@@ -0,0 +1,191 @@
+"""
+Локальний замінник Bot API для навантажувального тестування (без звернень до Telegram).
+Приймає запити python-telegram-bot на /bot<token>/<method>: sendMessage з імітацією затримки,
+відповідей 429 (RetryAfter) та 403 "bot was blocked by the user"; getMe, getUpdates (порожній long polling)
+та решта методів відповідають успіхом. GET /stats - лічильники з моменту запуску.
+
+    python fake_bot_api.py --port 8081 --latency-ms 40 --rate-limit 30 --blocked-ratio 0.02
+    # у конфігурації бота: BotApiBaseUrl = http://127.0.0.1:8081/bot
+"""
+from collections import deque
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import uvicorn
+
+DEFAULT_PORT = 8081
+
+
+class FakeBotApiState:
+    """
+    Поведінка та лічильники замінника.
+    latency / jitter - затримка відповіді sendMessage (с);
+    rate_limit - більше ніж rate_limit sendMessage за останню секунду отримують 429 (0 - без ліміту);
+    retry_after_ratio - частка випадкових 429 незалежно від навантаження;
+    blocked_ratio - частка чатів, що "заблокували бота" (стабільна для кожного chat_id)
+    """
+
+    def __init__(self, latency=0.03, jitter=0.01, rate_limit=0, retry_after=1, retry_after_ratio=0.0,
+                 blocked_ratio=0.0, seed=None):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.rate_limit = int(rate_limit)
+        self.retry_after = int(retry_after)
+        self.retry_after_ratio = float(retry_after_ratio)
+        self.blocked_ratio = float(blocked_ratio)
+        self._random = random.Random(seed)
+        self._window = deque()
+        self.started_at = time.time()
+        self.counters = {"sent": 0, "retry_after": 0, "blocked": 0, "other_methods": 0}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+        self.message_id = 0
+        self.chats = set()
+
+    def is_blocked(self, chat_id):
+        if self.blocked_ratio <= 0:
+            return False
+        digest = hashlib.blake2b(str(chat_id).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2 ** 64 < self.blocked_ratio
+
+    def over_rate_limit(self, now):
+        if self.rate_limit <= 0:
+            return False
+        cutoff = now - 1.0
+        while self._window and self._window[0] < cutoff:
+            self._window.popleft()
+        if len(self._window) >= self.rate_limit:
+            return True
+        self._window.append(now)
+        return False
+
+    def random_retry_after(self):
+        return self.retry_after_ratio > 0 and self._random.random() < self.retry_after_ratio
+
+    def delay(self):
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def stats(self):
+        elapsed = time.time() - self.started_at
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "unique_chats": len(self.chats),
+            "avg_latency": round(self.total_latency / self.counters["sent"], 4) if self.counters["sent"] else None,
+            "uptime": round(elapsed, 3),
+            "sent_per_second": round(self.counters["sent"] / elapsed, 2) if elapsed else 0.0
+        }
+
+
+def _error(status_code, description, parameters=None):
+    body = {"ok": False, "error_code": status_code, "description": description}
+    if parameters:
+        body["parameters"] = parameters
+    return JSONResponse(body, status_code=status_code)
+
+
+async def _request_params(request):
+    """Параметри методу: PTB надсилає form-data зі значеннями, закодованими в JSON"""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        return await request.json()
+    params = {}
+    for key, value in (await request.form()).items():
+        try:
+            params[key] = json.loads(value)
+        except (TypeError, ValueError):
+            params[key] = value
+    return params
+
+
+def create_app(state):
+    app = FastAPI()
+
+    @app.get("/stats")
+    async def stats():
+        return state.stats()
+
+    @app.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str, request: Request):
+        params = await _request_params(request)
+        method = method.lower()
+
+        if method == 'sendmessage':
+            return await send_message(params)
+        state.counters["other_methods"] += 1
+        if method == 'getme':
+            bot_id = int(token.split(':', 1)[0]) if token.split(':', 1)[0].isdigit() else 1
+            return {"ok": True, "result": {
+                "id": bot_id, "is_bot": True, "first_name": "Load Test", "username": "load_test_bot"
+            }}
+        if method == 'getupdates':
+            # Оновлень немає: тримаємо long polling, але не довше кількох секунд
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 2.0))
+            return {"ok": True, "result": []}
+        return {"ok": True, "result": True}
+
+    async def send_message(params):
+        chat_id = params.get('chat_id')
+        now = time.monotonic()
+        if state.over_rate_limit(now) or state.random_retry_after():
+            state.counters["retry_after"] += 1
+            return _error(
+                429, f"Too Many Requests: retry after {state.retry_after}", {"retry_after": state.retry_after}
+            )
+
+        state.in_flight += 1
+        state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+        delay = state.delay()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state.in_flight -= 1
+
+        if state.is_blocked(chat_id):
+            state.counters["blocked"] += 1
+            return _error(403, "Forbidden: bot was blocked by the user")
+
+        state.counters["sent"] += 1
+        state.total_latency += delay
+        state.chats.add(chat_id)
+        state.message_id += 1
+        return {"ok": True, "result": {
+            "message_id": state.message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": params.get('text', '')
+        }}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальний замінник Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--rate-limit", type=int, default=30, help="sendMessage на секунду до 429 (0 - без ліміту)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after у відповідях 429 (с)")
+    parser.add_argument("--retry-after-ratio", type=float, default=0.0, help="частка випадкових 429")
+    parser.add_argument("--blocked-ratio", type=float, default=0.0, help="частка чатів, що заблокували бота")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    state = FakeBotApiState(
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, rate_limit=args.rate_limit,
+        retry_after=args.retry_after, retry_after_ratio=args.retry_after_ratio,
+        blocked_ratio=args.blocked_ratio, seed=args.seed
+    )
+    uvicorn.run(create_app(state), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
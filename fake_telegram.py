@@ -0,0 +1,197 @@
+"""
+Синтетичне джерело повідомлень каналів замість TelegramClient (навантажувальне тестування).
+FakeTelegramClient реалізує ту частину інтерфейсу Telethon, яку використовує telegram_module
+(iter_messages, обробники NewMessage, is_connected, disconnect), і встановлюється
+через telegram_module.install_telegram_client. Повідомлення генеруються з заданою частотою
+(пуассонівський потік) та частками постів, що спрацьовують на правила, і репостів між каналами.
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import asyncio
+import random
+
+from telethon import events
+from telethon.tl.types import PeerChannel
+
+# Звичайні пости: не містять слів правил навантажувального тесту (ракет*, київ*, тривог*)
+NEUTRAL_SENTENCES = (
+    "Курс валют на сьогодні: долар подешевшав, євро без змін.",
+    "Погода: у столиці до +24°, без опадів, вітер помірний.",
+    "У Львові відкрили оновлений сквер біля ратуші.",
+    "Збірна з футболу провела відкрите тренування перед матчем.",
+    "Нацбанк залишив облікову ставку без змін.",
+    "Уряд ухвалив постанову про підтримку малого бізнесу.",
+    "На Закарпатті очікуються дощі, можливе підвищення рівня води в річках.",
+    "Укрзалізниця призначила додаткові поїзди на вихідні.",
+    "Ціни на пальне на АЗС протягом тижня майже не змінилися.",
+    "В Одесі стартував міжнародний кінофестиваль.",
+    "Пенсійний фонд нагадує про перерахунок виплат з першого числа.",
+    "Науковці представили нову систему моніторингу якості повітря.",
+)
+# Пости, що мають спрацьовувати на правила
+ALERT_SENTENCES = (
+    "Увага! Ракетна небезпека для Києва та області.",
+    "Сили ППО працюють по ракетах над Київщиною.",
+    "Повітряна тривога в Києві, ракети в повітрі, пройдіть в укриття.",
+    "Фіксуються пуски крилатих ракет, напрямок - Київ.",
+)
+
+
+class FakeMessage:
+    __slots__ = ('id', 'text', 'date', 'edit_date', 'peer_id')
+
+    def __init__(self, message_id, text, channel_id):
+        self.id = message_id
+        self.text = text
+        self.date = datetime.now(timezone.utc)
+        self.edit_date = None
+        self.peer_id = PeerChannel(int(channel_id))
+
+
+class FakeTelegramClient:
+    """
+    rate - повідомлень на секунду на канал; match_ratio - частка постів з тривожними реченнями;
+    repost_ratio - частка постів, що копіюють текст нещодавнього поста іншого каналу.
+    Нові повідомлення доставляються зареєстрованим обробникам NewMessage (push) і
+    доступні через iter_messages (poll)
+    """
+
+    def __init__(self, channel_ids, rate=1.0, match_ratio=0.05, repost_ratio=0.0, history_limit=1000, seed=None):
+        self.channel_ids = [str(channel_id) for channel_id in channel_ids]
+        self.rate = float(rate)
+        self.match_ratio = float(match_ratio)
+        self.repost_ratio = float(repost_ratio)
+        self.history_limit = int(history_limit)
+        self._random = random.Random(seed)
+        self._history = {channel_id: [] for channel_id in self.channel_ids}
+        self._last_id = {channel_id: 0 for channel_id in self.channel_ids}
+        self._recent_texts = []
+        self._handlers = []
+        self._connected = True
+        self._task = None
+        self.generated = 0
+        self.generated_matching = 0
+        self.max_lag = 0.0
+        self.started_at = None
+        self.stopped_at = None
+
+    # --- інтерфейс TelegramClient, який використовує telegram_module ---
+
+    async def start(self, *args, **kwargs):
+        return self
+
+    def is_connected(self):
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+        await self.stop()
+
+    def add_event_handler(self, callback, event):
+        self._handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self._handlers = [
+            (handler, handler_event) for handler, handler_event in self._handlers
+            if not (handler is callback and (event is None or handler_event is event))
+        ]
+
+    async def iter_messages(self, entity, limit=None, min_id=0, reverse=False):
+        history = self._history.get(str(entity.channel_id), [])
+        messages = [message for message in history if message.id > (min_id or 0)]
+        if not reverse:
+            messages.reverse()
+        for message in messages[:limit]:
+            yield message
+
+    # --- генерація трафіку ---
+
+    def _make_text(self):
+        if self._recent_texts and self._random.random() < self.repost_ratio:
+            return self._random.choice(self._recent_texts), False
+
+        sentences = self._random.sample(NEUTRAL_SENTENCES, self._random.randint(2, 5))
+        matching = self._random.random() < self.match_ratio
+        if matching:
+            sentences.insert(self._random.randrange(len(sentences) + 1), self._random.choice(ALERT_SENTENCES))
+        # Номер робить кожен пост унікальним для дедуплікації
+        text = ' '.join(sentences) + f" Новина №{self.generated + 1}."
+        self._recent_texts.append(text)
+        if len(self._recent_texts) > 50:
+            self._recent_texts.pop(0)
+        return text, matching
+
+    async def publish(self, channel_id, text):
+        """Публікує повідомлення в канал і доставляє його push-обробникам"""
+        channel_id = str(channel_id)
+        self._last_id[channel_id] += 1
+        message = FakeMessage(self._last_id[channel_id], text, channel_id)
+        history = self._history[channel_id]
+        history.append(message)
+        if len(history) > self.history_limit:
+            del history[:len(history) - self.history_limit]
+
+        event = SimpleNamespace(message=message, chat_id=int(channel_id))
+        for callback, handler_event in list(self._handlers):
+            # Як і Telethon, обробники викликаються послідовно; MessageEdited успадковує NewMessage
+            if type(handler_event) is events.NewMessage:
+                await callback(event)
+        return message
+
+    async def _generate(self, duration):
+        loop = asyncio.get_running_loop()
+        total_rate = self.rate * len(self.channel_ids)
+        self.started_at = loop.time()
+        next_at = self.started_at
+        deadline = self.started_at + duration if duration else None
+
+        while True:
+            next_at += self._random.expovariate(total_rate)
+            if deadline is not None and next_at > deadline:
+                break
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # Обробники не встигають: генератор відстає від заданої частоти
+                self.max_lag = max(self.max_lag, -delay)
+                await asyncio.sleep(0)
+
+            text, matching = self._make_text()
+            await self.publish(self._random.choice(self.channel_ids), text)
+            self.generated += 1
+            self.generated_matching += matching
+        self.stopped_at = loop.time()
+
+    def start_traffic(self, duration=None):
+        """Запускає генерацію на duration секунд (None - до stop)"""
+        if self.rate <= 0 or not self.channel_ids:
+            raise ValueError("потрібні канали та rate > 0")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._generate(duration))
+        return self._task
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self.stopped_at = asyncio.get_running_loop().time()
+        self._task = None
+
+    def latest_ids(self):
+        """ID останнього опублікованого повідомлення кожного каналу"""
+        return dict(self._last_id)
+
+    def stats(self):
+        elapsed = (self.stopped_at or asyncio.get_running_loop().time()) - self.started_at if self.started_at else 0.0
+        return {
+            "channels": len(self.channel_ids),
+            "target_rate": round(self.rate * len(self.channel_ids), 3),
+            "generated": self.generated,
+            "generated_matching": self.generated_matching,
+            "achieved_rate": round(self.generated / elapsed, 3) if elapsed else 0.0,
+            "max_lag": round(self.max_lag, 3)
+        }
@@ -0,0 +1,94 @@
+from telegram.request import HTTPXRequest
+import httpx
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest з налаштовуваним пулом з'єднань до Bot API (розмір, keep-alive)
+    та лічильниками навантаження, щоб розсилки йшли через теплі з'єднання
+    """
+
+    def __init__(self, connection_pool_size=64, keepalive_expiry=30.0, read_timeout=10.0,
+                 write_timeout=10.0, connect_timeout=5.0, pool_timeout=5.0, http_version="1.1"):
+        if http_version == "2" and not http2_available():
+            logger.warning("HTTP/2 недоступний (не встановлено h2), використовується HTTP/1.1")
+            http_version = "1.1"
+
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout,
+            http_version=http_version
+        )
+
+        # HTTPXRequest не приймає keepalive_expiry, тому перебудовуємо клієнт з власними лімітами
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._client = self._build_client()
+
+        self.pool_size = connection_pool_size
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.request_time_total = 0.0
+
+    @classmethod
+    def from_config(cls, config_data):
+        return cls(
+            connection_pool_size=int(config_data.get('BotApiPoolSize', 64)),
+            keepalive_expiry=float(config_data.get('BotApiKeepAlive', 30)),
+            read_timeout=float(config_data.get('BotApiReadTimeout', 10)),
+            write_timeout=float(config_data.get('BotApiWriteTimeout', 10)),
+            connect_timeout=float(config_data.get('BotApiConnectTimeout', 5)),
+            pool_timeout=float(config_data.get('BotApiPoolTimeout', 5)),
+            http_version=str(config_data.get('BotApiHttpVersion', '1.1'))
+        )
+
+    async def do_request(self, *args, **kwargs):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        except Exception:
+            self.errors_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests_total += 1
+            self.request_time_total += time.perf_counter() - started
+
+    def pool_metrics(self):
+        """Стан пулу та лічильники запитів до Bot API"""
+        # Кількість відкритих з'єднань - з внутрішнього пулу httpcore, якщо він доступний
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+
+        return {
+            "pool_size": self.pool_size,
+            "http_version": self.http_version,
+            "open_connections": len(connections) if connections is not None else None,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "avg_request_time": round(self.request_time_total / self.requests_total, 4) if self.requests_total else 0.0
+        }
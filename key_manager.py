@@ -0,0 +1,140 @@
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+import base64
+import json
+import logging
+import threading
+
+from config_reader import ConfigReader
+
+logger = logging.getLogger(__name__)
+
+
+def validate_key(key: str) -> bytes:
+    """Validate and prepare the encryption key."""
+    try:
+        if len(key) < 32:
+            key = key.ljust(32)[:32]
+        elif len(key) > 32:
+            key = key[:32]
+
+        return base64.urlsafe_b64encode(key.encode())
+    except Exception as e:
+        raise ValueError(f"Invalid key format: {str(e)}")
+
+
+@lru_cache(maxsize=16)
+def get_fernet_instance(encryption_key: str) -> Fernet:
+    """Get Fernet instance with validated key (cached per key)."""
+    key = validate_key(encryption_key)
+    return Fernet(key)
+
+
+def encrypt_payload(fernet: Any, data: Any) -> str:
+    """Serialize data to JSON and encrypt it with a Fernet/MultiFernet instance."""
+    try:
+        json_data = json.dumps(data)
+
+        encrypted_bytes = fernet.encrypt(json_data.encode())
+        return encrypted_bytes.decode()
+
+    except Exception as e:
+        raise RuntimeError(f"Encryption failed: {str(e)}")
+
+
+def decrypt_payload(fernet: Any, encrypted_data: str) -> Any:
+    """Decrypt a token with a Fernet/MultiFernet instance and parse JSON."""
+    try:
+        decrypted_bytes = fernet.decrypt(encrypted_data.encode())
+
+        return json.loads(decrypted_bytes.decode())
+
+    except InvalidToken:
+        raise ValueError("Invalid encryption key or corrupted data")
+    except json.JSONDecodeError:
+        raise ValueError("Decrypted data is not valid JSON")
+    except Exception as e:
+        raise RuntimeError(f"Decryption failed: {str(e)}")
+
+
+class KeyManager:
+    """
+    Holds the API cipher built from bot.config.
+    The cipher is created once and rebuilt only when bot.config changes on disk.
+    'encryption_key' encrypts every response; keys listed in 'previous_encryption_keys'
+    (comma separated) are still accepted for decryption, which allows key rotation
+    without breaking clients that have not switched yet.
+    If bot.config stops validating, the last valid keys stay in use, so the encrypted
+    endpoints that repair the config keep working.
+    """
+
+    def __init__(self, config_path: Optional[Path] = None):
+        self.config_path = config_path or Path(__file__).parent / "bot.config"
+        self._lock = threading.Lock()
+        self._config_mtime = None
+        self._primary_key = None
+        self._fernet = None
+
+    def _config_version(self):
+        try:
+            stats = self.config_path.stat()
+            return (stats.st_mtime_ns, stats.st_size)
+        except OSError:
+            return None
+
+    def _refresh(self):
+        version = self._config_version()
+        if self._fernet is not None and version == self._config_mtime:
+            return
+
+        with self._lock:
+            if self._fernet is not None and version == self._config_mtime:
+                return
+
+            try:
+                config_reader = ConfigReader()
+                config_reader.reload()
+            except RuntimeError as e:
+                logger.error(f"bot.config is invalid, keeping the last valid encryption keys: {str(e)}")
+                if self._fernet is not None:
+                    # Re-read only after the file changes again
+                    self._config_mtime = version
+                    return
+                # No cipher yet: fall back to the last configuration ConfigReader loaded successfully
+                config_reader = ConfigReader()
+            config_data = config_reader.get_config_dict()
+
+            if 'encryption_key' not in config_data:
+                raise ValueError("Missing 'encryption_key' in configuration")
+
+            primary_key = str(config_data['encryption_key'])
+            previous_keys = [
+                key.strip() for key in str(config_data.get('previous_encryption_keys', '')).split(',')
+                if key.strip() and key.strip() != primary_key
+            ]
+
+            self._fernet = MultiFernet([get_fernet_instance(key) for key in [primary_key] + previous_keys])
+            self._primary_key = primary_key
+            self._config_mtime = version
+            logger.info(f"Encryption keys loaded (previous keys: {len(previous_keys)})")
+
+    def invalidate(self):
+        """Force the cipher to be rebuilt on next use (the current one is kept if the config is invalid)."""
+        with self._lock:
+            self._config_mtime = None
+
+    def get_key(self) -> str:
+        self._refresh()
+        return self._primary_key
+
+    def get_fernet(self) -> MultiFernet:
+        self._refresh()
+        return self._fernet
+
+    def encrypt(self, data: Any) -> str:
+        return encrypt_payload(self.get_fernet(), data)
+
+    def decrypt(self, encrypted_data: str) -> Any:
+        return decrypt_payload(self.get_fernet(), encrypted_data)
@@ -0,0 +1,287 @@
+"""
+Навантажувальний тест Bot_1 на одній машині без Telegram.
+Запускає fake_bot_api.py окремим процесом (BotApiBaseUrl), підміняє клієнт Telethon
+синтетичним джерелом fake_telegram.FakeTelegramClient, наповнює базу --users користувачами
+і протягом --duration секунд подає трафік каналів. Після дочитування черг пише звіт JSON:
+досягнута частота надходження, відправлення Bot API (успішні / 429 / заблоковані),
+перцентилі затримки пост -> доставка, глибини черг та використання CPU і пам'яті.
+
+    python load_test.py --users 10000 --channels 50 --rate 0.2 --duration 60
+    python load_test.py --users 1000 --ingest poll --poll-interval 5 --blocked-ratio 0.05 --retry-after-ratio 0.01
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bot_1 import Bot_1
+from fake_telegram import FakeTelegramClient
+from telegram_module import install_telegram_client
+from user_store import UserStore
+
+DEFAULT_OUTPUT = "load_test_results.json"
+FAKE_BOT_API = Path(__file__).parent / "fake_bot_api.py"
+
+# Правила тесту: спрацьовують лише на тривожні речення fake_telegram.ALERT_SENTENCES
+LOAD_TEST_PATTERNS = [{
+    "expressions": {
+        "ракети_київ": {
+            "expression": "ракет* AND (київ* OR києв*)",
+            "priority": "critical",
+            "message": "УВАГА! {found_words}{channel_info}\n\n{message_preview}"
+        }
+    },
+    "any_of": {
+        "keywords": ["тривог"],
+        "match": "prefix",
+        "message": "Тривога: {found_words}{channel_info}\n\n{message_preview}"
+    }
+}]
+
+logger = logging.getLogger(__name__)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_bot_api(args, port):
+    command = [
+        sys.executable, str(FAKE_BOT_API), "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--rate-limit", str(args.bot_api_rate_limit), "--retry-after-ratio", str(args.retry_after_ratio),
+        "--blocked-ratio", str(args.blocked_ratio), "--seed", str(args.seed)
+    ]
+    return subprocess.Popen(command)
+
+
+async def wait_for(condition, timeout, interval=0.1):
+    """Очікує, поки condition() (sync або async) стане істинним; повертає False при тайм-ауті"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if asyncio.iscoroutine(value):
+            value = await value
+        if value:
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+
+async def seed_users(db_path, users, seed):
+    store = UserStore(db_path=db_path, legacy_json_path=None)
+    store.load()
+    for user_id in range(seed * 10 ** 6, seed * 10 ** 6 + users):
+        store.add(user_id)
+    await store.flush()
+    await store.close()
+
+
+def usage():
+    usage_data = resource.getrusage(resource.RUSAGE_SELF)
+    return {"cpu_seconds": usage_data.ru_utime + usage_data.ru_stime, "max_rss_mb": usage_data.ru_maxrss / 1024}
+
+
+async def run_load_test(args):
+    port = args.bot_api_port or free_port()
+    base = f"http://127.0.0.1:{port}"
+    process = start_fake_bot_api(args, port)
+    tmp_dir = tempfile.mkdtemp(prefix="bot-load-")
+    bot = None
+    bot_task = None
+
+    try:
+        async with httpx.AsyncClient(timeout=5) as http:
+            async def api_stats():
+                return (await http.get(f"{base}/stats")).json()
+
+            async def api_ready():
+                try:
+                    await api_stats()
+                    return True
+                except httpx.HTTPError:
+                    return False
+
+            if not await wait_for(api_ready, 15, 0.2):
+                raise RuntimeError("fake_bot_api.py не запустився")
+
+            users_db = str(Path(tmp_dir) / "users.db")
+            await seed_users(users_db, args.users, args.seed)
+
+            channel_ids = [str(1_000_000_000 + index) for index in range(args.channels)]
+            client = FakeTelegramClient(
+                channel_ids, rate=args.rate, match_ratio=args.match_ratio,
+                repost_ratio=args.repost_ratio, seed=args.seed
+            )
+            install_telegram_client(client)
+            # Перше опитування без курсора бере лише останній пост каналу, тож курсори ініціалізуються до трафіку
+            for channel_id in channel_ids:
+                await client.publish(channel_id, f"Канал {channel_id} створено.")
+
+            config_data = {
+                'Token': '123456:LOADTEST',
+                'ApiId': 1,
+                'ApiHash': 'load-test',
+                'PhoneNumber': '+380000000000',
+                'TargetChats': ','.join(channel_ids),
+                'MessagePatterns': LOAD_TEST_PATTERNS,
+                'IngestMode': args.ingest,
+                'PollInterval': args.poll_interval,
+                # Тихі канали теж дочитуються за кілька інтервалів, а не за 30 хвилин
+                'PollMaxInterval': args.poll_interval * 4,
+                'FetchRatePerSecond': args.fetch_rate,
+                'UsersDbFile': users_db,
+                'OutboundDbFile': str(Path(tmp_dir) / "outbound.db"),
+                'BotApiBaseUrl': f"{base}/bot",
+                'BroadcastRatePerSecond': args.broadcast_rate,
+                'BroadcastConcurrency': args.broadcast_concurrency,
+                'BotApiPoolSize': args.broadcast_concurrency + 8,
+                'PerChatInterval': args.per_chat_interval,
+                'TraceReportInterval': 0,
+            }
+            bot = Bot_1(config_data)
+            bot_task = asyncio.create_task(bot.run())
+
+            if not await wait_for(lambda: bot.pipeline is not None or bot_task.done(), args.startup_timeout):
+                raise RuntimeError("бот не запустився за startup_timeout")
+            if bot_task.done():
+                raise RuntimeError("бот завершився під час запуску")
+
+            # Повідомлення про запуск іде через ту саму чергу: вимірюємо лише сповіщення з каналів
+            async def startup_notice_sent():
+                stats = await api_stats()
+                if stats["sent"] + stats["blocked"] < args.users:
+                    return False
+                return (await bot.outbound_queue.stats())["depth"] == 0
+
+            if not await wait_for(startup_notice_sent, args.startup_timeout, 0.5):
+                raise RuntimeError("повідомлення про запуск не розіслано за startup_timeout")
+            await asyncio.sleep(1)
+
+            before = await api_stats()
+            usage_before = usage()
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            logger.info(f"Трафік: {args.channels} каналів x {args.rate}/с протягом {args.duration} с")
+            await client.start_traffic(args.duration)
+            ingest_seconds = loop.time() - started
+
+            async def drained():
+                # У poll-режимі пости чекають наступного опитування свого каналу
+                if any(bot.fetched_message_ids.get(channel_id, 0) < last_id
+                       for channel_id, last_id in client.latest_ids().items()):
+                    return False
+                if any(stage["depth"] for stage in bot.pipeline_stats().values()):
+                    return False
+                return (await bot.outbound_queue.stats())["depth"] == 0
+
+            is_drained = await wait_for(drained, args.drain_timeout, 0.5)
+            total_seconds = loop.time() - started
+            after = await api_stats()
+            usage_after = usage()
+
+            api_delta = {key: after[key] - before[key] for key in ("sent", "retry_after", "blocked")}
+            cpu_seconds = usage_after["cpu_seconds"] - usage_before["cpu_seconds"]
+            return {
+                "parameters": vars(args),
+                "source": client.stats(),
+                "bot_api": {
+                    **api_delta,
+                    "sent_per_second": round(api_delta["sent"] / total_seconds, 2),
+                    "peak_in_flight": after["peak_in_flight"],
+                    "avg_latency": after["avg_latency"]
+                },
+                "ingest_seconds": round(ingest_seconds, 3),
+                "drained": is_drained,
+                "drain_seconds": round(total_seconds - ingest_seconds, 3),
+                "latency": bot.latency_stats(),
+                "delivery_lanes": bot.delivery_stats(),
+                "pipeline": bot.pipeline_stats(),
+                "outbound_queue": await bot.outbound_queue.stats(),
+                "polling": bot.polling_stats() if args.ingest == "poll" else None,
+                "duplicates_suppressed": bot.duplicate_cache.suppressed,
+                "process": {
+                    "cpu_seconds": round(cpu_seconds, 3),
+                    "cpu_utilization": round(cpu_seconds / total_seconds, 3),
+                    "max_rss_mb": round(usage_after["max_rss_mb"], 1)
+                }
+            }
+    finally:
+        if bot_task is not None:
+            bot_task.cancel()
+            try:
+                await bot_task
+            except asyncio.CancelledError:
+                pass
+        install_telegram_client(None)
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def print_summary(report):
+    source, api, latency = report["source"], report["bot_api"], report["latency"]
+    print(f"Надходження: {source['generated']} постів ({source['generated_matching']} тривожних), "
+          f"{source['achieved_rate']}/с з {source['target_rate']}/с, макс. відставання {source['max_lag']} с")
+    print(f"Bot API: відправлено {api['sent']} ({api['sent_per_second']}/с), 429: {api['retry_after']}, "
+          f"заблоковано: {api['blocked']}, макс. одночасних: {api['peak_in_flight']}")
+    print(f"Черги дочитано: {'так' if report['drained'] else 'ні'} за {report['drain_seconds']} с, "
+          f"залишок у черзі: {report['outbound_queue']['depth']}")
+    for name, span in latency["spans"].items():
+        if span["count"]:
+            print(f"  {name:<24} p50 {span['p50']} с, p90 {span['p90']} с, p99 {span['p99']} с (n={span['count']})")
+    print(f"CPU: {report['process']['cpu_seconds']} с ({report['process']['cpu_utilization']:.0%}), "
+          f"пам'ять: {report['process']['max_rss_mb']} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Навантажувальний тест Bot_1 з локальними замінниками Telegram")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0.5, help="повідомлень на секунду на канал")
+    parser.add_argument("--match-ratio", type=float, default=0.02, help="частка постів, що спрацьовують на правила")
+    parser.add_argument("--repost-ratio", type=float, default=0.05, help="частка репостів між каналами")
+    parser.add_argument("--duration", type=float, default=30, help="тривалість подачі трафіку (с)")
+    parser.add_argument("--ingest", choices=("push", "poll"), default="push")
+    parser.add_argument("--poll-interval", type=int, default=5)
+    parser.add_argument("--fetch-rate", type=float, default=20, help="FetchRatePerSecond")
+    parser.add_argument("--broadcast-rate", type=float, default=30, help="BroadcastRatePerSecond (0 - без ліміту)")
+    parser.add_argument("--broadcast-concurrency", type=int, default=30)
+    parser.add_argument("--per-chat-interval", type=float, default=1.0)
+    parser.add_argument("--latency-ms", type=float, default=30, help="затримка sendMessage замінника Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--bot-api-rate-limit", type=int, default=0, help="sendMessage/с до 429 (0 - без ліміту)")
+    parser.add_argument("--retry-after-ratio", type=float, default=0.0)
+    parser.add_argument("--blocked-ratio", type=float, default=0.0)
+    parser.add_argument("--bot-api-port", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--drain-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--verbose", action="store_true", help="логи бота рівня INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+    logger.setLevel(logging.INFO)
+    report = asyncio.run(run_load_test(args))
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print_summary(report)
+    print(f"Звіт збережено в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,21 @@
 import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Request, Body
+from fastapi import FastAPI, HTTPException, Request, Body, Response
 from pathlib import Path
 import xml.etree.ElementTree as ET
-from cryptography.fernet import Fernet, InvalidToken
-import base64
 import uvicorn
 import subprocess
 import sys
 from typing import Dict, Any, Optional
 from contextlib import asynccontextmanager
-import json
+import hmac
 import os
 import signal
 
 from config_reader import ConfigReader
+from key_manager import KeyManager, get_fernet_instance, encrypt_payload, decrypt_payload
 from bot_1 import Bot_1
+from metrics import REGISTRY, CONTENT_TYPE, CRYPTO_SECONDS, RPC_REQUESTS
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -26,66 +26,24 @@ logging.basicConfig(
 decrypted_config_data = None
 config_received_event = asyncio.Event()
 bot_task = None
+bot_instance = None
+key_manager = KeyManager()
 
 def is_render_platform():
     """Перевірка чи працюємо на Render.com"""
     return bool(os.environ.get('RENDER', False))
 
-def validate_key(key: str) -> bytes:
-    """Validate and prepare the encryption key."""
-    try:
-        if len(key) < 32:
-            key = key.ljust(32)[:32]
-        elif len(key) > 32:
-            key = key[:32]
-        
-        return base64.urlsafe_b64encode(key.encode())
-    except Exception as e:
-        raise ValueError(f"Invalid key format: {str(e)}")
-
-def get_fernet_instance(encryption_key: str) -> Fernet:
-    """Get Fernet instance with validated key."""
-    key = validate_key(encryption_key)
-    return Fernet(key)
-
 def encrypt_data(data: Any, encryption_key: str) -> str:
     """Encrypt complete data package."""
-    try:
-        fernet = get_fernet_instance(encryption_key)
-        
-        json_data = json.dumps(data)
-        
-        encrypted_bytes = fernet.encrypt(json_data.encode())
-        return encrypted_bytes.decode()
-            
-    except Exception as e:
-        raise RuntimeError(f"Encryption failed: {str(e)}")
+    return encrypt_payload(get_fernet_instance(encryption_key), data)
 
 def decrypt_data(encrypted_data: str, encryption_key: str) -> Any:
     """Decrypt complete data package."""
-    try:
-        fernet = get_fernet_instance(encryption_key)
-        
-        decrypted_bytes = fernet.decrypt(encrypted_data.encode())
-        
-        return json.loads(decrypted_bytes.decode())
-            
-    except InvalidToken:
-        raise ValueError("Invalid encryption key or corrupted data")
-    except json.JSONDecodeError:
-        raise ValueError("Decrypted data is not valid JSON")
-    except Exception as e:
-        raise RuntimeError(f"Decryption failed: {str(e)}")
+    return decrypt_payload(get_fernet_instance(encryption_key), encrypted_data)
 
 async def get_encryption_key() -> str:
     """Get encryption key from configuration."""
-    config_reader = ConfigReader()
-    config_data = config_reader.get_config_dict()
-    
-    if 'encryption_key' not in config_data:
-        raise ValueError("Missing 'encryption_key' in configuration")
-    
-    return config_data['encryption_key']
+    return key_manager.get_key()
 
 def check_encryption_key() -> bool:
     """Перевірка наявності та валідності encryption_key в конфігурації"""
@@ -103,7 +61,7 @@ def check_encryption_key() -> bool:
             return False
         
         try:
-            get_fernet_instance(encryption_key)
+            key_manager.get_fernet()
             logger.info("encryption_key валідний")
             return True
         except Exception as e:
@@ -203,6 +161,46 @@ def restore_old_config() -> bool:
         logger.error(f"Failed to restore old config: {str(e)}")
         return False
 
+# Параметри, зміна яких потребує повного перезапуску (нові сесії Telethon та Bot API, новий пул з'єднань,
+# інші файли баз, новий конвеєр). Решту ключів Bot_1.apply_config застосовує без перезапуску
+RESTART_REQUIRED_KEYS = (
+    'Token', 'ApiId', 'ApiHash', 'PhoneNumber', 'FloodSleepThreshold',
+    'BotApiPoolSize', 'BotApiKeepAlive', 'BotApiConnectTimeout', 'BotApiReadTimeout',
+    'BotApiWriteTimeout', 'BotApiPoolTimeout', 'BotApiHttpVersion', 'BotApiBaseUrl',
+    'UsersDbFile', 'OutboundDbFile',
+    'PipelineQueueSize', 'MatchWorkers', 'DispatchWorkers'
+)
+
+async def reload_config() -> Dict[str, Any]:
+    """
+    Перечитує bot.config і застосовує зміни до працюючого бота без перезапуску процесу.
+    Повний перезапуск виконується лише тоді, коли змінився хоч один з RESTART_REQUIRED_KEYS.
+    Повертає {"mode": "hot-reload" | "restart" | "reloaded", "changed": [ключі]}
+    """
+    config_reader = ConfigReader()
+    old_file_config = config_reader.get_config_dict()
+    await asyncio.to_thread(config_reader.reload)
+    new_file_config = config_reader.get_config_dict()
+    
+    changed = sorted(
+        key for key in old_file_config.keys() | new_file_config.keys()
+        if old_file_config.get(key) != new_file_config.get(key)
+    )
+    
+    # Бот ще не запущений: нова конфігурація буде прочитана під час старту
+    if bot_instance is None or bot_task is None or bot_task.done():
+        return {"mode": "reloaded", "changed": changed}
+    
+    final_config_data = {**new_file_config, **(decrypted_config_data or {})}
+    
+    if any(bot_instance.config_data.get(key) != final_config_data.get(key) for key in RESTART_REQUIRED_KEYS):
+        logger.info("Змінились параметри, які не застосовуються без перезапуску, потрібен повний перезапуск")
+        asyncio.create_task(perform_restart())
+        return {"mode": "restart", "changed": changed}
+    
+    await bot_instance.apply_config(final_config_data)
+    return {"mode": "hot-reload", "changed": changed}
+
 def read_config_file():
     """Read and parse the current config file."""
     try:
@@ -255,260 +253,226 @@ async def health_check():
         "bot_running": bot_task is not None and not bot_task.done()
     }
 
-@app.post("/status")
-async def server_status_encrypted(request: Request):
+# Клієнти, яким /metrics доступний без токена, якщо MetricsToken не задано
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+def metrics_access_allowed(request: Request) -> bool:
+    """
+    Метрики містять ID відстежуваних каналів, тож /metrics доступний лише з заголовком
+    "Authorization: Bearer <MetricsToken>", а якщо MetricsToken не задано - лише з localhost
+    """
+    token = ConfigReader().get_config_dict().get('MetricsToken')
+    if token:
+        authorization = request.headers.get('authorization', '')
+        return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+    return request.client is not None and request.client.host in LOCAL_HOSTS
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Метрики процесу в текстовому форматі Prometheus"""
+    if not metrics_access_allowed(request):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+class RpcError(Exception):
+    """Помилка обробника зашифрованого ендпоінта з HTTP-подібним кодом у відповіді"""
+    
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Шифрування/дешифрування більших пакетів виконується в пулі потоків, щоб не блокувати event loop
+CRYPTO_OFFLOAD_THRESHOLD = 16 * 1024
+
+async def run_crypto(func, data, offload: bool, operation: str):
+    with CRYPTO_SECONDS.labels(operation).time():
+        if offload:
+            return await asyncio.to_thread(func, data)
+        return func(data)
+
+def encrypted_rpc(path: str, error_log: str, large_response: bool = False):
+    """
+    Реєструє POST-ендпоінт з повністю шифрованим обміном.
+    Обробник отримує дешифрований запит і повертає словник-відповідь; RpcError та ValueError
+    перетворюються на зашифровані помилки з кодом status_code (ValueError - 400, інші - 500)
+    """
+    def decorator(handler):
+        async def endpoint(request: Request):
+            # Відповідь шифрується тим самим ключем, що й запит, навіть якщо обробник змінив конфігурацію
+            fernet = None
+            try:
+                fernet = key_manager.get_fernet()
+                
+                # Отримуємо та дешифруємо запит
+                encrypted_request = await request.body()
+                decrypted_data = await run_crypto(
+                    lambda data: decrypt_payload(fernet, data),
+                    encrypted_request.decode(),
+                    len(encrypted_request) > CRYPTO_OFFLOAD_THRESHOLD,
+                    "decrypt"
+                )
+                
+                response_data = await handler(decrypted_data)
+                
+                # Шифруємо всю відповідь
+                encrypted_response = await run_crypto(
+                    lambda data: encrypt_payload(fernet, data), response_data, large_response, "encrypt"
+                )
+                RPC_REQUESTS.labels(path, 200).inc()
+                return encrypted_response
+                
+            except RpcError as e:
+                logger.error(f"{error_log}: {str(e)}")
+                error_data = {"error": str(e), "status_code": e.status_code}
+            except ValueError as e:
+                logger.error(f"{error_log}: {str(e)}")
+                error_data = {"error": str(e), "status_code": 400}
+            except Exception as e:
+                logger.error(f"{error_log}: {str(e)}")
+                error_data = {"error": str(e), "status_code": 500}
+            
+            RPC_REQUESTS.labels(path, error_data["status_code"]).inc()
+            if fernet is None:
+                return key_manager.encrypt(error_data)
+            return encrypt_payload(fernet, error_data)
+        
+        endpoint.__name__ = handler.__name__
+        endpoint.__doc__ = handler.__doc__
+        app.post(path)(endpoint)
+        return handler
+    
+    return decorator
+
+@encrypted_rpc("/status", "Помилка в ендпоінті статусу")
+async def server_status_encrypted(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для перевірки статусу сервера (повністю шифрований)"""
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        logger.info(f"Отримано запит статусу: {decrypted_data}")
-        
-        # Готуємо відповідь
-        response_data = {
-            "status": "OK",
-            "server_time": asyncio.get_event_loop().time(),
-            "platform": "render" if is_render_platform() else "local",
-            "endpoints": ["/status", "/health", "/full-restart", "/receive-encrypted", "/update-config", "/restore-config", "/get-config", "/get-config-info"],
-            "bot_running": bot_task is not None and not bot_task.done(),
-            "bot_status": "on" if (bot_task is not None and not bot_task.done()) else "off"
-        }
-        
-        # Шифруємо всю відповідь
-        encrypted_response = encrypt_data(response_data, encryption_key)
-        return encrypted_response
-        
-    except Exception as e:
-        logger.error(f"Помилка в ендпоінті статусу: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/full-restart")
-async def full_restart_encrypted(request: Request):
+    logger.info(f"Отримано запит статусу: {decrypted_data}")
+    
+    return {
+        "status": "OK",
+        "server_time": asyncio.get_event_loop().time(),
+        "platform": "render" if is_render_platform() else "local",
+        "endpoints": ["/status", "/health", "/full-restart", "/receive-encrypted", "/update-config", "/restore-config", "/get-config", "/get-config-info"],
+        "bot_running": bot_task is not None and not bot_task.done(),
+        "bot_status": "on" if (bot_task is not None and not bot_task.done()) else "off",
+        "outbound_queue": await bot_instance.outbound_queue.stats() if bot_instance else None,
+        "bot_api_pool": bot_instance.bot_api_pool_metrics() if bot_instance else None,
+        "pipeline": bot_instance.pipeline_stats() if bot_instance else None,
+        "delivery_lanes": bot_instance.delivery_stats() if bot_instance else None,
+        "digest": bot_instance.digest_stats() if bot_instance else None,
+        "latency": bot_instance.latency_stats() if bot_instance else None,
+        "polling": bot_instance.polling_stats() if bot_instance else None
+    }
+
+@encrypted_rpc("/full-restart", "Помилка при перезапуску сервера")
+async def full_restart_encrypted(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для повного перезапуска сервера (повністю шифрований)"""
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        logger.info(f"Отримано запит перезапуску: {decrypted_data}")
-        
-        # Можна додати додаткову перевірку автентифікації тут
-        if decrypted_data.get("auth_token") != "secure-token":
-            raise ValueError("Invalid authentication token")
-        
-        logger.info("Ініційовано повний перезапуск сервера")
-        
-        # Готуємо відповідь перед перезапуском
-        response_data = {
-            "status": "restarting",
-            "message": "Server is restarting",
-            "platform": "render" if is_render_platform() else "local",
-            "timestamp": asyncio.get_event_loop().time()
-        }
-        
-        encrypted_response = encrypt_data(response_data, encryption_key)
-        
-        # Перезапускаємо сервер (асинхронно)
-        asyncio.create_task(perform_restart())
-        
-        return encrypted_response
-        
-    except Exception as e:
-        logger.error(f"Помилка при перезапуску сервера: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/receive-encrypted")
-async def receive_encrypted_data(request: Request):
+    logger.info(f"Отримано запит перезапуску: {decrypted_data}")
+    
+    # Можна додати додаткову перевірку автентифікації тут
+    if decrypted_data.get("auth_token") != "secure-token":
+        raise ValueError("Invalid authentication token")
+    
+    logger.info("Ініційовано повний перезапуск сервера")
+    
+    # Перезапускаємо сервер (асинхронно), відповідь встигає піти до перезапуску
+    asyncio.create_task(perform_restart())
+    
+    return {
+        "status": "restarting",
+        "message": "Server is restarting",
+        "platform": "render" if is_render_platform() else "local",
+        "timestamp": asyncio.get_event_loop().time()
+    }
+
+@encrypted_rpc("/receive-encrypted", "Error processing request")
+async def receive_encrypted_data(decrypted_data: Any) -> Dict[str, Any]:
     """Endpoint to receive and decrypt encrypted data (fully encrypted)"""
     global decrypted_config_data, bot_task
     
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        if not isinstance(decrypted_data, dict):
-            raise ValueError("Expected a dictionary with encrypted data")
-             
-        # Зберігаємо дешифровані дані та сигналізуємо про отримання
-        decrypted_config_data = decrypted_data
-        config_received_event.set()
-        
-        # Запускаємо бота в окремому потоці, не зупиняючи сервер
-        if bot_task is None or bot_task.done():
-            bot_task = asyncio.create_task(start_bot_with_config())
-        
-        # Шифруємо всю відповідь
-        response_data = {"status": "success", "message": "Data received successfully, bot starting"}
-        encrypted_response = encrypt_data(response_data, encryption_key)
-        
-        return encrypted_response
-        
-    except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
-        error_data = {"error": str(e), "status_code": 400}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-    except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
-        error_data = {"error": f"Failed to process data: {str(e)}", "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/update-config")
-async def update_config_endpoint(request: Request):
+    if not isinstance(decrypted_data, dict):
+        raise ValueError("Expected a dictionary with encrypted data")
+    
+    # Зберігаємо дешифровані дані та сигналізуємо про отримання
+    decrypted_config_data = decrypted_data
+    config_received_event.set()
+    
+    # Запускаємо бота в окремому потоці, не зупиняючи сервер
+    if bot_task is None or bot_task.done():
+        bot_task = asyncio.create_task(start_bot_with_config())
+    
+    return {"status": "success", "message": "Data received successfully, bot starting"}
+
+@encrypted_rpc("/update-config", "Error updating config")
+async def update_config_endpoint(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для перезапису даних файла конфіга (повністю шифрований)"""
+    # Очікуємо, що дані містять поле 'config_data'
+    if 'config_data' not in decrypted_data:
+        raise ValueError("Missing 'config_data' in request")
+    
+    if not await asyncio.to_thread(update_config, decrypted_data['config_data']):
+        raise RpcError("Failed to update config")
+    
     try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        # Очікуємо, що дані містять поле 'config_data'
-        if 'config_data' not in decrypted_data:
-            raise ValueError("Missing 'config_data' in request")
-        
-        new_config_data = decrypted_data['config_data']
-        
-        if update_config(new_config_data):
-            # Готуємо відповідь перед перезапуском
-            response_data = {"status": "success", "message": "Config updated, restarting"}
-            encrypted_response = encrypt_data(response_data, encryption_key)
-            
-            # Перезапускаємо асинхронно
-            asyncio.create_task(perform_restart())
-            
-            return encrypted_response
-        else:
-            raise RuntimeError("Failed to update config")
-            
+        reload_result = await reload_config()
     except Exception as e:
-        logger.error(f"Error updating config: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/restore-config")
-async def restore_config_endpoint(request: Request):
+        # Новий файл не читається - повертаємо попередній
+        await asyncio.to_thread(restore_old_config)
+        await asyncio.to_thread(ConfigReader().reload)
+        raise RpcError(f"Invalid config, previous config restored: {str(e)}", status_code=400)
+    
+    return {
+        "status": "success",
+        "message": "Config updated, restarting" if reload_result["mode"] == "restart" else "Config updated and applied",
+        "reload": reload_result
+    }
+
+@encrypted_rpc("/restore-config", "Error restoring config")
+async def restore_config_endpoint(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для повернення старого файла конфіга (повністю шифрований)"""
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        if restore_old_config():
-            # Готуємо відповідь перед перезапуском
-            response_data = {"status": "success", "message": "Config restored, restarting"}
-            encrypted_response = encrypt_data(response_data, encryption_key)
-            
-            # Перезапускаємо асинхронно
-            asyncio.create_task(perform_restart())
-            
-            return encrypted_response
-        else:
-            error_data = {"error": "No backup config found", "status_code": 404}
-            encrypted_error = encrypt_data(error_data, encryption_key)
-            return encrypted_error
-            
-    except Exception as e:
-        logger.error(f"Error restoring config: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/get-config")
-async def get_config_endpoint(request: Request):
+    if not restore_old_config():
+        raise RpcError("No backup config found", status_code=404)
+    
+    reload_result = await reload_config()
+    
+    return {
+        "status": "success",
+        "message": "Config restored, restarting" if reload_result["mode"] == "restart" else "Config restored and applied",
+        "reload": reload_result
+    }
+
+@encrypted_rpc("/get-config", "Error getting config", large_response=True)
+async def get_config_endpoint(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для отримання даних з конфігураційного файлу (повністю шифрований)"""
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        # Отримуємо інформацію про конфіг файл
-        config_info = get_config_info()
-        
-        # Отримуємо вміст конфіг файлу
-        config_content = read_config_file()
-        
-        # Формуємо відповідь
-        response_data = {
-            "status": "success",
-            "config_info": config_info,
-            "config_content": config_content
-        }
-        
-        # Шифруємо всю відповідь
-        encrypted_response = encrypt_data(response_data, encryption_key)
-        return encrypted_response
-            
-    except Exception as e:
-        logger.error(f"Error getting config: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
-
-@app.post("/get-config-info")
-async def get_config_info_endpoint(request: Request):
+    # Отримуємо інформацію про конфіг файл та його вміст
+    config_info = get_config_info()
+    config_content = await asyncio.to_thread(read_config_file)
+    
+    return {
+        "status": "success",
+        "config_info": config_info,
+        "config_content": config_content
+    }
+
+@encrypted_rpc("/get-config-info", "Error getting config info")
+async def get_config_info_endpoint(decrypted_data: Any) -> Dict[str, Any]:
     """Ендпоінт для отримання інформації про конфігураційний файл (повністю шифрований)"""
-    try:
-        encryption_key = await get_encryption_key()
-        
-        # Отримуємо та дешифруємо запит
-        encrypted_request = await request.body()
-        decrypted_data = decrypt_data(encrypted_request.decode(), encryption_key)
-        
-        # Отримуємо інформацію про конфіг файл
-        config_info = get_config_info()
-        
-        # Формуємо відповідь
-        response_data = {
-            "status": "success",
-            "config_info": config_info
-        }
-        
-        # Шифруємо всю відповідь
-        encrypted_response = encrypt_data(response_data, encryption_key)
-        return encrypted_response
-            
-    except Exception as e:
-        logger.error(f"Error getting config info: {str(e)}")
-        error_data = {"error": str(e), "status_code": 500}
-        encryption_key = await get_encryption_key()
-        encrypted_error = encrypt_data(error_data, encryption_key)
-        return encrypted_error
+    return {
+        "status": "success",
+        "config_info": get_config_info()
+    }
 
 async def run_bot_with_config(config_data: dict):
     """Запуск бота з конфігураційними даними"""
+    global bot_instance
+    
     try:
         if not config_data.get('Token'):
             raise ValueError("Token not found in configuration")
         
         # Створюємо та запускаємо бота
-        bot = Bot_1(config_data=config_data)
-        await bot.run()
+        bot_instance = Bot_1(config_data=config_data)
+        await bot_instance.run()
         
     except Exception as e:
         logger.error(f"Помилка при запуску бота: {str(e)}")
@@ -0,0 +1,266 @@
+from bisect import bisect_left
+import threading
+import time
+
+# Межі гістограм тривалості за замовчуванням (секунди)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Дочірня метрика для конкретних значень міток (кешується)"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """Значення обчислюється функцією під час збору метрик"""
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []
+            if value is None:
+                return []
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(float(value))}"]
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, values, ('le', _format_value(float(bound))))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        """Контекстний менеджер, що вимірює тривалість блоку"""
+        return self._default().time()
+
+
+class MetricsRegistry:
+    """
+    Реєстр метрик у пам'яті процесу з виводом у текстовому форматі Prometheus.
+    Оновлення метрики - це зміна числа в пам'яті без блокувань, тож інструментування
+    гарячих шляхів майже нічого не коштує; форматування відбувається лише при зборі (GET /metrics)
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} вже зареєстрована з іншим типом")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+# Спільний реєстр процесу
+REGISTRY = MetricsRegistry()
+
+# Отримання повідомлень з Telethon
+FETCH_SECONDS = REGISTRY.histogram(
+    "telegram_fetch_seconds", "Час отримання нових повідомлень каналу (з очікуванням лімітів)", ("channel",)
+)
+FETCH_ERRORS = REGISTRY.counter("telegram_fetch_errors_total", "Невдалі спроби отримання повідомлень", ("channel",))
+FLOOD_WAITS = REGISTRY.counter("telegram_flood_waits_total", "Отримані FloodWaitError", ("channel",))
+FETCHED_MESSAGES = REGISTRY.counter("telegram_messages_fetched_total", "Отримані повідомлення каналів", ("source",))
+
+# Аналіз повідомлень
+ANALYZE_SECONDS = REGISTRY.histogram(
+    "message_analyze_seconds", "Тривалість analyze_message_with_patterns",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+MATCHED_MESSAGES = REGISTRY.counter("messages_matched_total", "Повідомлення, що спрацювали на правила")
+
+# Відправка через Bot API
+SEND_RESULTS = REGISTRY.counter("bot_api_sends_total", "Результати відправки повідомлень", ("outcome",))
+SEND_SECONDS = REGISTRY.histogram("bot_api_send_seconds", "Тривалість виклику send_message")
+SEND_RETRIES = REGISTRY.counter("bot_api_send_retries_total", "Повторні спроби відправки", ("reason",))
+NOTIFICATIONS_ENQUEUED = REGISTRY.counter("notifications_enqueued_total", "Записи, поставлені в чергу сповіщень")
+
+# Сховище користувачів
+USER_STORE_FLUSH_SECONDS = REGISTRY.histogram("user_store_flush_seconds", "Тривалість пакетного запису в users.db")
+USER_STORE_FLUSH_ERRORS = REGISTRY.counter("user_store_flush_errors_total", "Помилки запису в users.db")
+USER_STORE_WRITES = REGISTRY.counter("user_store_writes_total", "Зміни, записані в users.db", ("kind",))
+
+# Шифровані ендпоінти
+CRYPTO_SECONDS = REGISTRY.histogram("rpc_crypto_seconds", "Час шифрування/розшифрування запитів API", ("operation",))
+RPC_REQUESTS = REGISTRY.counter("rpc_requests_total", "Запити до шифрованих ендпоінтів", ("path", "status"))
@@ -0,0 +1,325 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from pattern_matcher import DEFAULT_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_QUEUE_FILE = "outbound.db"
+
+
+class OutboundQueue:
+    """
+    Дискова черга вихідних сповіщень (SQLite, WAL).
+    Кожен запис ідентифікується парою (message_key, user_id): повторна постановка
+    того самого повідомлення тому ж користувачу ігнорується, а доставлений запис
+    позначається як sent і більше не відправляється. Незавершені записи переживають
+    перезапуск процесу і дочитуються диспетчером після старту.
+    """
+
+    def __init__(self, db_path=OUTBOUND_QUEUE_FILE, retention=86400):
+        self.db_path = db_path
+        self.retention = float(retention)
+        self._conn = None
+        self._lock = asyncio.Lock()
+
+    def _open(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                message_key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS deliveries (
+                message_key TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                priority INTEGER NOT NULL DEFAULT 1,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL,
+                last_error TEXT,
+                PRIMARY KEY (message_key, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries (status, next_attempt_at);
+        """)
+        # Черги, створені до появи пріоритетів
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(deliveries)")}
+        if 'priority' not in columns:
+            self._conn.execute(
+                f"ALTER TABLE deliveries ADD COLUMN priority INTEGER NOT NULL DEFAULT {DEFAULT_PRIORITY}"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_lane ON deliveries (status, priority, next_attempt_at)"
+        )
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def open(self):
+        await self._run(self._open)
+
+    def _enqueue(self, message_key, text, user_ids, priority):
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO messages (message_key, text, created_at) VALUES (?, ?, ?)",
+                (message_key, text, now)
+            )
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO deliveries (message_key, user_id, priority, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(message_key, user_id, priority, now, now) for user_id in user_ids]
+            )
+            return self._conn.total_changes - before
+
+    async def enqueue(self, message_key, text, user_ids, priority=DEFAULT_PRIORITY):
+        """Ставить повідомлення в чергу для списку користувачів; повертає кількість нових записів"""
+        return await self._run(self._enqueue, message_key, text, list(user_ids), int(priority))
+
+    def _due(self, limit):
+        rows = self._conn.execute(
+            "SELECT d.message_key, d.user_id, m.text, d.attempts, d.priority, d.created_at "
+            "FROM deliveries d JOIN messages m ON m.message_key = d.message_key "
+            "WHERE d.status = 'pending' AND d.next_attempt_at <= ? "
+            "ORDER BY d.priority DESC, d.next_attempt_at LIMIT ?",
+            (time.time(), limit)
+        )
+        return rows.fetchall()
+
+    async def due(self, limit=500):
+        """
+        Записи, готові до відправки, спочатку з вищим пріоритетом:
+        [(message_key, user_id, text, attempts, priority, created_at), ...]
+        """
+        return await self._run(self._due, limit)
+
+    def _next_due_in(self):
+        row = self._conn.execute(
+            "SELECT MIN(next_attempt_at) FROM deliveries WHERE status = 'pending'"
+        ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    async def next_due_in(self):
+        """Секунд до найближчого запланованого повтору (None, якщо черга порожня)"""
+        return await self._run(self._next_due_in)
+
+    def _apply_results(self, sent, retries, failed):
+        now = time.time()
+        with self._conn:
+            if sent:
+                self._conn.executemany(
+                    "UPDATE deliveries SET status = 'sent', attempts = attempts + 1, updated_at = ? "
+                    "WHERE message_key = ? AND user_id = ?",
+                    [(now, key, user_id) for key, user_id in sent]
+                )
+            if retries:
+                self._conn.executemany(
+                    "UPDATE deliveries SET attempts = attempts + 1, next_attempt_at = ?, updated_at = ?, last_error = ? "
+                    "WHERE message_key = ? AND user_id = ?",
+                    [(now + delay, now, error, key, user_id) for key, user_id, delay, error in retries]
+                )
+            if failed:
+                self._conn.executemany(
+                    "UPDATE deliveries SET status = 'failed', attempts = attempts + 1, updated_at = ?, last_error = ? "
+                    "WHERE message_key = ? AND user_id = ?",
+                    [(now, error, key, user_id) for key, user_id, error in failed]
+                )
+
+    async def apply_results(self, sent=(), retries=(), failed=()):
+        """
+        Фіксує результати відправки одним записом:
+        sent - [(key, user_id)], retries - [(key, user_id, delay, error)], failed - [(key, user_id, error)]
+        """
+        await self._run(self._apply_results, list(sent), list(retries), list(failed))
+
+    def _stats(self):
+        now = time.time()
+        counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall())
+        oldest = self._conn.execute(
+            "SELECT MIN(created_at) FROM deliveries WHERE status = 'pending'"
+        ).fetchone()[0]
+        lanes = self._conn.execute(
+            "SELECT priority, COUNT(*) FROM deliveries WHERE status = 'pending' GROUP BY priority"
+        ).fetchall()
+        return {
+            "depth": counts.get('pending', 0),
+            "depth_by_priority": {priority: count for priority, count in lanes},
+            "oldest_age": round(now - oldest, 3) if oldest is not None else 0.0,
+            "sent": counts.get('sent', 0),
+            "failed": counts.get('failed', 0)
+        }
+
+    async def stats(self):
+        """Глибина черги, вік найстаршого невідправленого запису (с) та лічильники"""
+        return await self._run(self._stats)
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM deliveries WHERE status != 'pending' AND updated_at < ?", (cutoff,)
+            )
+            self._conn.execute(
+                "DELETE FROM messages WHERE created_at < ? AND message_key NOT IN "
+                "(SELECT DISTINCT message_key FROM deliveries)", (cutoff,)
+            )
+
+    async def purge(self):
+        """Видаляє завершені записи, старші за retention"""
+        await self._run(self._purge)
+
+    async def close(self):
+        async with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class OutboundDispatcher:
+    """
+    Фоновий відправник записів OutboundQueue через Broadcaster.
+    Тимчасові помилки повторюються з експоненційною затримкою (до max_attempts), відхилені Bot API
+    записи одразу позначаються невдалими,
+    недоступні користувачі передаються в on_unreachable, а результати кожного пакета
+    (ключі доставлених та остаточно невдалих записів) - в on_results.
+    Результати фіксуються після кожного пакета (batch_size), тож після аварійного
+    завершення повторно можуть піти лише повідомлення з останнього незафіксованого пакета.
+    Записи з вищим пріоритетом відправляються першими; якщо під час розсилки
+    з'являється терміновіше сповіщення, поточний пакет зупиняється, а невідправлені
+    записи залишаються в черзі до наступного проходу.
+    """
+
+    def __init__(self, queue, broadcaster, bot, on_unreachable=None, on_results=None,
+                 batch_size=100, max_attempts=5, retry_base_delay=30, purge_interval=3600):
+        self.queue = queue
+        self.broadcaster = broadcaster
+        self.bot = bot
+        self.on_unreachable = on_unreachable
+        self.on_results = on_results
+        self.batch_size = int(batch_size)
+        self.max_attempts = int(max_attempts)
+        self.retry_base_delay = float(retry_base_delay)
+        self.purge_interval = float(purge_interval)
+        self._wakeup = asyncio.Event()
+        self._preempt_priority = None
+        self._lanes = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self, priority=None):
+        """Будить диспетчер після постановки нових записів у чергу з пріоритетом priority"""
+        if priority is not None and (self._preempt_priority is None or priority > self._preempt_priority):
+            self._preempt_priority = priority
+        self._wakeup.set()
+
+    def _record_delivery(self, priority, created_at):
+        lane = self._lanes.setdefault(priority, {"delivered": 0, "total_latency": 0.0, "max_latency": 0.0})
+        latency = max(0.0, time.time() - created_at)
+        lane["delivered"] += 1
+        lane["total_latency"] += latency
+        lane["max_latency"] = max(lane["max_latency"], latency)
+
+    def lane_stats(self):
+        """Час від постановки в чергу до доставки (с) окремо для кожного пріоритету"""
+        return {
+            priority: {
+                "delivered": lane["delivered"],
+                "avg_latency": round(lane["total_latency"] / lane["delivered"], 3),
+                "max_latency": round(lane["max_latency"], 3)
+            }
+            for priority, lane in sorted(self._lanes.items(), reverse=True)
+        }
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _send_batch(self, batch):
+        sent, retries, failed, unreachable = [], [], [], []
+        pending = iter(batch)
+        preempted = False
+
+        async def worker():
+            nonlocal preempted
+            for message_key, user_id, text, attempts, priority, created_at in pending:
+                # Надійшло терміновіше сповіщення: решта пакета залишається pending
+                if self._preempt_priority is not None and priority < self._preempt_priority:
+                    preempted = True
+                    break
+                outcome = await self.broadcaster.send(self.bot, user_id, text)
+                if outcome == "sent":
+                    sent.append((message_key, user_id))
+                    self._record_delivery(priority, created_at)
+                elif outcome == "unreachable":
+                    failed.append((message_key, user_id, "unreachable"))
+                    unreachable.append(user_id)
+                elif outcome == "rejected":
+                    # Постійна помилка (BadRequest, Forbidden): повтор дасть той самий результат
+                    failed.append((message_key, user_id, "rejected"))
+                elif attempts + 1 >= self.max_attempts:
+                    failed.append((message_key, user_id, "max attempts"))
+                else:
+                    delay = self.retry_base_delay * (2 ** attempts)
+                    retries.append((message_key, user_id, delay, "send failed"))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.broadcaster.concurrency, len(batch)))))
+        await self.queue.apply_results(sent, retries, failed)
+
+        if unreachable and self.on_unreachable:
+            self.on_unreachable(unreachable)
+        if self.on_results and (sent or failed):
+            self.on_results([key for key, _user_id in sent], [key for key, _user_id, _error in failed])
+
+        logger.info(
+            f"Черга сповіщень: відправлено {len(sent)}, повтор {len(retries)}, невдало {len(failed)}"
+            + (" (перервано терміновішим сповіщенням)" if preempted else "")
+        )
+
+    async def _run(self):
+        last_purge = time.monotonic()
+
+        while True:
+            try:
+                self._wakeup.clear()
+                self._preempt_priority = None
+                batch = await self.queue.due(self.batch_size)
+                if batch:
+                    await self._send_batch(batch)
+                    continue
+
+                if time.monotonic() - last_purge > self.purge_interval:
+                    await self.queue.purge()
+                    last_purge = time.monotonic()
+
+                # Чекаємо нових записів або найближчого повтору
+                timeout = await self.queue.next_due_in()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout if timeout is not None else 60)
+                except asyncio.TimeoutError:
+                    pass
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Помилка диспетчера черги сповіщень: {str(e)}")
+                await asyncio.sleep(5)
@@ -0,0 +1,135 @@
+from rule_expressions import ExpressionPlan
+from term_index import TermIndex, DEFAULT_MATCH_MODE
+
+# Порядок перевірки блоків MessagePatterns (визначає пріоритет шаблону повідомлення)
+PATTERN_KINDS = ('any_of', 'all_of', 'none_of')
+# Іменовані правила-вирази (AND/OR/NOT/NEAR/k): блок "expressions": {"назва": {"expression": ...}}
+EXPRESSION_KIND = 'expression'
+
+# Пріоритет правила (поле "priority"): назва рівня або число, більше - терміновіше
+PRIORITY_LEVELS = {'low': 0, 'normal': 1, 'high': 2, 'critical': 3}
+DEFAULT_PRIORITY = PRIORITY_LEVELS['normal']
+
+
+def rule_priority(pattern_config):
+    """Числовий пріоритет правила; невідомі значення вважаються normal"""
+    priority = pattern_config.get('priority', DEFAULT_PRIORITY)
+    if isinstance(priority, bool):
+        return DEFAULT_PRIORITY
+    if isinstance(priority, int):
+        return priority
+    if isinstance(priority, str):
+        priority = priority.strip().lower()
+        if priority.lstrip('-').isdigit():
+            return int(priority)
+        return PRIORITY_LEVELS.get(priority, DEFAULT_PRIORITY)
+    return DEFAULT_PRIORITY
+
+
+def normalize_pattern_rules(message_patterns):
+    """
+    Зводить MessagePatterns до єдиного списку правил [{"kind": ..., "keywords": [...], ...}].
+    Приймає як один блок {"any_of": {...}, "all_of": {...}, "expressions": {"назва": {...}}},
+    так і список таких блоків (повторні ключі MessagePatterns у bot.config) або вже готових правил з полем "kind".
+    Правило-вираз можна задати й рядком: "expressions": {"назва": "ракет AND Київ"}
+    Порядок правил визначає пріоритет шаблону повідомлення
+    """
+    if not message_patterns:
+        return []
+
+    blocks = message_patterns if isinstance(message_patterns, list) else [message_patterns]
+    rules = []
+    for block in blocks:
+        if not isinstance(block, dict):
+            continue
+        if 'kind' in block:
+            rules.append(block)
+            continue
+        for kind in PATTERN_KINDS:
+            if kind in block:
+                rules.append({**(block[kind] or {}), "kind": kind})
+        for name, rule in (block.get('expressions') or {}).items():
+            if isinstance(rule, str):
+                rule = {"expression": rule}
+            rules.append({**rule, "kind": EXPRESSION_KIND, "name": name})
+    return rules
+
+
+class PatternMatcher:
+    """
+    Скомпільований матчер для MessagePatterns.
+    Будується один раз при завантаженні патернів: ключові слова всіх блоків і терміни всіх
+    правил-виразів зводяться в один TermIndex. Повідомлення токенізується та нормалізується
+    один раз (ua_text.tokenize), і один прохід по словах знаходить терміни для всіх правил.
+    Режим збігу задається полем правила "match": exact (за замовчуванням), prefix або stem.
+    """
+
+    def __init__(self, message_patterns):
+        self.rules = []
+        self.term_index = TermIndex()
+        self._postings = {}
+        expressions = []
+
+        for pattern_config in normalize_pattern_rules(message_patterns):
+            kind = pattern_config.get('kind')
+            mode = pattern_config.get('match', DEFAULT_MATCH_MODE)
+            if kind == EXPRESSION_KIND:
+                expressions.append((len(self.rules), pattern_config.get('expression'), mode))
+                self.rules.append((kind, pattern_config, []))
+                continue
+            if kind not in PATTERN_KINDS:
+                continue
+            keywords = [word for word in pattern_config.get('keywords', []) if isinstance(word, str) and word]
+            rule_index = len(self.rules)
+            self.rules.append((kind, pattern_config, keywords))
+
+            for position, word in enumerate(keywords):
+                term_id = self.term_index.add(word, mode)
+                if term_id is not None:
+                    self._postings.setdefault(term_id, []).append((rule_index, position))
+
+        # Правила-вирази перевіряються спільним планом за тими ж знайденими термінами
+        self._expression_plan = ExpressionPlan(expressions, self.term_index) if expressions else None
+
+    @property
+    def keyword_count(self):
+        return len(self.term_index)
+
+    def match(self, message_text):
+        """
+        Повертає список спрацьованих правил у порядку normalize_pattern_rules:
+        [(kind, pattern_config, found_words), ...]
+        Для none_of found_words містить усі ключові слова блоку (уникнуті слова),
+        для правил-виразів - знайдені терміни виразу
+        """
+        if not self.rules:
+            return []
+
+        term_positions = self.term_index.scan_text(message_text)
+
+        expression_hits = {}
+        if self._expression_plan is not None:
+            expression_hits = self._expression_plan.evaluate_positions(term_positions)
+
+        found_positions = [set() for _ in self.rules]
+        for term_id in term_positions:
+            for rule_index, position in self._postings.get(term_id, ()):
+                found_positions[rule_index].add(position)
+
+        triggered = []
+        for rule_index, (kind, pattern_config, keywords) in enumerate(self.rules):
+            positions = found_positions[rule_index]
+            if kind == 'any_of':
+                if positions:
+                    triggered.append((kind, pattern_config, [keywords[i] for i in sorted(positions)]))
+            elif kind == 'all_of':
+                if keywords and len(positions) == len(keywords):
+                    triggered.append((kind, pattern_config, [keywords[i] for i in sorted(positions)]))
+            elif kind == 'none_of':
+                if keywords and not positions:
+                    triggered.append((kind, pattern_config, list(keywords)))
+            elif kind == EXPRESSION_KIND:
+                if rule_index in expression_hits:
+                    triggered.append((kind, pattern_config, expression_hits[rule_index]))
+
+        return triggered
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    """
+    Етап конвеєра: обмежена черга вхідних елементів та workers обробників.
+    Результат обробника (якщо не None) передається в чергу наступного етапу;
+    коли вона заповнена, обробник чекає - так повільний етап гальмує попередні (backpressure)
+    """
+
+    def __init__(self, name, handler, workers=1, maxsize=1000):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.queue = asyncio.Queue(maxsize=max(0, int(maxsize)))
+        self.next_stage = None
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._tasks = []
+
+    async def put(self, item):
+        await self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def start(self):
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                result = await self.handler(item)
+                self.processed += 1
+                if result is not None and self.next_stage is not None:
+                    await self.next_stage.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Помилка на етапі {self.name}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "capacity": self.queue.maxsize,
+            "workers": self.workers,
+            "processed": self.processed,
+            "errors": self.errors
+        }
+
+
+class Pipeline:
+    """Послідовність етапів PipelineStage, з'єднаних обмеженими чергами"""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+
+    async def submit(self, item):
+        """Додає елемент у перший етап; чекає, якщо його черга заповнена"""
+        await self.stages[0].put(item)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    async def stop(self):
+        for stage in self.stages:
+            await stage.stop()
+
+    async def join(self):
+        """Очікує, поки всі етапи оброблять уже додані елементи"""
+        for stage in self.stages:
+            await stage.queue.join()
+
+    def stats(self):
+        """Глибина черг та лічильники кожного етапу"""
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,188 @@
+import random
+import time
+
+
+class ChannelPollState:
+    __slots__ = ('channel_id', 'rate', 'last_message_id', 'last_poll_at', 'next_poll_at', 'interval',
+                 'desired_interval', 'failures', 'polls', 'errors', 'last_error')
+
+    def __init__(self, channel_id, next_poll_at):
+        self.channel_id = channel_id
+        # Згладжена частота публікацій (повідомлень/с); None - ще невідома
+        self.rate = None
+        self.last_message_id = None
+        self.last_poll_at = None
+        self.next_poll_at = next_poll_at
+        self.interval = None
+        self.desired_interval = None
+        self.failures = 0
+        self.polls = 0
+        self.errors = 0
+        self.last_error = None
+
+
+class PollScheduler:
+    """
+    Розклад опитування каналів у poll-режимі.
+    Для кожного каналу оцінюється частота публікацій (експоненційне згладжування приросту ID
+    повідомлень між опитуваннями), і канал опитується приблизно раз на одне нове повідомлення:
+    інтервал 1/частота в межах [min_interval, max_interval]; канал з невідомою частотою -
+    раз на base_interval. Якщо сумарна частота опитувань перевищує budget (опитувань на хвилину),
+    усі інтервали пропорційно розтягуються, тож активні канали все одно опитуються частіше за тихі.
+    Помилка каналу відкладає лише цей канал (експоненційно до backoff_max або на час FloodWait).
+    За замовчуванням budget дорівнює вартості опитування всіх каналів раз на base_interval
+    """
+
+    def __init__(self, base_interval=300, min_interval=30, max_interval=1800, budget=None,
+                 smoothing=0.3, backoff_base=30, backoff_max=1800, jitter=0.1, seed=None):
+        self.base_interval = float(base_interval)
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.budget = float(budget) if budget else None
+        self.smoothing = float(smoothing)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.jitter = float(jitter)
+        self._random = random.Random(seed)
+        self._channels = {}
+        # Сума бажаних частот опитування всіх каналів (опитувань/с)
+        self._demand = 0.0
+
+    @classmethod
+    def from_config(cls, config_data):
+        scheduler = cls()
+        scheduler.configure(config_data)
+        return scheduler
+
+    def configure(self, config_data):
+        """Параметри з конфігурації (при гарячому оновленні стан каналів зберігається)"""
+        self.base_interval = float(config_data.get('PollInterval', 300))
+        self.min_interval = float(config_data.get('PollMinInterval', min(30.0, self.base_interval)))
+        self.max_interval = float(config_data.get('PollMaxInterval', max(1800.0, self.base_interval)))
+        budget = config_data.get('PollBudgetPerMinute')
+        self.budget = float(budget) if budget else None
+        self.smoothing = float(config_data.get('PollRateSmoothing', 0.3))
+        self.backoff_max = float(config_data.get('PollBackoffMax', 1800))
+        self._recompute_demand()
+
+    def set_channels(self, channel_ids, now=None):
+        """Оновлює список каналів: нові опитуються одразу, стан наявних зберігається"""
+        now = time.monotonic() if now is None else now
+        channel_ids = [str(channel_id) for channel_id in channel_ids]
+        self._channels = {
+            channel_id: self._channels.get(channel_id) or ChannelPollState(channel_id, now)
+            for channel_id in channel_ids
+        }
+        self._recompute_demand()
+
+    def __len__(self):
+        return len(self._channels)
+
+    def budget_per_second(self):
+        if self.budget:
+            return self.budget / 60
+        return len(self._channels) / self.base_interval if self.base_interval > 0 else None
+
+    def _desired_interval(self, state):
+        if state.rate is None:
+            interval = self.base_interval
+        elif state.rate <= 0:
+            interval = self.max_interval
+        else:
+            interval = 1 / state.rate
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def _recompute_demand(self):
+        for state in self._channels.values():
+            state.desired_interval = self._desired_interval(state)
+        self._demand = sum(1 / state.desired_interval for state in self._channels.values())
+
+    def _update_desired(self, state):
+        desired = self._desired_interval(state)
+        self._demand += 1 / desired - 1 / state.desired_interval
+        state.desired_interval = desired
+
+    def _budget_scale(self):
+        """У скільки разів розтягнути інтервали, щоб уміститися в бюджет опитувань"""
+        budget = self.budget_per_second()
+        if not budget:
+            return 1.0
+        return max(1.0, self._demand / budget)
+
+    def _schedule(self, state, delay, now):
+        # Невеликий розкид, щоб канали з однаковим інтервалом не опитувалися одночасно
+        state.next_poll_at = now + delay * (1 + self._random.uniform(0, self.jitter))
+
+    def due(self, now=None):
+        """Канали, які пора опитати, від найбільш прострочених"""
+        now = time.monotonic() if now is None else now
+        due = [state for state in self._channels.values() if state.next_poll_at <= now]
+        due.sort(key=lambda state: state.next_poll_at)
+        return [state.channel_id for state in due]
+
+    def next_due_in(self, now=None):
+        """Секунд до найближчого опитування (None, якщо каналів немає)"""
+        if not self._channels:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(state.next_poll_at for state in self._channels.values()) - now)
+
+    def record_success(self, channel_id, last_message_id, now=None):
+        """Успішне опитування; last_message_id - найбільший ID повідомлення каналу після нього"""
+        state = self._channels.get(str(channel_id))
+        if state is None:
+            return
+        now = time.monotonic() if now is None else now
+
+        if last_message_id is not None:
+            if state.last_message_id is not None and state.last_poll_at is not None and now > state.last_poll_at:
+                new_messages = max(0, last_message_id - state.last_message_id)
+                observed = new_messages / (now - state.last_poll_at)
+                state.rate = observed if state.rate is None else (
+                    self.smoothing * observed + (1 - self.smoothing) * state.rate
+                )
+            state.last_message_id = max(last_message_id, state.last_message_id or last_message_id)
+
+        state.last_poll_at = now
+        state.polls += 1
+        state.failures = 0
+        self._update_desired(state)
+        state.interval = state.desired_interval * self._budget_scale()
+        self._schedule(state, state.interval, now)
+
+    def record_failure(self, channel_id, error=None, retry_after=None, now=None):
+        """Невдале опитування: канал відкладається окремо від решти"""
+        state = self._channels.get(str(channel_id))
+        if state is None:
+            return
+        now = time.monotonic() if now is None else now
+        state.failures += 1
+        state.errors += 1
+        state.last_error = error
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (state.failures - 1))
+        if retry_after:
+            delay = max(delay, float(retry_after))
+        self._schedule(state, delay, now)
+
+    def stats(self, now=None):
+        """Поточні інтервали, оцінки частоти та стан помилок каналів"""
+        now = time.monotonic() if now is None else now
+        budget = self.budget_per_second()
+        planned = sum(1 / state.interval for state in self._channels.values() if state.interval)
+        return {
+            "budget_per_minute": round(budget * 60, 2) if budget else None,
+            "planned_per_minute": round(planned * 60, 2),
+            "budget_scale": round(self._budget_scale(), 3),
+            "channels": {
+                state.channel_id: {
+                    "posts_per_hour": round(state.rate * 3600, 2) if state.rate is not None else None,
+                    "interval": round(state.interval, 1) if state.interval else None,
+                    "next_poll_in": round(max(0.0, state.next_poll_at - now), 1),
+                    "polls": state.polls,
+                    "failures": state.failures,
+                    "errors": state.errors,
+                    "last_error": state.last_error
+                }
+                for state in self._channels.values()
+            }
+        }
@@ -0,0 +1,219 @@
+import re
+
+from term_index import TermIndex, DEFAULT_MATCH_MODE
+from ua_text import tokenize
+
+# Токени виразу: дужки, NEAR/k, лапки з фразою або окреме слово
+_EXPR_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|NEAR/(\d+)\b|"([^"]*)"|([^\s()"]+))')
+
+OPERATORS = ('AND', 'OR', 'NOT')
+# Суфікс терміна, що вмикає пошук за префіксом незалежно від режиму правила: ракет*
+PREFIX_MARKER = '*'
+
+
+class ExpressionSyntaxError(ValueError):
+    pass
+
+
+def _lex(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _EXPR_TOKEN_RE.match(expression, position)
+        if match is None or match.end() == position:
+            raise ExpressionSyntaxError(f"незрозумілий символ на позиції {position}: {expression[position:]!r}")
+        position = match.end()
+        open_paren, close_paren, near, phrase, word = match.groups()
+        if open_paren:
+            tokens.append(('(', None))
+        elif close_paren:
+            tokens.append((')', None))
+        elif near is not None:
+            tokens.append(('NEAR', int(near)))
+        elif phrase is not None:
+            tokens.append(('TERM', phrase))
+        elif word in OPERATORS:
+            tokens.append((word, None))
+        else:
+            tokens.append(('TERM', word))
+    return tokens
+
+
+class _Parser:
+    """
+    Рекурсивний розбір з пріоритетами NOT > NEAR > AND > OR.
+    Сусідні терміни без оператора з'єднуються через AND
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _lex(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionSyntaxError("порожній вираз")
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ExpressionSyntaxError(f"зайвий токен {self.tokens[self.position][0]} у '{self.expression}'")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() in ('AND', 'NOT', 'TERM', '('):
+            if self.peek() == 'AND':
+                self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parse_not(self):
+        if self.peek() == 'NOT':
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_near()
+
+    def parse_near(self):
+        left = self.parse_primary()
+        pairs = []
+        while self.peek() == 'NEAR':
+            distance = self.take()[1]
+            right = self.parse_primary()
+            if left[0] != 'term' or right[0] != 'term':
+                raise ExpressionSyntaxError("операндами NEAR можуть бути лише слова або фрази")
+            pairs.append(('near', left, right, distance))
+            left = right
+        if not pairs:
+            return left
+        return pairs[0] if len(pairs) == 1 else ('and', pairs)
+
+    def parse_primary(self):
+        kind = self.peek()
+        if kind == '(':
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise ExpressionSyntaxError(f"не закрита дужка у '{self.expression}'")
+            self.take()
+            return node
+        if kind == 'TERM':
+            term = self.take()[1]
+            if not tokenize(term.rstrip(PREFIX_MARKER)):
+                raise ExpressionSyntaxError(f"термін '{term}' не містить слів")
+            return ('term', term)
+        raise ExpressionSyntaxError(f"очікується слово або '(' у '{self.expression}', отримано {kind}")
+
+
+def parse_expression(expression):
+    """Розбирає вираз правила в дерево; при синтаксичній помилці - ExpressionSyntaxError"""
+    if not isinstance(expression, str):
+        raise ExpressionSyntaxError("вираз має бути рядком")
+    return _Parser(expression).parse()
+
+
+class ExpressionPlan:
+    """
+    План перевірки набору правил-виразів за один прохід по словах повідомлення.
+    Усі терміни всіх правил зводяться в спільний TermIndex (його можна розділити з іншими правилами);
+    прохід по тексту збирає позиції знайдених термінів, після чого перевіряються лише правила,
+    що містять знайдені терміни (індекс термін -> правила), та правила, які істинні без жодного
+    терміна (наприклад "NOT навчання") - вони відомі заздалегідь.
+    """
+
+    def __init__(self, expressions, term_index=None):
+        """expressions - список (rule_id, вираз, режим збігу термінів)"""
+        self.term_index = term_index if term_index is not None else TermIndex()
+        self._term_rules = {}
+        self._rules = []
+        self._true_when_empty = []
+
+        for rule_id, expression, mode in expressions:
+            tree = self._bind(parse_expression(expression), mode or DEFAULT_MATCH_MODE)
+            self._rules.append((rule_id, tree))
+            if self._evaluate(tree, {}):
+                self._true_when_empty.append(len(self._rules) - 1)
+
+    @property
+    def term_count(self):
+        return len(self._term_rules)
+
+    def _bind(self, node, mode):
+        kind = node[0]
+        if kind == 'term':
+            term = node[1]
+            term_mode = mode
+            if term.endswith(PREFIX_MARKER):
+                term, term_mode = term.rstrip(PREFIX_MARKER), 'prefix'
+            term_id = self.term_index.add(term, term_mode)
+            self._term_rules.setdefault(term_id, set()).add(len(self._rules))
+            return ('term', term_id, term)
+        if kind in ('and', 'or'):
+            return (kind, [self._bind(child, mode) for child in node[1]])
+        if kind == 'not':
+            return ('not', self._bind(node[1], mode))
+        return ('near', self._bind(node[1], mode), self._bind(node[2], mode), node[3])
+
+    def _evaluate(self, node, positions):
+        kind = node[0]
+        if kind == 'term':
+            return node[1] in positions
+        if kind == 'and':
+            return all(self._evaluate(child, positions) for child in node[1])
+        if kind == 'or':
+            return any(self._evaluate(child, positions) for child in node[1])
+        if kind == 'not':
+            return not self._evaluate(node[1], positions)
+
+        _kind, left, right, distance = node
+        left_positions = positions.get(left[1])
+        right_positions = positions.get(right[1])
+        if not left_positions or not right_positions:
+            return False
+        return any(abs(p - q) <= distance for p in left_positions for q in right_positions)
+
+    def _found_terms(self, node, positions, found):
+        kind = node[0]
+        if kind == 'term':
+            if node[1] in positions and node[2] not in found:
+                found.append(node[2])
+        elif kind in ('and', 'or'):
+            for child in node[1]:
+                self._found_terms(child, positions, found)
+        elif kind == 'near':
+            self._found_terms(node[1], positions, found)
+            self._found_terms(node[2], positions, found)
+        return found
+
+    def evaluate(self, tokens):
+        """Спрацьовані правила для списку слів повідомлення: {rule_id: [знайдені терміни]}"""
+        if not self._rules:
+            return {}
+        return self.evaluate_positions(self.term_index.scan(tokens))
+
+    def evaluate_positions(self, positions):
+        """Те саме за вже знайденими позиціями термінів (результат TermIndex.scan)"""
+        candidates = set(self._true_when_empty)
+        for term_id in positions:
+            candidates |= self._term_rules.get(term_id, set())
+
+        triggered = {}
+        for rule_index in candidates:
+            rule_id, tree = self._rules[rule_index]
+            if self._evaluate(tree, positions):
+                triggered[rule_id] = self._found_terms(tree, positions, [])
+        return triggered
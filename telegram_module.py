@@ -1,14 +1,28 @@
-from telethon import TelegramClient
+from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError
 from telethon.tl.types import PeerChannel
 import asyncio
 import logging
+import time
+
+from rate_limit import TokenBucket
+from metrics import FETCH_SECONDS, FETCH_ERRORS, FLOOD_WAITS, FETCHED_MESSAGES
 
 logger = logging.getLogger(__name__)
 
+# Текст, яким замінюється повідомлення без тексту (фото, відео тощо)
+MEDIA_MESSAGE_PLACEHOLDER = "[Медіа-повідомлення без тексту]"
+
 # Глобальний клієнт для уникнення конфліктів сесій
 _client = None
 _client_lock = asyncio.Lock()
 
+# Зареєстровані обробники подій каналів (push-режим)
+_channel_handlers = []
+
+# Спільний ліміт запитів до Telegram для всіх опитувань каналів
+_fetch_bucket = None
+
 async def get_telegram_client(config_data):
     """Отримати або створити клієнт Telegram з блокуванням"""
     global _client
@@ -16,10 +30,12 @@ async def get_telegram_client(config_data):
     async with _client_lock:
         if _client is None:
             try:
+                # Короткі FloodWait Telethon чекає сам, довші обробляє fetch_channel_messages
                 _client = TelegramClient(
                     'session_name', 
                     int(config_data['ApiId']), 
-                    config_data['ApiHash']
+                    config_data['ApiHash'],
+                    flood_sleep_threshold=int(config_data.get('FloodSleepThreshold', 5))
                 )
                 await _client.start(phone=config_data['PhoneNumber'])
                 logger.info("Telegram клієнт успішно ініціалізований")
@@ -28,30 +44,55 @@ async def get_telegram_client(config_data):
                 raise
         return _client
 
+def install_telegram_client(client):
+    """
+    Підміняє спільний клієнт об'єктом з тим самим інтерфейсом (наприклад fake_telegram.FakeTelegramClient
+    для навантажувального тестування); None - наступний виклик get_telegram_client створить TelegramClient
+    """
+    global _client
+    _client = client
+
+def is_telegram_client_connected():
+    """Чи є активне з'єднання у спільного клієнта Telegram"""
+    return _client is not None and _client.is_connected()
+
 async def close_telegram_client():
     """Закрити клієнт Telegram"""
     global _client
     
     async with _client_lock:
         if _client:
+            for callback, event in _channel_handlers:
+                _client.remove_event_handler(callback, event)
+            _channel_handlers.clear()
             await _client.disconnect()
             _client = None
             logger.info("Telegram клієнт закритий")
 
-async def get_last_channel_message(config_data=None, channel_id=None):
+def _message_to_dict(message, edited=False):
+    """Перетворює повідомлення Telethon у словник для обробки ботом"""
+    return {
+        "id": message.id,
+        "message": message.text or MEDIA_MESSAGE_PLACEHOLDER,
+        "date": message.date.isoformat() if message.date else None,
+        "edit_date": message.edit_date.isoformat() if edited and message.edit_date else None,
+        "edited": edited
+    }
+
+async def get_new_channel_messages(config_data=None, channel_id=None, min_id=None):
     """
-    Отримання останнього повідомлення з конкретного каналу
+    Отримання всіх повідомлень каналу, новіших за курсор min_id (від старих до нових)
+    Якщо курсора ще немає, повертається лише останнє повідомлення для ініціалізації
     Повертає словник з інформацією:
     {
         "success": bool,
-        "message": str,
         "channel_id": str,
+        "messages": [{"id": int, "message": str, "date": str, "edited": bool}, ...],
+        "last_message_id": int або None,
         "error": str (якщо success=False)
     }
     """
-    client = None
     try:
-        # Перевіряємо обов'язкові параметри
         if not config_data:
             return {
                 "success": False,
@@ -75,67 +116,181 @@ async def get_last_channel_message(config_data=None, channel_id=None):
                     "channel_id": channel_id
                 }
         
-        # Отримуємо клієнт з блокуванням
         client = await get_telegram_client(config_data)
+        entity = PeerChannel(int(channel_id))
+        messages = []
         
-        # Отримуємо останнє повідомлення
-        messages = await client.get_messages(
-            entity=PeerChannel(int(channel_id)),
-            limit=1
-        )
-        
-        if not messages:
-            return {
-                "success": True,
-                "message": "[Канал порожній]",
-                "channel_id": channel_id
-            }
-        
-        last_message = messages[0]
-        message_text = last_message.text or "[Медіа-повідомлення без тексту]"
+        if min_id is None:
+            # Курсора немає: беремо лише останнє повідомлення
+            async for message in client.iter_messages(entity, limit=1):
+                messages.append(_message_to_dict(message))
+        else:
+            # Потокове отримання всього, що новіше за курсор, у хронологічному порядку
+            max_messages = int(config_data.get('MaxMessagesPerPoll', 100))
+            async for message in client.iter_messages(entity, min_id=int(min_id), reverse=True, limit=max_messages):
+                messages.append(_message_to_dict(message))
         
         return {
             "success": True,
-            "message": message_text,
             "channel_id": channel_id,
-            "date": last_message.date.isoformat() if last_message.date else None
+            "messages": messages,
+            "last_message_id": messages[-1]["id"] if messages else min_id
         }
-            
+    
+    except FloodWaitError:
+        # Обробляється у fetch_channel_messages: пауза лише для цього каналу
+        raise
     except Exception as e:
-        logger.error(f"Помилка при отриманні повідомлення з каналу {channel_id}: {str(e)}")
+        logger.error(f"Помилка при отриманні нових повідомлень з каналу {channel_id}: {str(e)}")
         return {
             "success": False,
-            "error": f"Помилка при отриманні повідомлення: {str(e)}",
+            "error": f"Помилка при отриманні повідомлень: {str(e)}",
             "channel_id": channel_id
         }
 
-async def get_messages_from_all_channels(config_data=None):
+def parse_channel_ids(config_data):
+    """Розбирає TargetChats у список ID каналів (рядки)"""
+    target_chats = config_data.get('TargetChats') if config_data else None
+    if not target_chats:
+        return []
+    
+    # Переконуємося, що target_chats є рядком перед викликом split()
+    if not isinstance(target_chats, str):
+        target_chats = str(target_chats)
+    
+    # Розділяємо по комах, фільтруємо пусті значення
+    return [id_str.strip() for id_str in target_chats.split(',') if id_str.strip()]
+
+async def register_channel_handlers(config_data, on_message, channel_ids=None):
     """
-    Отримання останніх повідомлень з усіх каналів у списку
-    Повертає список результатів для кожного каналу
+    Реєструє обробники NewMessage/MessageEdited на спільному клієнті для всіх каналів TargetChats.
+    on_message отримує словник того ж формату, що й get_new_channel_messages,
+    з одним повідомленням у полі "messages"
+    channel_ids - вже розібраний список каналів (ConfigSnapshot.channel_ids), інакше розбирається TargetChats
+    Повертає кількість каналів, на які встановлено підписку
     """
-    try:
-        if not config_data:
-            return {
+    if channel_ids is None:
+        channel_ids = parse_channel_ids(config_data)
+    if not channel_ids:
+        return 0
+    
+    client = await get_telegram_client(config_data)
+    chats = [PeerChannel(int(channel_id)) for channel_id in channel_ids]
+    
+    async def handle_update(event):
+        try:
+            message = event.message
+            peer = message.peer_id
+            channel_id = str(getattr(peer, 'channel_id', None) or event.chat_id)
+            FETCHED_MESSAGES.labels("push").inc()
+            await on_message({
+                "success": True,
+                "channel_id": channel_id,
+                "messages": [_message_to_dict(message, edited=isinstance(event, events.MessageEdited.Event))],
+                "last_message_id": message.id
+            })
+        except Exception as e:
+            logger.error(f"Помилка обробки оновлення з каналу: {str(e)}")
+    
+    async with _client_lock:
+        # Повторна реєстрація замінює попередні обробники
+        for callback, event in _channel_handlers:
+            client.remove_event_handler(callback, event)
+        _channel_handlers.clear()
+        
+        for event in (events.NewMessage(chats=chats), events.MessageEdited(chats=chats)):
+            client.add_event_handler(handle_update, event)
+            _channel_handlers.append((handle_update, event))
+    
+    logger.info(f"Push-режим: підписка на оновлення {len(channel_ids)} каналів")
+    return len(channel_ids)
+
+async def unregister_channel_handlers():
+    """Знімає push-обробники каналів (перехід з push-режиму на опитування)"""
+    async with _client_lock:
+        if _client:
+            for callback, event in _channel_handlers:
+                _client.remove_event_handler(callback, event)
+        _channel_handlers.clear()
+    
+    logger.info("Push-режим вимкнено, обробники оновлень каналів знято")
+
+def get_fetch_bucket(config_data):
+    """Повертає спільний token bucket для запитів до каналів (FetchRatePerSecond)"""
+    global _fetch_bucket
+    
+    rate = float(config_data.get('FetchRatePerSecond', 20))
+    if _fetch_bucket is None or _fetch_bucket.rate != rate:
+        _fetch_bucket = TokenBucket(rate)
+    return _fetch_bucket
+
+async def fetch_channel_messages(config_data, channel_id, min_id, semaphore, bucket, wait_flood=True):
+    """
+    Отримання нових повідомлень каналу з урахуванням лімітів.
+    При FloodWaitError чекає лише цей канал (не займаючи слот семафора), решта продовжує роботу.
+    wait_flood=False - без очікування: результат з помилкою та retry_after повертається одразу
+    (у poll-режимі канал відкладає PollScheduler, не затримуючи опитування інших каналів).
+    До результату додається fetch_time (секунди, включно з очікуванням лімітів)
+    """
+    max_flood_wait = int(config_data.get('MaxFloodWait', 300))
+    max_attempts = 3
+    started = time.perf_counter()
+    
+    for attempt in range(1, max_attempts + 1):
+        async with semaphore:
+            await bucket.acquire()
+            try:
+                result = await get_new_channel_messages(config_data, channel_id, min_id)
+                break
+            except FloodWaitError as e:
+                wait_seconds = e.seconds
+                FLOOD_WAITS.labels(channel_id).inc()
+        
+        if not wait_flood or wait_seconds > max_flood_wait or attempt == max_attempts:
+            logger.error(f"FloodWait {wait_seconds} с для каналу {channel_id}, пропускаємо до наступного опитування")
+            result = {
                 "success": False,
-                "error": "Відсутні дані конфігурації"
+                "error": f"FloodWait: потрібно зачекати {wait_seconds} с",
+                "channel_id": channel_id,
+                "retry_after": wait_seconds
             }
+            break
         
-        if 'TargetChats' not in config_data or not config_data['TargetChats']:
+        logger.warning(f"FloodWait {wait_seconds} с для каналу {channel_id}, повтор після паузи")
+        await asyncio.sleep(wait_seconds)
+    
+    result['fetch_time'] = time.perf_counter() - started
+    FETCH_SECONDS.labels(channel_id).observe(result['fetch_time'])
+    if result.get('success'):
+        FETCHED_MESSAGES.labels("poll").inc(len(result.get('messages', ())))
+    else:
+        FETCH_ERRORS.labels(channel_id).inc()
+    return result
+
+async def get_messages_from_all_channels(config_data=None, cursors=None, channel_ids=None, wait_flood=True):
+    """
+    Отримання нових повідомлень з усіх каналів у списку
+    cursors - словник {channel_id: ID останнього обробленого повідомлення}
+    channel_ids - вже розібраний список каналів (ConfigSnapshot.channel_ids), інакше розбирається TargetChats
+    wait_flood - чи чекати FloodWait всередині опитування (див. fetch_channel_messages)
+    Повертає список результатів для кожного каналу (формат get_new_channel_messages)
+    """
+    try:
+        if not config_data:
             return {
                 "success": False,
-                "error": "Відсутній список каналів у конфігурації"
+                "error": "Відсутні дані конфігурації"
             }
         
-        # Отримуємо список ID каналів
-        target_chats = config_data['TargetChats']
-        
-        # Переконуємося, що target_chats є рядком перед викликом split()
-        if not isinstance(target_chats, str):
-            target_chats = str(target_chats)
-        
-        # Розділяємо по комах, фільтруємо пусті значення
-        channel_ids = [id_str.strip() for id_str in target_chats.split(',') if id_str.strip()]
+        if channel_ids is None:
+            if 'TargetChats' not in config_data or not config_data['TargetChats']:
+                return {
+                    "success": False,
+                    "error": "Відсутній список каналів у конфігурації"
+                }
+            
+            # Отримуємо список ID каналів
+            channel_ids = parse_channel_ids(config_data)
         
         if not channel_ids:
             return {
@@ -143,27 +298,36 @@ async def get_messages_from_all_channels(config_data=None):
                 "error": "Список каналів порожній"
             }
         
-        # Отримуємо повідомлення з усіх каналів послідовно для уникнення блокування
-        results = []
-        for channel_id in channel_ids:
-            try:
-                result = await get_last_channel_message(config_data, channel_id)
-                results.append(result)
-                # Невелика затримка між запитами до різних каналів
-                await asyncio.sleep(1)
-            except Exception as e:
-                logger.error(f"Помилка при обробці каналу {channel_id}: {str(e)}")
-                results.append({
-                    "success": False,
-                    "error": f"Помилка обробки: {str(e)}",
-                    "channel_id": channel_id
-                })
+        # Паралельне отримання з обмеженням кількості одночасних запитів та їх частоти
+        semaphore = asyncio.Semaphore(max(1, int(config_data.get('FetchConcurrency', 10))))
+        bucket = get_fetch_bucket(config_data)
+        started = time.perf_counter()
+        
+        results = await asyncio.gather(*(
+            fetch_channel_messages(
+                config_data,
+                channel_id,
+                cursors.get(channel_id) if cursors else None,
+                semaphore,
+                bucket,
+                wait_flood
+            )
+            for channel_id in channel_ids
+        ))
+        
+        sweep_time = time.perf_counter() - started
+        slowest = max(results, key=lambda r: r.get('fetch_time', 0))
+        logger.info(
+            f"Опитування {len(channel_ids)} каналів за {sweep_time:.2f} с "
+            f"(найповільніший {slowest['channel_id']}: {slowest.get('fetch_time', 0):.2f} с)"
+        )
         
         return {
             "success": True,
             "results": results,
             "total_channels": len(channel_ids),
-            "successful_channels": sum(1 for r in results if r.get('success', False))
+            "successful_channels": sum(1 for r in results if r.get('success', False)),
+            "sweep_time": sweep_time
         }
             
     except Exception as e:
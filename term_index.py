@@ -0,0 +1,94 @@
+from ua_text import stem, tokenize
+
+# Режими збігу терміна зі словами повідомлення
+MATCH_MODES = ('exact', 'prefix', 'stem')
+DEFAULT_MATCH_MODE = 'exact'
+
+
+class TermIndex:
+    """
+    Індекс термінів (слів та фраз) усіх правил для пошуку за один прохід по словах повідомлення.
+    exact - слово збігається повністю, prefix - слово починається з терміна ("ракет" -> "ракетна"),
+    stem - збігаються основи слів ("ракети" -> "ракета").
+    Кандидати шукаються за першим словом терміна: для prefix перевіряються лише
+    префікси слова тих довжин, що є в індексі, тож вартість не залежить від кількості термінів
+    """
+
+    def __init__(self):
+        self._term_ids = {}
+        self.terms = []
+        self._first = {mode: {} for mode in MATCH_MODES}
+        self._prefix_lengths = ()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term, mode=DEFAULT_MATCH_MODE):
+        """Додає термін; повертає його ID (None, якщо в терміні немає слів)"""
+        if mode not in MATCH_MODES:
+            raise ValueError(f"невідомий режим збігу '{mode}', очікується одне з {', '.join(MATCH_MODES)}")
+
+        tokens = tuple(tokenize(term))
+        if not tokens:
+            return None
+        if mode == 'stem':
+            tokens = tuple(stem(token) for token in tokens)
+
+        key = (mode, tokens)
+        term_id = self._term_ids.get(key)
+        if term_id is None:
+            term_id = len(self.terms)
+            self._term_ids[key] = term_id
+            self.terms.append(key)
+            self._first[mode].setdefault(tokens[0], []).append(term_id)
+            if mode == 'prefix':
+                self._prefix_lengths = tuple(sorted({*self._prefix_lengths, len(tokens[0])}))
+        return term_id
+
+    @staticmethod
+    def _token_matches(mode, term_token, token):
+        if mode == 'exact':
+            return token == term_token
+        if mode == 'prefix':
+            return token.startswith(term_token)
+        return stem(token) == term_token
+
+    def _rest_matches(self, term_id, tokens, index):
+        mode, term = self.terms[term_id]
+        if len(term) == 1:
+            return True
+        if index + len(term) > len(tokens):
+            return False
+        return all(
+            self._token_matches(mode, term_token, tokens[index + offset])
+            for offset, term_token in enumerate(term[1:], 1)
+        )
+
+    def scan(self, tokens):
+        """Позиції знайдених термінів у списку слів: {term_id: [позиція, ...]}"""
+        positions = {}
+        exact, prefix, stemmed = self._first['exact'], self._first['prefix'], self._first['stem']
+        prefix_lengths = self._prefix_lengths
+
+        for index, token in enumerate(tokens):
+            candidates = exact.get(token)
+            if stemmed:
+                stem_hits = stemmed.get(stem(token))
+                if stem_hits:
+                    candidates = candidates + stem_hits if candidates else stem_hits
+            for length in prefix_lengths:
+                if length > len(token):
+                    break
+                prefix_hits = prefix.get(token[:length])
+                if prefix_hits:
+                    candidates = candidates + prefix_hits if candidates else prefix_hits
+            if not candidates:
+                continue
+
+            for term_id in candidates:
+                if self._rest_matches(term_id, tokens, index):
+                    positions.setdefault(term_id, []).append(index)
+        return positions
+
+    def scan_text(self, text):
+        return self.scan(tokenize(text))
@@ -0,0 +1,175 @@
+from collections import OrderedDict, deque
+from datetime import datetime
+import time
+import uuid
+
+# Інтервали, для яких рахуються перцентилі: (назва, початкова мітка, кінцева мітка)
+TRACE_SPANS = (
+    ("post_to_fetch", "posted", "fetched"),
+    ("fetch_to_match", "fetched", "matched"),
+    ("match_to_enqueue", "matched", "enqueued"),
+    ("enqueue_to_first_send", "enqueued", "first_sent"),
+    ("post_to_first_send", "posted", "first_sent"),
+    ("post_to_last_send", "posted", "last_sent"),
+)
+
+PERCENTILES = (50, 90, 99)
+
+
+def parse_post_date(value):
+    """Час публікації поста (ISO-рядок з Telethon) у секундах epoch або None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class MessageTrace:
+    __slots__ = ('trace_id', 'channel_id', 'message_id', 'stamps', 'recipients', 'delivered', 'failed', 'message_keys')
+
+    def __init__(self, trace_id, channel_id, message_id):
+        self.trace_id = trace_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.stamps = {}
+        self.recipients = 0
+        self.delivered = 0
+        self.failed = 0
+        self.message_keys = []
+
+
+class TraceRecorder:
+    """
+    Трасування шляху поста від публікації в каналі до доставки користувачам.
+    Кожне отримане повідомлення отримує trace_id та мітки часу (epoch) на етапах
+    fetched, matched, enqueued, first_sent, last_sent; posted береться з дати поста.
+    Завершені інтервали зберігаються у ковзних вікнах (window останніх значень)
+    для перцентилів; активні трейси обмежені max_traces (найстаріші витісняються).
+    """
+
+    def __init__(self, max_traces=2000, window=1000):
+        self.max_traces = int(max_traces)
+        self._traces = OrderedDict()
+        self._by_message_key = {}
+        self._spans = {name: deque(maxlen=int(window)) for name, _start, _end in TRACE_SPANS}
+        self.started = 0
+        self.completed = 0
+
+    def start(self, channel_id, message_id, posted_at=None):
+        """Створює трейс для отриманого повідомлення; повертає trace_id"""
+        trace_id = uuid.uuid4().hex[:16]
+        trace = MessageTrace(trace_id, channel_id, message_id)
+        trace.stamps['fetched'] = time.time()
+        if posted_at is not None:
+            trace.stamps['posted'] = posted_at
+        self._traces[trace_id] = trace
+        self.started += 1
+        self._record_span(trace, 'fetched')
+
+        while len(self._traces) > self.max_traces:
+            _trace_id, old = self._traces.popitem(last=False)
+            self._forget(old)
+        return trace_id
+
+    def _forget(self, trace):
+        for message_key in trace.message_keys:
+            self._by_message_key.pop(message_key, None)
+
+    def _record_span(self, trace, stamp):
+        for name, start, end in TRACE_SPANS:
+            if end == stamp and start in trace.stamps:
+                self._spans[name].append(max(0.0, trace.stamps[end] - trace.stamps[start]))
+
+    def stamp(self, trace_id, stamp):
+        trace = self._traces.get(trace_id)
+        if trace is None or stamp in trace.stamps:
+            return
+        trace.stamps[stamp] = time.time()
+        self._record_span(trace, stamp)
+
+    def discard(self, trace_id):
+        """Трейс повідомлення, яке не стало сповіщенням"""
+        trace = self._traces.pop(trace_id, None)
+        if trace is not None:
+            self._forget(trace)
+
+    def enqueued(self, trace_id, message_key, recipients):
+        trace = self._traces.get(trace_id)
+        if trace is None:
+            return
+        if recipients <= 0:
+            self.discard(trace_id)
+            return
+        trace.recipients += recipients
+        trace.message_keys.append(message_key)
+        self._by_message_key[message_key] = trace_id
+        self.stamp(trace_id, 'enqueued')
+
+    def delivered(self, sent_keys, failed_keys=()):
+        """
+        Фіксує результати відправки; sent_keys та failed_keys - ключі черги сповіщень
+        (по одному на доставку). Трейс завершується, коли відомий результат для всіх одержувачів
+        """
+        now = time.time()
+        for message_key, sent in [(key, True) for key in sent_keys] + [(key, False) for key in failed_keys]:
+            trace = self._traces.get(self._by_message_key.get(message_key))
+            if trace is None:
+                continue
+            if sent:
+                trace.delivered += 1
+                if 'first_sent' not in trace.stamps:
+                    trace.stamps['first_sent'] = now
+                    self._record_span(trace, 'first_sent')
+            else:
+                trace.failed += 1
+
+            if trace.delivered + trace.failed >= trace.recipients:
+                if trace.delivered:
+                    trace.stamps['last_sent'] = now
+                    self._record_span(trace, 'last_sent')
+                self.completed += 1
+                del self._traces[trace.trace_id]
+                self._forget(trace)
+
+    def summary(self):
+        """Перцентилі інтервалів (секунди) за останні завершені трейси"""
+        spans = {}
+        for name, values in self._spans.items():
+            ordered = sorted(values)
+            spans[name] = {
+                "count": len(ordered),
+                **{f"p{p}": round(percentile(ordered, p), 3) if ordered else None for p in PERCENTILES},
+                "max": round(ordered[-1], 3) if ordered else None
+            }
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "active": len(self._traces),
+            "spans": spans
+        }
+
+    def format_report(self):
+        """Короткий текстовий звіт для адміністратора"""
+        summary = self.summary()
+        lines = [
+            "Затримка сповіщень",
+            f"Трейсів: {summary['started']}, завершено: {summary['completed']}, активних: {summary['active']}",
+            ""
+        ]
+        for name, span in summary['spans'].items():
+            if not span['count']:
+                continue
+            lines.append(
+                f"•{name}: p50 {span['p50']} с, p90 {span['p90']} с, p99 {span['p99']} с, max {span['max']} с"
+                f" (n={span['count']})"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,78 @@
+from functools import lru_cache
+import re
+import unicodedata
+
+# Варіанти апострофа, що трапляються в українських текстах, зводяться до звичайного '
+_APOSTROPHES = "’ʼ‘`′ʹ＇"
+# Латинські літери, що виглядають як кириличні (після casefold)
+_HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'c': 'с', 'e': 'е', 'i': 'і', 'o': 'о', 'p': 'р',
+    'x': 'х', 'y': 'у', 'k': 'к', 'ï': 'ї'
+})
+_COMBINING_ACCENT = '́'
+
+_TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+_LATIN_RUN_RE = re.compile(r'[a-z]+')
+_CYRILLIC_LETTERS = frozenset('абвгґдеєжзиіїйклмнопрстуфхцчшщьюяыэъё')
+# Слова, в яких є і кирилиця, і латиниця
+_MIXED_WORD_RE = re.compile(r"\b(?=\w*[а-яіїєґ])(?=\w*[a-z])\w+")
+
+# Закінчення, що відкидаються при визначенні основи слова (від довших до коротших)
+_ENDINGS = sorted({
+    # дієслова
+    'ється', 'еться', 'ються', 'аться', 'яться', 'иться', 'іться',
+    'ати', 'яти', 'ити', 'іти', 'ують', 'юють', 'ють', 'ать', 'ять', 'ить', 'іть',
+    'ємо', 'емо', 'имо', 'ете', 'ите', 'ує',
+    # іменники та прикметники
+    'ами', 'ями', 'ові', 'еві', 'єві', 'ими', 'іми', 'ого', 'ому', 'ої',
+    'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'єм', 'ів', 'їв', 'ей', 'ою', 'ею', 'єю',
+    'ий', 'ій', 'их', 'іх', 'им', 'ім', 'ая', 'яя', 'ую', 'юю',
+    'а', 'я', 'о', 'е', 'є', 'у', 'ю', 'і', 'ї', 'и', 'ь'
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def normalize_text(text):
+    """Регістр, наголоси, варіанти апострофа та латинські двійники в кириличних словах"""
+    text = text.casefold()
+    # str.replace для кожного варіанта значно швидший за str.translate на довгих текстах
+    for apostrophe in _APOSTROPHES:
+        if apostrophe in text:
+            text = text.replace(apostrophe, "'")
+    if not text.isascii():
+        # Наголос може бути окремим символом або складеним з літерою (é); й та ї при цьому зберігаються
+        text = unicodedata.normalize('NFD', text)
+        if _COMBINING_ACCENT in text:
+            text = text.replace(_COMBINING_ACCENT, '')
+        text = unicodedata.normalize('NFC', text)
+        if _has_mixed_words(text):
+            text = _MIXED_WORD_RE.sub(lambda match: match.group(0).translate(_HOMOGLYPHS), text)
+    return text
+
+
+def _has_mixed_words(text):
+    # Швидка перевірка: латинські фрагменти (зазвичай лише посилання) межують з кирилицею
+    for match in _LATIN_RUN_RE.finditer(text):
+        start, end = match.span()
+        if (start and text[start - 1] in _CYRILLIC_LETTERS) or (end < len(text) and text[end] in _CYRILLIC_LETTERS):
+            return True
+    return False
+
+
+def tokenize(text):
+    """
+    Нормалізовані слова тексту: апостроф усередині слова не розриває його ("м'ясо"),
+    латинські літери в кириличному слові замінюються двійниками ("Kиїв" з латинською K -> "київ")
+    """
+    if not text:
+        return []
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+@lru_cache(maxsize=65536)
+def stem(token):
+    """Легка основа слова: відкидається одне відмінкове/особове закінчення, основа не коротша за 3 літери"""
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM_LENGTH:
+            return token[:-len(ending)]
+    return token
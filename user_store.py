@@ -0,0 +1,395 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from metrics import USER_STORE_FLUSH_SECONDS, USER_STORE_FLUSH_ERRORS, USER_STORE_WRITES
+from ua_text import stem, tokenize
+
+logger = logging.getLogger(__name__)
+
+USERS_STORE_FILE = "users.db"
+LEGACY_USERS_DB_FILE = "users_db.json"
+
+# Типи підписок: на канал (ID з TargetChats) або на ключове слово
+SUBSCRIPTION_KINDS = ('channel', 'keyword')
+
+
+
+def message_words(text):
+    """Основи слів повідомлення для пошуку підписок на ключові слова"""
+    return {stem(token) for token in tokenize(text)}
+
+
+class UserStore:
+    """
+    Сховище користувачів: індексована множина в пам'яті та SQLite (WAL) на диску.
+    Разом з користувачами зберігаються їхні налаштування сповіщень (/on, /off),
+    підписки на канали та ключові слова (/subscribe) та курсори каналів
+    (ID останнього обробленого повідомлення), щоб перезапуск бота був непомітним для підписників.
+    Підписки тримаються як інвертований індекс (канал/слово -> множина користувачів),
+    тож одержувачі сповіщення визначаються перетином множин без перебору всіх користувачів.
+    Зміни застосовуються в пам'яті одразу, а на диск записуються пакетно
+    фоновою задачею (write-behind) у окремому потоці, не блокуючи event loop.
+    """
+
+    def __init__(self, db_path=USERS_STORE_FILE, legacy_json_path=LEGACY_USERS_DB_FILE, flush_interval=1.0):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self.flush_interval = float(flush_interval)
+        self._users = set()
+        self._pending_add = set()
+        self._pending_remove = set()
+        # Користувачі з вимкненими сповіщеннями (зазвичай їх значно менше, ніж усіх)
+        self._disabled = set()
+        self._pending_flags = {}
+        self._cursors = {}
+        self._pending_cursors = {}
+        # Інвертований індекс підписок {(kind, value): {user_id}} та підписки кожного користувача
+        self._subscribers = {}
+        self._user_subscriptions = {}
+        self._subscribed = {kind: set() for kind in SUBSCRIPTION_KINDS}
+        self._pending_subscriptions = {}
+        # Користувачі з увімкненими сповіщеннями без підписок - отримують усі сповіщення
+        self._unfiltered = set()
+        self._conn = None
+        self._flush_lock = asyncio.Lock()
+        self._dirty = None
+        self._flush_task = None
+
+    def load(self):
+        """Відкриває базу та завантажує всіх користувачів у пам'ять (синхронно)"""
+        if self._conn is not None:
+            return
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS channel_cursors (channel_id TEXT PRIMARY KEY, last_message_id INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "user_id INTEGER NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, kind, value))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        if 'notifications' not in columns:
+            self._conn.execute("ALTER TABLE users ADD COLUMN notifications INTEGER NOT NULL DEFAULT 1")
+        self._conn.commit()
+
+        for user_id, notifications in self._conn.execute("SELECT user_id, notifications FROM users"):
+            self._users.add(user_id)
+            if not notifications:
+                self._disabled.add(user_id)
+        self._cursors = dict(self._conn.execute("SELECT channel_id, last_message_id FROM channel_cursors"))
+        subscription_count = 0
+        for user_id, kind, value in self._conn.execute("SELECT user_id, kind, value FROM subscriptions"):
+            if user_id in self._users and kind in SUBSCRIPTION_KINDS:
+                self._index_subscription(user_id, kind, value)
+                subscription_count += 1
+
+        if not self._users:
+            self._import_legacy_json()
+
+        self._unfiltered = {
+            user_id for user_id in self._users
+            if user_id not in self._disabled and user_id not in self._user_subscriptions
+        }
+
+        logger.info(
+            f"Завантажено користувачів: {len(self._users)} (сповіщення вимкнено: {len(self._disabled)}), "
+            f"підписок: {subscription_count}, курсорів каналів: {len(self._cursors)}"
+        )
+
+    def _import_legacy_json(self):
+        """Одноразовий перенос користувачів зі старого users_db.json"""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+
+        try:
+            with open(self.legacy_json_path, 'r') as f:
+                legacy_users = json.load(f).get("users", [])
+        except Exception as e:
+            logger.error(f"Не вдалося прочитати {self.legacy_json_path}: {str(e)}")
+            return
+
+        self._users = {int(user_id) for user_id in legacy_users}
+        self._conn.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)", [(u,) for u in self._users])
+        self._conn.commit()
+        os.replace(self.legacy_json_path, self.legacy_json_path + ".migrated")
+        logger.info(f"Перенесено {len(self._users)} користувачів з {self.legacy_json_path}")
+
+    async def open(self):
+        """Завантаження у фоновому потоці та запуск фонового запису змін"""
+        await asyncio.to_thread(self.load)
+        if self._flush_task is None or self._flush_task.done():
+            self._dirty = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def users(self):
+        """Знімок списку користувачів"""
+        return list(self._users)
+
+    def notifications_enabled(self, user_id):
+        return user_id not in self._disabled
+
+    def enabled_users(self):
+        """Користувачі з увімкненими сповіщеннями"""
+        if not self._disabled:
+            return list(self._users)
+        return [user_id for user_id in self._users if user_id not in self._disabled]
+
+    def set_notifications(self, user_id, enabled):
+        """Зберігає налаштування сповіщень користувача (додає його, якщо ще немає)"""
+        self.add(user_id)
+        if enabled == (user_id not in self._disabled):
+            return
+        if enabled:
+            self._disabled.discard(user_id)
+        else:
+            self._disabled.add(user_id)
+        self._refresh_unfiltered(user_id)
+        self._pending_flags[user_id] = enabled
+        self._mark_dirty()
+
+    def _refresh_unfiltered(self, user_id):
+        if user_id in self._users and user_id not in self._disabled and user_id not in self._user_subscriptions:
+            self._unfiltered.add(user_id)
+        else:
+            self._unfiltered.discard(user_id)
+
+    @staticmethod
+    def _index_key(kind, value):
+        # Слова індексуються за основою, тож підписка на "ракета" спрацьовує і на "ракети"
+        return (kind, stem(value)) if kind == 'keyword' else (kind, value)
+
+    def _index_subscription(self, user_id, kind, value):
+        self._subscribers.setdefault(self._index_key(kind, value), set()).add(user_id)
+        self._user_subscriptions.setdefault(user_id, set()).add((kind, value))
+        self._subscribed[kind].add(user_id)
+
+    def _unindex_subscription(self, user_id, kind, value):
+        index_key = self._index_key(kind, value)
+        subscribers = self._subscribers.get(index_key)
+        if subscribers is not None:
+            subscribers.discard(user_id)
+            if not subscribers:
+                del self._subscribers[index_key]
+
+        user_subscriptions = self._user_subscriptions.get(user_id)
+        if user_subscriptions is not None:
+            user_subscriptions.discard((kind, value))
+            if not any(sub_kind == kind for sub_kind, _value in user_subscriptions):
+                self._subscribed[kind].discard(user_id)
+            if not user_subscriptions:
+                del self._user_subscriptions[user_id]
+
+    @staticmethod
+    def _normalize_subscription(kind, value):
+        if kind not in SUBSCRIPTION_KINDS:
+            raise ValueError(f"Невідомий тип підписки: {kind}")
+        value = str(value).strip()
+        return ' '.join(tokenize(value)) if kind == 'keyword' else value
+
+    def subscribe(self, user_id, kind, value):
+        """Додає підписку (додає користувача, якщо ще немає); повертає True, якщо її ще не було"""
+        value = self._normalize_subscription(kind, value)
+        self.add(user_id)
+        if (kind, value) in self._user_subscriptions.get(user_id, ()):
+            return False
+        self._index_subscription(user_id, kind, value)
+        self._refresh_unfiltered(user_id)
+        self._pending_subscriptions[(user_id, kind, value)] = True
+        self._mark_dirty()
+        return True
+
+    def unsubscribe(self, user_id, kind, value):
+        """Видаляє підписку; повертає True, якщо вона була"""
+        value = self._normalize_subscription(kind, value)
+        if (kind, value) not in self._user_subscriptions.get(user_id, ()):
+            return False
+        self._unindex_subscription(user_id, kind, value)
+        self._refresh_unfiltered(user_id)
+        self._pending_subscriptions[(user_id, kind, value)] = False
+        self._mark_dirty()
+        return True
+
+    def clear_subscriptions(self, user_id):
+        """Видаляє всі підписки користувача; повертає їх кількість"""
+        subscriptions = list(self._user_subscriptions.get(user_id, ()))
+        for kind, value in subscriptions:
+            self.unsubscribe(user_id, kind, value)
+        return len(subscriptions)
+
+    def subscriptions(self, user_id):
+        """Підписки користувача: {kind: [value, ...]}"""
+        result = {kind: [] for kind in SUBSCRIPTION_KINDS}
+        for kind, value in self._user_subscriptions.get(user_id, ()):
+            result[kind].append(value)
+        return {kind: sorted(values) for kind, values in result.items()}
+
+    def has_channel_subscribers(self, channel_id):
+        """Чи є користувачі з підпискою на канал channel_id"""
+        return bool(self._subscribers.get(('channel', str(channel_id))))
+
+    def recipients(self, channel_id=None, words=()):
+        """
+        Одержувачі сповіщення про пост з каналу channel_id, що містить слова words.
+        words - основи слів поста (message_words). Користувачі без підписок отримують усе. Для решти кожен тип підписок,
+        який у них є, має спрацювати: канал - якщо підписані на канал, слово - якщо на будь-яке зі слів.
+        Обчислюється перетином множин з індексу, вартість залежить від кількості підписників, а не всіх користувачів
+        """
+        channel_hits = set(self._subscribers.get(('channel', str(channel_id)), ()))
+        keyword_hits = set()
+        for word in words:
+            subscribers = self._subscribers.get(('keyword', word))
+            if subscribers:
+                keyword_hits |= subscribers
+
+        candidates = channel_hits | keyword_hits
+        channel_ok = channel_hits | (candidates - self._subscribed['channel'])
+        keyword_ok = keyword_hits | (candidates - self._subscribed['keyword'])
+        matched = (channel_ok & keyword_ok) - self._disabled
+
+        return self._unfiltered | matched
+
+    def channel_cursors(self):
+        """Копія збережених курсорів {channel_id: last_message_id}"""
+        return dict(self._cursors)
+
+    def set_cursor(self, channel_id, message_id):
+        if self._cursors.get(channel_id) == message_id:
+            return
+        self._cursors[channel_id] = message_id
+        self._pending_cursors[channel_id] = message_id
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        if self._dirty is not None:
+            self._dirty.set()
+
+    def add(self, user_id):
+        """Додає користувача; повертає True, якщо його ще не було"""
+        if user_id in self._users:
+            return False
+        self._users.add(user_id)
+        self._refresh_unfiltered(user_id)
+        self._pending_remove.discard(user_id)
+        self._pending_add.add(user_id)
+        self._mark_dirty()
+        return True
+
+    def remove_many(self, user_ids):
+        """Видаляє користувачів; повертає кількість фактично видалених"""
+        removed = 0
+        for user_id in user_ids:
+            if user_id in self._users:
+                self._users.discard(user_id)
+                self._disabled.discard(user_id)
+                self._unfiltered.discard(user_id)
+                for kind, value in list(self._user_subscriptions.get(user_id, ())):
+                    self._unindex_subscription(user_id, kind, value)
+                self._pending_flags.pop(user_id, None)
+                self._pending_add.discard(user_id)
+                self._pending_remove.add(user_id)
+                removed += 1
+        if removed:
+            self._mark_dirty()
+        return removed
+
+    def _write_batch(self, to_add, to_remove, flags, cursors, subscriptions):
+        with self._conn:
+            if to_add:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, notifications) VALUES (?, ?)",
+                    [(u, 0 if u in self._disabled else 1) for u in to_add]
+                )
+            if flags:
+                self._conn.executemany(
+                    "UPDATE users SET notifications = ? WHERE user_id = ?",
+                    [(1 if enabled else 0, u) for u, enabled in flags.items()]
+                )
+            if subscriptions:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO subscriptions (user_id, kind, value) VALUES (?, ?, ?)",
+                    [key for key, subscribed in subscriptions.items() if subscribed]
+                )
+                self._conn.executemany(
+                    "DELETE FROM subscriptions WHERE user_id = ? AND kind = ? AND value = ?",
+                    [key for key, subscribed in subscriptions.items() if not subscribed]
+                )
+            if to_remove:
+                self._conn.executemany("DELETE FROM users WHERE user_id = ?", [(u,) for u in to_remove])
+                self._conn.executemany("DELETE FROM subscriptions WHERE user_id = ?", [(u,) for u in to_remove])
+            if cursors:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO channel_cursors (channel_id, last_message_id) VALUES (?, ?)",
+                    list(cursors.items())
+                )
+
+    async def flush(self):
+        """Записує накопичені зміни на диск одним пакетом"""
+        async with self._flush_lock:
+            if not (self._pending_add or self._pending_remove or self._pending_flags
+                    or self._pending_cursors or self._pending_subscriptions):
+                return
+            to_add, self._pending_add = self._pending_add, set()
+            to_remove, self._pending_remove = self._pending_remove, set()
+            flags, self._pending_flags = self._pending_flags, {}
+            cursors, self._pending_cursors = self._pending_cursors, {}
+            subscriptions, self._pending_subscriptions = self._pending_subscriptions, {}
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_batch, to_add, to_remove, flags, cursors, subscriptions)
+                USER_STORE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+                for kind, changes in (("users", len(to_add) + len(to_remove)), ("flags", len(flags)),
+                                      ("cursors", len(cursors)), ("subscriptions", len(subscriptions))):
+                    if changes:
+                        USER_STORE_WRITES.labels(kind).inc(changes)
+            except Exception as e:
+                USER_STORE_FLUSH_ERRORS.inc()
+                logger.error(f"Помилка запису стану у базу: {str(e)}")
+                # Повертаємо зміни в чергу, якщо їх не перекрили новіші
+                self._pending_add |= {u for u in to_add if u in self._users and u not in self._pending_remove}
+                self._pending_remove |= {u for u in to_remove if u not in self._users and u not in self._pending_add}
+                self._pending_flags = {**{u: f for u, f in flags.items() if u in self._users}, **self._pending_flags}
+                self._pending_cursors = {**cursors, **self._pending_cursors}
+                self._pending_subscriptions = {
+                    **{key: sub for key, sub in subscriptions.items() if key[0] in self._users},
+                    **self._pending_subscriptions
+                }
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            # Збираємо зміни за flush_interval в один пакет
+            await asyncio.sleep(self.flush_interval)
+            self._dirty.clear()
+            await self.flush()
+
+    async def close(self):
+        """Зупиняє фоновий запис, зберігає залишок змін і закриває базу"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._conn is not None:
+            await self.flush()
+            self._conn.close()
+            self._conn = None